@@ -21,11 +21,8 @@ import re
 import logging
 from datetime import datetime
 import calendar
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
-from os.path import expanduser
+
+from pyqso.preferences import preferences
 
 # ADIF field names and their associated data types available in PyQSO.
 AVAILABLE_FIELD_NAMES_TYPES = {"CALL": "S",
@@ -244,13 +241,7 @@ class ADIF:
         records = []
 
         # ADIF-related configuration options
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser("~/.config/pyqso/preferences.ini")) != [])
-        (section, option) = ("import_export", "merge_comment")
-        if(have_config and config.has_option(section, option) and config.getboolean(section, option)):
-            merge_comment = True
-        else:
-            merge_comment = False
+        merge_comment = preferences.getboolean("import_export", "merge_comment", fallback=False)
 
         # Separate the text at the <eor> or <eoh> markers.
         tokens = re.split("(<eor>|<eoh>)", text, flags=re.IGNORECASE)
@@ -324,10 +315,37 @@ class ADIF:
 
         assert n_eor == n_record
 
+        self.check_bands(records)
+
         logging.debug("Finished parsing text.")
 
         return records
 
+    def check_bands(self, records):
+        """ Fill in the BAND field of any records which have a FREQ but no BAND, and warn about records whose BAND does not match their FREQ. The bands of all the records are found in a single pass using the band plan.
+
+        :arg list records: The records (as returned by parse_adi), which are modified in place.
+        """
+        from pyqso.band_plan import bands_for_frequencies  # Imported here because the band_plan module depends on this one.
+
+        records = [r for r in records if "FREQ" in r]
+        bands = bands_for_frequencies([r["FREQ"] for r in records])
+        filled = 0
+        mismatched = 0
+        for (r, band) in zip(records, bands):
+            if(not band):
+                continue
+            if(not r.get("BAND")):
+                r["BAND"] = band
+                filled += 1
+            elif(r["BAND"] != band):
+                mismatched += 1
+        if(filled):
+            logging.debug("Filled in the BAND field of %d record(s) using the FREQ field." % filled)
+        if(mismatched):
+            logging.warning("The BAND field of %d record(s) does not match the FREQ field. The BAND field has been left as it is." % mismatched)
+        return
+
     def write(self, records, path):
         """ Write an ADIF file containing all the QSOs in the 'records' list.
 
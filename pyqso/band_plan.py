@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import csv
+import bisect
+import os.path
+
+from pyqso.adif import BANDS, BANDS_RANGES
+
+# An optional band plan which replaces the ADIF band definitions, e.g. to restrict the bands to those allocated in the user's IARU region.
+# Each row of the file holds a band (as named in the ADIF specification) and its lower and upper frequency bounds in MHz, under the headings "band", "lower" and "upper".
+BAND_PLAN_FILE = os.path.expanduser("~/.config/pyqso/band_plan.csv")
+
+
+class BandPlan:
+
+    """ The frequency range of each amateur radio band. The ranges are kept in sorted arrays, so that the band a frequency lies in can be found with a binary search. """
+
+    def __init__(self, ranges):
+        """ Sort the band ranges.
+
+        :arg list ranges: A list of (band, lower bound, upper bound) tuples, with the bounds in MHz.
+        :raises ValueError: If a band is not an ADIF band, a band's lower bound is above its upper bound, or two bands overlap.
+        """
+        ranges = sorted(ranges, key=lambda r: r[1])
+        for (band, lower, upper) in ranges:
+            if(band not in BANDS or band == ""):
+                raise ValueError("Unknown band '%s'." % band)
+            if(lower > upper):
+                raise ValueError("The lower bound of band '%s' is above its upper bound." % band)
+        for i in range(1, len(ranges)):
+            if(ranges[i][1] <= ranges[i-1][2]):
+                raise ValueError("Bands '%s' and '%s' overlap." % (ranges[i-1][0], ranges[i][0]))
+
+        self.bands = [r[0] for r in ranges]
+        self.lower = [r[1] for r in ranges]
+        self.upper = [r[2] for r in ranges]
+        return
+
+    def band_for_frequency(self, frequency):
+        """ Return the band that a frequency lies in.
+
+        :arg float frequency: The frequency in MHz.
+        :returns: The band (e.g. "20m"), or an empty string if the frequency is not in any band.
+        :rtype: str
+        """
+        i = bisect.bisect_right(self.lower, frequency) - 1
+        if(i >= 0 and frequency <= self.upper[i]):
+            return self.bands[i]
+        return ""
+
+    def bands_for_frequencies(self, frequencies):
+        """ Return the bands that many frequencies lie in, using a single vectorised search.
+
+        :arg frequencies: A sequence of frequencies in MHz. These may be numbers or strings, and empty or invalid frequencies (e.g. None) are allowed.
+        :returns: The band of each frequency, or an empty string for frequencies which are invalid or not in any band.
+        :rtype: list
+        """
+        import numpy
+        values = numpy.array([to_float(f) for f in frequencies], dtype=float)
+        if(len(values) == 0):
+            return []
+        indices = numpy.searchsorted(numpy.array(self.lower), values, side="right") - 1
+        found = (indices >= 0) & (values <= numpy.array(self.upper)[numpy.clip(indices, 0, None)])  # NaN (i.e. invalid) frequencies never compare as less than or equal.
+        names = numpy.array(self.bands, dtype=object)[numpy.clip(indices, 0, None)]
+        return list(numpy.where(found, names, ""))
+
+
+def to_float(frequency):
+    """ Convert a frequency to a floating-point number.
+
+    :arg frequency: The frequency, as a number or a string.
+    :returns: The frequency, or NaN if the frequency is empty or invalid.
+    :rtype: float
+    """
+    try:
+        return float(frequency)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def load_band_plan(path):
+    """ Load a band plan from a CSV file with the columns "band", "lower" and "upper" (the latter two in MHz).
+
+    :arg str path: The path to the CSV file.
+    :returns: The band plan.
+    :rtype: BandPlan
+    :raises IOError: If the file could not be read.
+    :raises ValueError: If the file does not hold a valid band plan.
+    """
+    with open(path) as f:
+        try:
+            ranges = [(row["band"].strip().lower(), float(row["lower"]), float(row["upper"])) for row in csv.DictReader(f)]
+        except (KeyError, AttributeError, TypeError):
+            raise ValueError("The band plan must have the columns 'band', 'lower' and 'upper'.")
+    return BandPlan(ranges)
+
+
+# The band plan given by the ADIF specification.
+ADIF_BAND_PLAN = BandPlan([(BANDS[i], BANDS_RANGES[i][0], BANDS_RANGES[i][1]) for i in range(1, len(BANDS))])
+
+band_plan = None  # The band plan in use. This is loaded when it is first needed.
+
+
+def get_band_plan():
+    """ Return the band plan in use. This is the band plan in ~/.config/pyqso/band_plan.csv if that file exists (and is valid), or the ADIF band plan otherwise.
+
+    :rtype: BandPlan
+    """
+    global band_plan
+    if(band_plan is None):
+        band_plan = ADIF_BAND_PLAN
+        if(os.path.exists(BAND_PLAN_FILE)):
+            try:
+                band_plan = load_band_plan(BAND_PLAN_FILE)
+                logging.info("Using the band plan in %s." % BAND_PLAN_FILE)
+            except (IOError, ValueError) as e:
+                logging.error("Could not load the band plan in %s. Using the ADIF band plan instead." % BAND_PLAN_FILE)
+                logging.exception(e)
+    return band_plan
+
+
+def band_for_frequency(frequency):
+    """ Return the band that a frequency lies in, according to the band plan in use.
+
+    :arg float frequency: The frequency in MHz.
+    :returns: The band (e.g. "20m"), or an empty string if the frequency is not in any band.
+    :rtype: str
+    """
+    return get_band_plan().band_for_frequency(frequency)
+
+
+def bands_for_frequencies(frequencies):
+    """ Return the bands that many frequencies lie in, according to the band plan in use.
+
+    :arg frequencies: A sequence of frequencies in MHz.
+    :returns: The band of each frequency, or an empty string for frequencies which are invalid or not in any band.
+    :rtype: list
+    """
+    return get_band_plan().bands_for_frequencies(frequencies)
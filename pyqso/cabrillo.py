@@ -18,15 +18,35 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from pyqso.band_plan import band_for_frequency
 
 CABRILLO_VERSION = "3.0"
 
+# The Cabrillo mode of each ADIF mode.
+# FIXME: Any other mode is assumed to be a non-CW digital mode (RY), which isn't always going to be the case (e.g. for AM).
+MODES = {"SSB": "PH", "CW": "CW", "FM": "FM"}
+
+# The ADIF mode of each Cabrillo mode. Digital (DG) QSOs do not say which digital mode was used.
+ADIF_MODES = {"PH": "SSB", "CW": "CW", "FM": "FM", "RY": "RTTY", "DG": ""}
+
+# The ADIF band of each Cabrillo band designator, which are used instead of the frequency from 50 MHz upwards.
+ADIF_BANDS = {"50": "6m", "70": "4m", "144": "2m", "222": "1.25m", "432": "70cm", "902": "33cm", "1.2G": "23cm", "2.3G": "13cm", "3.4G": "9cm", "5.7G": "6cm",
+              "10G": "3cm", "24G": "1.25cm", "47G": "6mm", "75G": "4mm", "122G": "2.5mm", "134G": "2mm", "241G": "1mm"}
+
+# The size of the buffer used when writing a Cabrillo file, in bytes.
+WRITE_BUFFER_SIZE = 1 << 16
+
+# The number of records added to a log at a time when importing a Cabrillo file.
+IMPORT_BATCH_SIZE = 1000
+
 CONTESTS = ["", "AP-SPRINT", "ARRL-10", "ARRL-160", "ARRL-222", "ARRL-DX-CW", "ARRL-DX-SSB", "ARRL-RR-PH", "ARRL-RR-DIG", "ARRL-RR-CW", "ARRL-SCR", "ARRL-SS-CW", "ARRL-SS-SSB", "ARRL-UHF-AUG", "ARRL-VHF-JAN", "ARRL-VHF-JUN", "ARRL-VHF-SEP", "ARRL-RTTY", "BARTG-RTTY", "CQ-160-CW", "CQ-160-SSB", "CQ-WPX-CW", "CQ-WPX-RTTY", "CQ-WPX-SSB", "CQ-VHF", "CQ-WW-CW", "CQ-WW-RTTY", "CQ-WW-SSB", "DARC-WAEDC-CW", "DARC-WAEDC-RTTY", "DARC-WAEDC-SSB", "DL-DX-RTTY", "DRCG-WW-RTTY", "FCG-FQP", "IARU-HF", "JIDX-CW", "JIDX-SSB", "NAQP-CW", "NAQP-SSB", "NA-SPRINT-CW", "NA-SPRINT-SSB", "NCCC-CQP", "NEQP", "OCEANIA-DX-CW", "OCEANIA-DX-SSB", "RDXC", "RSGB-IOTA", "SAC-CW", "SAC-SSB", "STEW-PERRY", "TARA-RTTY"]
 
 
 class Cabrillo:
 
-    """ The Cabrillo class supplies methods for writing log files in the Cabrillo format (v3.0).
+    """ The Cabrillo class supplies methods for reading and writing log files in the Cabrillo format (v3.0).
     For more information, visit http://wwrof.org/cabrillo/ """
 
     def __init__(self):
@@ -34,72 +54,199 @@ class Cabrillo:
         return
 
     def write(self, records, path, contest="", mycall=""):
-        """ Write a list of QSO records to a file in the Cabrillo format.
+        """ Write QSO records to a file in the Cabrillo format. The records are written as they are iterated over, so they can be streamed straight from a database cursor (e.g. via Log.iter_records) without being held in memory.
 
-        :arg list records: The list of QSO records to write.
+        :arg records: An iterable of QSO records to write.
         :arg str path: The desired path of the Cabrillo file to write to.
         :arg str contest: The name of the contest.
         :arg str mycall: The callsign used during the contest.
-        :returns: None
+        :returns: The number of QSOs written.
+        :rtype: int
         :raises IOError: If the Cabrillo file cannot be written (e.g. due to lack of write permissions)."""
 
         logging.debug("Writing records to a Cabrillo file...")
 
-        with open(path, mode='w', errors="replace") as f:  # Open file for writing
+        count = 0
+        with open(path, mode='w', errors="replace", buffering=WRITE_BUFFER_SIZE) as f:  # Open file for writing
 
             # Header
-            f.write("""START-OF-LOG: %s\n""" % (CABRILLO_VERSION))
-            f.write("""CREATED-BY: PyQSO v1.1.0\n""")
-            f.write("""CALLSIGN: %s\n""" % (mycall))
-            f.write("""CONTEST: %s\n""" % (contest))
+            f.write("START-OF-LOG: %s\nCREATED-BY: PyQSO v1.1.0\nCALLSIGN: %s\nCONTEST: %s\n" % (CABRILLO_VERSION, mycall, contest))
 
             # Write each record to the file.
+            write = f.write
             for r in records:
+                write(self.format_qso(r, mycall))
+                count += 1
 
-                # Frequency. Note that this must be in kHz. The frequency is stored in MHz in the database, so it's converted to kHz here.
-                try:
-                    freq = str(float(r["FREQ"])*1e3)
-                except ValueError:
-                    freq = ""
-
-                # Mode
-                if(r["MODE"] == "SSB"):
-                    mo = "PH"
-                elif(r["MODE"] == "CW"):
-                    mo = "CW"
-                elif(r["MODE"] == "FM"):
-                    mo = "FM"
-                else:
-                    # FIXME: This assumes that the mode is any other non-CW digital mode, which isn't always going to be the case (e.g. for AM).
-                    mo = "RY"
-
-                # Date in yyyy-mm-dd format.
-                date = r["QSO_DATE"][0:4] + "-" + r["QSO_DATE"][4:6] + "-" + r["QSO_DATE"][6:8]
-
-                # Time
-                time = r["TIME_ON"]
-
-                # The callsign that was used when operating the contest station.
-                call_sent = mycall
-
-                # Exchange (the part sent to the distant station)
-                exch_sent = r["RST_SENT"]
-
-                # Callsign
-                call_rcvd = r["CALL"]
-
-                # Exchange (the part received from the distant station)
-                exch_rcvd = r["RST_RCVD"]
+            # Footer
+            write("END-OF-LOG:")
 
-                # Transmitter ID (must be 0 or 1, if applicable).
-                # FIXME: For now this has been hard-coded to 0.
-                t = "0"
+        logging.info("Wrote %d QSOs to %s in Cabrillo format." % (count, path))
 
-                f.write("""QSO: %s %s %s %s %s %s %s %s %s\n""" % (freq, mo, date, time, call_sent, exch_sent, call_rcvd, exch_rcvd, t))
+        return count
 
-            # Footer
-            f.write("END-OF-LOG:")
+    def format_qso(self, r, mycall):
+        """ Format a QSO record as a line of a Cabrillo file.
 
-            logging.info("Wrote %d QSOs to %s in Cabrillo format." % (len(records), path))
+        :arg r: The QSO record.
+        :arg str mycall: The callsign used during the contest.
+        :returns: The QSO line, including the trailing newline.
+        :rtype: str
+        """
+
+        # Frequency. Note that this must be in kHz. The frequency is stored in MHz in the database, so it's converted to kHz here.
+        try:
+            freq = str(float(r["FREQ"])*1e3)
+        except (TypeError, ValueError):
+            freq = ""
+
+        # Date in yyyy-mm-dd format.
+        date = r["QSO_DATE"] or ""
+        date = "%s-%s-%s" % (date[0:4], date[4:6], date[6:8])
+
+        # The fields are: frequency, mode, date, time, the callsign that was used when operating the contest station, the exchange sent to the distant station, the callsign and exchange received from the distant station, and the transmitter ID (must be 0 or 1, if applicable).
+        # FIXME: The transmitter ID has been hard-coded to 0 for now.
+        return "QSO: %s %s %s %s %s %s %s %s 0\n" % (freq, MODES.get(r["MODE"], "RY"), date, r["TIME_ON"], mycall, r["RST_SENT"], r["CALL"], r["RST_RCVD"])
+
+    def read(self, path, header=None):
+        """ Read a Cabrillo file and parse it.
+
+        :arg str path: The path to the Cabrillo file to read.
+        :arg dict header: If given, the header tags of the file (e.g. CALLSIGN and CONTEST) are stored in this dictionary.
+        :returns: A list of dictionaries (one dictionary per QSO), with each dictionary containing ADIF field-value pairs.
+        :rtype: list
+        :raises IOError: If the Cabrillo file does not exist or cannot be read (e.g. due to lack of read permissions).
+        """
+        records = list(self.iter_records(path, header))
+        if(records == []):
+            logging.warning("No records found in the file. Empty file or wrong file type?")
+        logging.info("Read %d QSOs from %s in Cabrillo format." % (len(records), path))
+        return records
+
+    def iter_records(self, path, header=None):
+        """ Read a Cabrillo file one line at a time, and yield each QSO as soon as it is parsed. Lines which cannot be parsed are skipped.
+
+        :arg str path: The path to the Cabrillo file to read.
+        :arg dict header: If given, the header tags of the file (e.g. CALLSIGN and CONTEST) are stored in this dictionary as they are read.
+        :returns: An iterator over the QSOs, each represented by a dictionary of ADIF field-value pairs.
+        :raises IOError: If the Cabrillo file does not exist or cannot be read (e.g. due to lack of read permissions).
+        """
+        logging.debug("Reading in Cabrillo file with path: %s..." % path)
+        with open(path, mode="r", errors="replace") as f:
+            for (number, line) in enumerate(f, start=1):
+                (tag, separator, value) = line.partition(":")
+                if(not separator):
+                    continue
+                tag = tag.strip().upper()
+                if(tag == "QSO"):
+                    try:
+                        yield self.parse_qso(value)
+                    except ValueError as e:
+                        logging.warning("Could not parse line %d of %s: %s" % (number, path, e))
+                elif(tag == "END-OF-LOG"):
+                    break
+                elif(header is not None and tag != "X-QSO"):  # Excluded QSOs (X-QSO) are not scored, so they are ignored.
+                    if(tag in header):
+                        header[tag] = (header[tag] + " " + value.strip()).strip()  # Some tags (e.g. ADDRESS and SOAPBOX) can be repeated.
+                    else:
+                        header[tag] = value.strip()
+        return
 
+    def parse_qso(self, line):
+        """ Parse the fields of a QSO line (after the "QSO:" tag). The sent and received exchanges are assumed to have the same number of parts, which is true of every contest's template.
+
+        :arg str line: The fields of the QSO line: the frequency (in kHz) or band, the mode, the date, the time, the callsign and exchange sent, the callsign and exchange received, and (optionally) the transmitter ID.
+        :returns: The QSO, as a dictionary of ADIF field-value pairs. The exchanges are stored in the RST_SENT and RST_RCVD fields (as expected by the write method), and the callsign sent is stored in the STATION_CALLSIGN field. Note that a log has no STATION_CALLSIGN column, so this field is only available to callers of read and iter_records (e.g. for cross-checking), and is not kept by import_log.
+        :rtype: dict
+        :raises ValueError: If the line does not have enough fields, or the date or time is invalid.
+        """
+        fields = line.split()
+        if(len(fields) < 6):
+            raise ValueError("A QSO line needs at least 6 fields, but only %d were found." % len(fields))
+        (frequency, mode, date, time) = fields[0:4]
+        exchanges = fields[4:]
+        if(len(exchanges) % 2 == 1):
+            exchanges.pop()  # The transmitter ID.
+        n = len(exchanges)//2
+
+        date = date.replace("-", "")
+        time = time.replace(":", "").zfill(4)
+        if(len(date) != 8 or not date.isdigit() or len(time) != 4 or not time.isdigit()):
+            raise ValueError("Invalid date or time '%s %s'." % (fields[2], fields[3]))
+
+        record = {"QSO_DATE": date, "TIME_ON": time, "MODE": ADIF_MODES.get(mode.upper(), ""),
+                  "STATION_CALLSIGN": exchanges[0].upper(), "RST_SENT": " ".join(exchanges[1:n]),
+                  "CALL": exchanges[n].upper(), "RST_RCVD": " ".join(exchanges[n+1:])}
+
+        band = ADIF_BANDS.get(frequency.upper())
+        if(band is not None):
+            record["BAND"] = band
+        else:
+            try:
+                frequency = float(frequency)/1e3  # The frequency is in kHz in the Cabrillo file, but is stored in MHz in the database.
+            except ValueError:
+                raise ValueError("Invalid frequency '%s'." % fields[0])
+            record["FREQ"] = ("%.6f" % frequency).rstrip("0").rstrip(".")
+            record["BAND"] = band_for_frequency(frequency)
+        return record
+
+    def import_log(self, path, log, batch_size=IMPORT_BATCH_SIZE):
+        """ Read a Cabrillo file and add its QSOs to a log, in batches of records.
+        Only the fields that the log has columns for are kept. In particular, the callsign sent (STATION_CALLSIGN) is not stored, since every QSO in a Cabrillo file was made by the same station; the exchanges sent and received are kept in the RST_SENT and RST_RCVD fields.
+
+        :arg str path: The path to the Cabrillo file to read.
+        :arg Log log: The log to add the QSOs to.
+        :arg int batch_size: The number of records to add to the log at a time.
+        :returns: The number of QSOs added.
+        :rtype: int
+        :raises IOError: If the Cabrillo file does not exist or cannot be read.
+        :raises sqlite.Error: If the QSOs could not be added to the log.
+        """
+        count = 0
+        batch = []
+        for record in self.iter_records(path):
+            batch.append(record)
+            if(len(batch) == batch_size):
+                log.add_record(batch)
+                count += len(batch)
+                batch = []
+        if(batch):
+            log.add_record(batch)
+            count += len(batch)
+        logging.info("Imported %d QSOs from %s into log '%s'." % (count, path, log.name))
+        return count
+
+
+def read_file(path):
+    """ Read a Cabrillo file. This is run in a worker process by read_files.
+
+    :arg str path: The path to the Cabrillo file to read.
+    :returns: The path, the header tags, and the QSOs. If the file could not be read, the header tags and QSOs are both None.
+    :rtype: tuple
+    """
+    header = {}
+    try:
+        records = Cabrillo().read(path, header)
+    except (IOError, UnicodeError) as e:
+        logging.error("Could not read the Cabrillo file %s." % path)
+        logging.exception(e)
+        return (path, None, None)
+    return (path, header, records)
+
+
+def read_files(paths, workers=None):
+    """ Read many Cabrillo files concurrently, using a pool of worker processes.
+
+    :arg list paths: The paths to the Cabrillo files to read.
+    :arg int workers: The number of worker processes. By default, this is the number of processors.
+    :returns: An iterator over the (path, header tags, QSOs) tuple of each file, in the same order as the paths. The header tags and QSOs are both None for files that could not be read.
+    """
+    paths = list(paths)
+    if(len(paths) <= 1 or workers == 1):
+        for path in paths:
+            yield read_file(path)
         return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(read_file, paths):
+            yield result
+    return
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pyqso.callsign_lookup import LOOKUP_FIELD_NAMES, strip
+
+
+class RateLimiter:
+
+    """ Limit the rate at which requests are sent to a server, across any number of threads. """
+
+    def __init__(self, rate):
+        """ Set up the rate limiter.
+
+        :arg float rate: The maximum number of requests per second. If this is None or zero, the rate is not limited.
+        """
+        self.interval = (1.0/rate if rate else 0)
+        self.next = 0  # The earliest time at which the next request may be sent.
+        self.lock = threading.Lock()
+        return
+
+    def wait(self):
+        """ Block until another request may be sent. """
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if(delay > 0):
+            time.sleep(delay)
+        return
+
+
+class CallsignEnrichment:
+
+    """ Fill in the empty NAME, ADDRESS, STATE, COUNTRY, DXCC, CQZ, ITUZ and IOTA fields of the records in a log by looking up each distinct callsign in an online database.
+    The lookups are performed by a pool of worker threads (each with its own HTTP connection) at a limited rate, and the results are written to the log in batches, each in its own transaction. Fields that already contain data are never overwritten.
+    The job can be cancelled and started again later: records whose fields have already been filled in are skipped, and callsigns that have already been looked up (including those that could not be found) are answered by the lookup cache. """
+
+    def __init__(self, log, client, database, username, password, ignore_prefix_suffix=True, fields=None, workers=4, rate=2.0, batch_size=50):
+        """ Set up the job.
+
+        :arg Log log: The log to enrich.
+        :arg CallsignLookupClient client: The client used to log in to the callsign database, and whose cache is used.
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
+        :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
+        :arg list fields: The names of the fields to fill in. By default, all the fields returned by a callsign lookup are filled in.
+        :arg int workers: The maximum number of lookups in progress at any one time.
+        :arg float rate: The maximum number of requests per second sent to the callsign database.
+        :arg int batch_size: The number of callsigns whose results are written to the log in each transaction.
+        """
+        self.log = log
+        self.client = client
+        self.database = database
+        self.username = username
+        self.password = password
+        self.ignore_prefix_suffix = ignore_prefix_suffix
+        self.fields = (fields if fields is not None else LOOKUP_FIELD_NAMES)
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.cancelled = False
+        self.errors = []  # The error messages from all the lookups.
+        self.local = threading.local()  # Holds each worker thread's lookup handler.
+        return
+
+    def get_callsigns(self):
+        """ Return the distinct callsigns of the records which have at least one empty field.
+
+        :returns: The callsigns, in alphabetical order.
+        :rtype: list
+        :raises sqlite.Error: If the callsigns could not be retrieved from the database.
+        """
+        empty = " OR ".join(["%s IS NULL OR %s=''" % (field_name.lower(), field_name.lower()) for field_name in self.fields])
+        with self.log.connection:
+            c = self.log.connection.cursor()
+            c.execute("SELECT DISTINCT call FROM %s WHERE call IS NOT NULL AND call!='' AND (%s) ORDER BY call" % (self.log.name, empty))
+            return [row[0] for row in c.fetchall()]
+
+    def get_cached(self, call):
+        """ Return the cached details of a callsign, or None if it has not been looked up recently. """
+        if(self.client.cache is None):
+            return None
+        return self.client.cache.get(self.database, strip(call) if self.ignore_prefix_suffix else call)
+
+    def login(self):
+        """ Start a session with the callsign database, unless there is a valid session already. This is run by one of the worker threads.
+
+        :returns: True if there is a valid session, and False otherwise.
+        :rtype: bool
+        """
+        handler = self.client.get_handler(self.database)
+        with handler.lock:
+            handler.errors = self.errors
+            try:
+                return handler.is_connected(self.username, self.password) or handler.connect(self.username, self.password)
+            finally:
+                handler.errors = None
+
+    def lookup(self, call):
+        """ Look up a callsign. This is run by the worker threads.
+
+        :arg str call: The callsign, as it appears in the log.
+        :returns: The callsign and the data in a dictionary called fields_and_data.
+        :rtype: tuple
+        """
+        fields_and_data = self.get_cached(call)
+        if(fields_and_data is None and not self.cancelled):
+            handler = getattr(self.local, "handler", None)
+            if(handler is None):
+                handler = self.client.get_handler(self.database).clone()
+                handler.errors = self.errors
+                self.local.handler = handler
+            self.limiter.wait()
+            fields_and_data = handler.lookup(call, ignore_prefix_suffix=self.ignore_prefix_suffix)
+        return (call, fields_and_data)
+
+    def write(self, results):
+        """ Fill in the empty fields of the records with the results of the lookups, in a single transaction.
+
+        :arg list results: A list of (callsign, fields_and_data) tuples.
+        :returns: The number of fields that were filled in.
+        :rtype: int
+        :raises sqlite.Error: If the records could not be updated.
+        """
+        filled = 0
+        with self.log.connection:
+            c = self.log.connection.cursor()
+            for field_name in self.fields:
+                values = [(fields_and_data[field_name], call) for (call, fields_and_data) in results if fields_and_data is not None and fields_and_data.get(field_name)]
+                if(values):
+                    column = field_name.lower()
+                    c.executemany("UPDATE %s SET %s=? WHERE call=? AND (%s IS NULL OR %s='')" % (self.log.name, column, column, column), values)
+                    filled += c.rowcount
+        return filled
+
+    def run(self, progress=None):
+        """ Look up the callsigns and fill in the empty fields of the records. This blocks until all the callsigns have been looked up, or the job has been cancelled.
+
+        :arg progress: An optional function which is called regularly with the number of callsigns looked up so far and the total number of callsigns. This can be used to keep the user interface responsive.
+        :returns: The number of callsigns looked up, and the number of fields that were filled in.
+        :rtype: tuple
+        :raises sqlite.Error: If the log could not be read or updated.
+        """
+        self.cancelled = False
+        callsigns = self.get_callsigns()
+        total = len(callsigns)
+        logging.debug("Enriching %d callsign(s) in log '%s'..." % (total, self.log.name))
+
+        # Callsigns that are in the cache do not need to be handed to the worker threads.
+        results = []
+        pending = []
+        for call in callsigns:
+            fields_and_data = self.get_cached(call)
+            if(fields_and_data is not None):
+                results.append((call, fields_and_data))
+            else:
+                pending.append(call)
+        done = len(results)
+        filled = 0
+
+        if(pending):
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            futures = set()
+            try:
+                # Logging in is also left to the worker threads, so that the progress function keeps being called during the round trip to the server.
+                login = executor.submit(self.login)
+                while(not login.done() and not self.cancelled):
+                    wait([login], timeout=0.1)
+                    if(progress is not None):
+                        progress(done, total)
+                if(self.cancelled or not login.result()):
+                    pending = []
+
+                while((pending or futures) and not self.cancelled):
+                    # Only a few lookups are queued at any time, so that cancelling the job takes effect quickly.
+                    while(pending and len(futures) < 2*self.workers):
+                        futures.add(executor.submit(self.lookup, pending.pop(0)))
+                    (completed, futures) = wait(futures, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        try:
+                            results.append(future.result())
+                        except Exception as e:
+                            logging.exception(e)
+                        done += 1
+                    if(len(results) >= self.batch_size):
+                        filled += self.write(results)
+                        results = []
+                    if(progress is not None):
+                        progress(done, total)
+            finally:
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=login.done())  # If the job was cancelled while logging in, there are no lookups to wait for.
+                for future in futures:
+                    if(not future.cancelled() and future.exception() is None):
+                        results.append(future.result())
+                        done += 1
+
+        filled += self.write(results)
+        if(progress is not None):
+            progress(done, total)
+        logging.debug("Looked up %d callsign(s) and filled in %d field(s) in log '%s'." % (done, filled, self.log.name))
+        return (done, filled)
+
+    def cancel(self):
+        """ Stop the job. Any lookups that are in progress are completed, and their results are written to the log. """
+        self.cancelled = True
+        return
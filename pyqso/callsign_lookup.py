@@ -18,75 +18,367 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import sqlite3 as sqlite
+import base64
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os.path import expanduser
 try:
     import http.client as http_client
 except ImportError:
     import httplib as http_client
-from xml.dom import minidom
+from gi.repository import GLib
+import xml.etree.ElementTree as ElementTree
 try:
     from urllib.parse import quote
 except ImportError:
     from urllib import quote
 
 from pyqso.auxiliary_dialogs import error
+from pyqso.preferences import preferences
 
+CALLSIGN_LOOKUP_CACHE_FILE = expanduser("~/.config/pyqso/callsign_lookup.db")
 
-class CallsignLookupQRZ:
+# The time (in seconds) after which a request to a callsign database is abandoned.
+CALLSIGN_LOOKUP_TIMEOUT = 10
 
-    """ Use qrz.com to lookup details about a particular callsign. """
+# The fields that are filled in by a callsign lookup.
+LOOKUP_FIELD_NAMES = ["NAME", "ADDRESS", "STATE", "COUNTRY", "DXCC", "CQZ", "ITUZ", "IOTA"]
+
+
+class CallsignLookupCache:
+
+    """ A cache of callsign lookup results, so that a callsign which has been looked up recently does not need to be looked up online again. Lookups are answered by an in-memory LRU cache, and then by a persistent on-disk cache.
+    Callsigns that could not be found are also remembered (for a shorter time), so that they are not repeatedly looked up either. """
+
+    def __init__(self, path=CALLSIGN_LOOKUP_CACHE_FILE, ttl=30*24*3600, negative_ttl=24*3600, maximum_size=1024):
+        """ Connect to the on-disk cache.
+
+        :arg str path: The path of the SQLite database file used as the persistent cache. If None, nothing is persisted.
+        :arg float ttl: The time (in seconds) for which the details of a callsign are remembered.
+        :arg float negative_ttl: The time (in seconds) for which a callsign that could not be found is remembered.
+        :arg int maximum_size: The maximum number of entries in the in-memory LRU cache.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maximum_size = maximum_size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.connection = None
+        if(path is not None):
+            try:
+                # The cache may be used by more than one thread.
+                self.connection = sqlite.connect(path, check_same_thread=False)
+                with self.connection:
+                    self.connection.execute("CREATE TABLE IF NOT EXISTS lookups (database TEXT, callsign TEXT, data TEXT, time REAL, PRIMARY KEY (database, callsign))")
+            except sqlite.Error as e:
+                logging.error("Could not open the callsign lookup cache. Lookup results will not be remembered between sessions.")
+                logging.exception(e)
+                self.connection = None
+        return
 
-    def __init__(self, parent):
+    def get(self, database, callsign, now=None):
+        """ Return the cached details of a callsign, if they have not expired.
+
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :arg str callsign: The callsign, with any prefix/suffix already removed if desired.
+        :arg float now: The current time. By default, this is the current system time.
+        :returns: A copy of the cached fields_and_data dictionary (in which all fields are empty if the callsign could not be found), or None if the callsign is not in the cache.
+        :rtype: dict
+        """
+        if(now is None):
+            now = time.time()
+        key = (database, normalise(callsign))
+
+        with self.lock:
+            entry = self.lru.get(key)
+            if(entry is not None):
+                self.lru.move_to_end(key)
+
+        if(entry is None and self.connection is not None):
+            try:
+                with self.lock:
+                    c = self.connection.cursor()
+                    c.execute("SELECT data, time FROM lookups WHERE database=? AND callsign=?", key)
+                    result = c.fetchone()
+                if(result is not None):
+                    entry = (json.loads(result[0]) if result[0] is not None else None, result[1])
+                    self.remember(key, entry)
+            except (sqlite.Error, ValueError) as e:
+                logging.exception(e)
+
+        if(entry is None):
+            return None
+        (data, stored) = entry
+        if(now - stored > (self.ttl if data is not None else self.negative_ttl)):
+            return None  # Expired.
+        logging.debug("Found callsign %s in the lookup cache." % key[1])
+        fields_and_data = dict.fromkeys(LOOKUP_FIELD_NAMES, "")
+        if(data is not None):
+            fields_and_data.update(data)
+        return fields_and_data
+
+    def store(self, database, callsign, fields_and_data, now=None):
+        """ Store the details of a callsign in the cache.
+
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :arg str callsign: The callsign, with any prefix/suffix already removed if desired.
+        :arg dict fields_and_data: The details of the callsign, or None if the callsign could not be found.
+        :arg float now: The current time. By default, this is the current system time.
+        """
+        if(now is None):
+            now = time.time()
+        key = (database, normalise(callsign))
+        data = dict(fields_and_data) if fields_and_data is not None else None
+        self.remember(key, (data, now))
+        if(self.connection is not None):
+            try:
+                with self.lock:
+                    with self.connection:
+                        self.connection.execute("INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)", key + (json.dumps(data) if data is not None else None, now))
+            except sqlite.Error as e:
+                logging.exception(e)
+        return
+
+    def remember(self, key, entry):
+        """ Add an entry to the in-memory LRU cache, evicting the least recently used entry if the cache is full. """
+        with self.lock:
+            self.lru[key] = entry
+            self.lru.move_to_end(key)
+            while(len(self.lru) > self.maximum_size):
+                self.lru.popitem(last=False)
+        return
+
+    def clear(self):
+        """ Remove everything from the cache. """
+        with self.lock:
+            self.lru.clear()
+            if(self.connection is not None):
+                try:
+                    with self.connection:
+                        self.connection.execute("DELETE FROM lookups")
+                except sqlite.Error as e:
+                    logging.exception(e)
+        return
+
+
+class CallsignLookup:
+
+    """ The base class for the handlers that look up details about a particular callsign in an online database. The HTTP connection and the session key are kept between lookups, and a new session is started automatically when the old one expires. """
+
+    database = None  # The name of the callsign database.
+    host = None  # The host name of the database's XML server.
+    session_tag = None  # The name of the XML element that contains the session details...
+    key_tag = None  # ...and the session key...
+    error_tag = None  # ...and any error message.
+    record_tag = None  # The name of the XML element that contains the details of the callsign.
+    field_map = []  # The (XML element name, field name) pairs used to fill in the fields from the callsign's details. Elements that map to the same field are joined together, in this order.
+    separators = {"NAME": " ", "ADDRESS": ", "}  # The strings used to join several elements that map to the same field.
+    session_lifetime = None  # The time (in seconds) after which the server expires a session, if known.
+
+    def __init__(self, parent, cache=None):
         """ Initialise a new callsign lookup handler.
 
         :arg parent: The parent Gtk dialog.
+        :arg CallsignLookupCache cache: The cache of callsign lookup results. This is an optional argument.
         """
         self.parent = parent
+        self.cache = cache
         self.connection = None
         self.session_key = None
+        self.session_started = None
+        self.username = None
+        self.password = None
+        self.errors = None  # If this is a list, error messages are appended to it instead of being shown to the user.
+        self.lock = threading.RLock()  # The HTTP connection can only be used by one thread at a time.
         return
 
+    def clone(self):
+        """ Return a new handler for the same server which shares this handler's session, cache and login details, but has its own HTTP connection. This allows several lookups to run at the same time.
+
+        :returns: The new lookup handler.
+        """
+        with self.lock:
+            handler = self.__class__(self.parent, cache=self.cache)
+            handler.host = self.host
+            (handler.session_key, handler.session_started) = (self.session_key, self.session_started)
+            (handler.username, handler.password) = (self.username, self.password)
+        return handler
+
+    def create_connection(self):
+        """ Create a new (unconnected) HTTP connection to the server. """
+        return http_client.HTTPConnection(self.host, timeout=CALLSIGN_LOOKUP_TIMEOUT)
+
+    def report_error(self, message):
+        """ Show an error message to the user, or collect it if the lookup is running in a background thread (where Gtk dialogs cannot be shown).
+
+        :arg str message: The error message.
+        """
+        if(self.errors is not None):
+            logging.error(message)
+            self.errors.append(message)
+        else:
+            error(parent=self.parent, message=message)
+        return
+
+    def request(self, path):
+        """ Send a GET request to the server, re-using the existing connection if possible. If the server has closed the connection since the last request, the connection is re-opened and the request is sent again.
+
+        :arg str path: The path and query string to request.
+        :returns: The body of the response.
+        :rtype: bytes
+        :raises http_client.HTTPException, OSError: If the request could not be sent, or no response was received.
+        """
+        with self.lock:
+            for attempt in range(2):
+                if(self.connection is None):
+                    self.connection = self.create_connection()
+                try:
+                    self.connection.request("GET", path)
+                    return self.connection.getresponse().read()
+                except (http_client.HTTPException, OSError) as e:
+                    self.connection.close()
+                    self.connection = None
+                    if(attempt > 0):
+                        raise
+                    logging.debug("The connection to %s was lost (%s). Reconnecting..." % (self.host, e))
+
+    def get_login_path(self, username, password):
+        """ Return the path and query string used to start a new session. """
+        raise NotImplementedError
+
+    def get_lookup_path(self, callsign):
+        """ Return the path and query string used to look up a callsign. """
+        raise NotImplementedError
+
+    def parse(self, data):
+        """ Parse a response from the server in a single pass over the XML tree. The session and callsign elements are both direct children of the root element, so only their own children need to be visited.
+
+        :arg bytes data: The body of the response.
+        :returns: A dictionary with the text of each child of the session element (under "session"), and of each child of the callsign element, or None if there is no callsign element (under "record").
+        :rtype: dict
+        :raises ElementTree.ParseError: If the response is not valid XML.
+        """
+        response = {"session": {}, "record": None}
+        for element in ElementTree.fromstring(data):
+            tag = local_name(element.tag)
+            if(tag == self.session_tag):
+                target = response["session"]
+            elif(tag == self.record_tag):
+                target = response["record"] = {}
+            else:
+                continue
+            for child in element:
+                if(child.text is not None):
+                    target[local_name(child.tag)] = child.text
+        return response
+
     def connect(self, username, password):
-        """ Initiate a session with the qrz.com server. Hopefully this will provide a session key.
+        """ Initiate a session with the server. Hopefully this will provide a session key.
 
-        :arg str username: The username of the qrz.com user account.
-        :arg str password: The password of the qrz.com user account.
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
         :returns: True if a successful connection was made to the server, and False otherwise.
         :rtype: bool
         """
-        logging.debug("Connecting to the qrz.com server...")
+        logging.debug("Connecting to the %s server..." % self.database)
+
+        with self.lock:
+            # Connect to the server.
+            try:
+                session = self.parse(self.request(self.get_login_path(username, password)))["session"]
+            except Exception as e:
+                logging.exception(e)
+                self.report_error(message="Could not connect to the %s server. Check connection to the internets?" % self.database)
+                return False
+
+            # Get the session key.
+            if(self.key_tag in session):
+                self.session_key = session[self.key_tag]
+                self.session_started = time.time()
+                self.username = username
+                self.password = password
+                logging.debug("Successfully connected to the %s server. Session key is: %s." % (self.database, self.session_key))
+                connected = True
+            else:
+                self.session_key = None
+                connected = False
 
-        # Connect to the server.
-        try:
-            self.connection = http_client.HTTPConnection("xmldata.qrz.com")
-            request = "/xml/current/?username=%s;password=%s;agent=pyqso" % (username, quote(password))  # Percent-escape the password in case there are reserved characters present.
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
-        except Exception as e:
-            logging.exception(e)
-            error(parent=self.parent, message="Could not connect to the qrz.com server. Check connection to the internets?")
+            # If there are any errors or warnings, print them out.
+            if(self.error_tag in session):
+                self.report_error(message="%s session error: %s" % (self.database, session[self.error_tag]))
+
+        return connected
+
+    def is_connected(self, username, password):
+        """ Check whether there is a session (that has not yet expired) for the given login details.
+
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
+        :rtype: bool
+        """
+        return (self.session_key is not None and (username, password) == (self.username, self.password) and not self.session_expired())
+
+    def session_expired(self):
+        """ Check whether the session is about to expire (based on its lifetime, if known). """
+        if(self.session_lifetime is None or self.session_started is None):
             return False
+        return (time.time() - self.session_started > self.session_lifetime - 60)
 
-        # Get the session key.
-        xml_data = minidom.parseString(response.read())
-        session_node = xml_data.getElementsByTagName("Session")[0]  # There should only be one Session element.
-        session_key_node = session_node.getElementsByTagName("Key")
-        if(session_key_node):
-            self.session_key = session_key_node[0].firstChild.nodeValue
-            logging.debug("Successfully connected to the qrz.com server. Session key is: %s." % self.session_key)
-            connected = True
-        else:
-            connected = False
+    def query(self, callsign):
+        """ Send a lookup request for a callsign. If the server reports that the session has expired, a new session is started with the same login details and the request is sent again.
 
-        # If there are any errors or warnings, print them out.
-        session_error_node = session_node.getElementsByTagName("Error")
-        if(session_error_node):
-            session_error = session_error_node[0].firstChild.nodeValue
-            error(parent=self.parent, message="qrz.com session error: %s" % session_error)
+        :arg str callsign: The callsign to look up.
+        :returns: The parsed response (see the parse method), or None if the server could not be reached.
+        :rtype: dict
+        """
+        with self.lock:
+            try:
+                if(self.session_expired() and self.username is not None):
+                    self.connect(self.username, self.password)
+                response = self.parse(self.request(self.get_lookup_path(callsign)))
+                session_error = self.get_session_error(response)
+                if(session_error is not None and is_session_expired(session_error) and self.username is not None):
+                    logging.debug("The %s session has expired. Starting a new session..." % self.database)
+                    if(self.connect(self.username, self.password)):
+                        response = self.parse(self.request(self.get_lookup_path(callsign)))
+            except Exception as e:
+                logging.exception(e)
+                self.report_error(message="Could not look up the callsign on the %s server. Check connection to the internets?" % self.database)
+                return None
+        return response
+
+    def get_session_error(self, response):
+        """ Return the error message in the session element of a response, if there is one.
+
+        :arg dict response: The parsed response.
+        :returns: The error message, or None.
+        :rtype: str
+        """
+        return response["session"].get(self.error_tag)
 
-        return connected
+    def get_fields(self, record):
+        """ Fill in the fields using the handler's field_map.
+
+        :arg dict record: The text of each child of the callsign element.
+        :returns: The data in a dictionary called fields_and_data.
+        :rtype: dict
+        """
+        fields_and_data = dict.fromkeys(LOOKUP_FIELD_NAMES, "")
+        for (tag, field_name) in self.field_map:
+            if(tag in record):
+                if(fields_and_data[field_name]):
+                    fields_and_data[field_name] += self.separators.get(field_name, " ") + record[tag]
+                else:
+                    fields_and_data[field_name] = record[tag]
+        return fields_and_data
 
     def lookup(self, full_callsign, ignore_prefix_suffix=True):
-        """ Parse the XML tree that is returned from the qrz.com XML server to obtain the NAME, ADDRESS, STATE, COUNTRY, DXCC, CQZ, ITUZ, and IOTA field data (if present).
+        """ Look up a callsign and obtain the NAME, ADDRESS, STATE, COUNTRY, DXCC, CQZ, ITUZ, and IOTA field data (if present), using the handler's field_map.
 
         :arg str full_callsign: The callsign to look up (without any prefix/suffix stripping).
         :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
@@ -102,190 +394,358 @@ class CallsignLookupQRZ:
         else:
             callsign = full_callsign
 
+        # Recently looked-up callsigns are answered from the cache, without going online.
+        if(self.cache is not None):
+            fields_and_data = self.cache.get(self.database, callsign)
+            if(fields_and_data is not None):
+                return fields_and_data
+
         # Commence lookup.
-        fields_and_data = {"NAME": "", "ADDRESS": "", "STATE": "", "COUNTRY": "", "DXCC": "", "CQZ": "", "ITUZ": "", "IOTA": ""}
-        if(self.session_key):
-            request = "/xml/current/?s=%s;callsign=%s" % (self.session_key, callsign)
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
-
-            xml_data = minidom.parseString(response.read())
-            callsign_node = xml_data.getElementsByTagName("Callsign")
-            if(callsign_node):
-                callsign_node = callsign_node[0]  # There should only be a maximum of one Callsign element.
-
-                callsign_fname_node = callsign_node.getElementsByTagName("fname")
-                callsign_name_node = callsign_node.getElementsByTagName("name")
-                if(callsign_fname_node):
-                    fields_and_data["NAME"] = callsign_fname_node[0].firstChild.nodeValue
-                if(callsign_name_node):  # Add the surname, if present.
-                    fields_and_data["NAME"] = fields_and_data["NAME"] + " " + callsign_name_node[0].firstChild.nodeValue
-
-                callsign_addr1_node = callsign_node.getElementsByTagName("addr1")
-                callsign_addr2_node = callsign_node.getElementsByTagName("addr2")
-                if(callsign_addr1_node):
-                    fields_and_data["ADDRESS"] = callsign_addr1_node[0].firstChild.nodeValue
-                if(callsign_addr2_node):  # Add the second line of the address, if present.
-                    fields_and_data["ADDRESS"] = (fields_and_data["ADDRESS"] + ", " if callsign_addr1_node else "") + callsign_addr2_node[0].firstChild.nodeValue
-
-                callsign_state_node = callsign_node.getElementsByTagName("state")
-                if(callsign_state_node):
-                    fields_and_data["STATE"] = callsign_state_node[0].firstChild.nodeValue
-
-                callsign_country_node = callsign_node.getElementsByTagName("country")
-                if(callsign_country_node):
-                    fields_and_data["COUNTRY"] = callsign_country_node[0].firstChild.nodeValue
-
-                callsign_ccode_node = callsign_node.getElementsByTagName("ccode")
-                if(callsign_ccode_node):
-                    fields_and_data["DXCC"] = callsign_ccode_node[0].firstChild.nodeValue
-
-                callsign_cqzone_node = callsign_node.getElementsByTagName("cqzone")
-                if(callsign_cqzone_node):
-                    fields_and_data["CQZ"] = callsign_cqzone_node[0].firstChild.nodeValue
-
-                callsign_ituzone_node = callsign_node.getElementsByTagName("ituzone")
-                if(callsign_ituzone_node):
-                    fields_and_data["ITUZ"] = callsign_ituzone_node[0].firstChild.nodeValue
-
-                callsign_iota_node = callsign_node.getElementsByTagName("iota")
-                if(callsign_iota_node):
-                    fields_and_data["IOTA"] = callsign_iota_node[0].firstChild.nodeValue
+        fields_and_data = dict.fromkeys(LOOKUP_FIELD_NAMES, "")
+        response = self.query(callsign) if self.session_key else None
+        if(response is not None):
+            record = response["record"]
+            if(record is not None):
+                fields_and_data = self.get_fields(record)
+                if(self.cache is not None):
+                    self.cache.store(self.database, callsign, fields_and_data)
             else:
-                # If there is no Callsign element, then print out the error message in the Session element.
-                session_node = xml_data.getElementsByTagName("Session")
-                if(session_node):
-                    session_error_node = session_node[0].getElementsByTagName("Error")
-                    if(session_error_node):
-                        session_error = session_error_node[0].firstChild.nodeValue
-                        error(parent=self.parent, message=session_error)
+                # If there is no callsign element, then print out the error message in the session element.
+                session_error = self.get_session_error(response)
+                if(session_error is not None):
+                    if(self.cache is not None and is_not_found(session_error)):
+                        self.cache.store(self.database, callsign, None)
+                    self.report_error(message=session_error)
                 # Return empty strings for the field data.
             logging.debug("Callsign lookup complete. Returning data...")
         return fields_and_data
 
 
-class CallsignLookupHamQTH:
+class CallsignLookupQRZ(CallsignLookup):
+
+    """ Use qrz.com to lookup details about a particular callsign. """
+
+    database = "qrz.com"
+    host = "xmldata.qrz.com"
+    session_tag = "Session"
+    key_tag = "Key"
+    error_tag = "Error"
+    record_tag = "Callsign"
+    field_map = [("fname", "NAME"), ("name", "NAME"),  # The first name, followed by the surname.
+                 ("addr1", "ADDRESS"), ("addr2", "ADDRESS"),  # The first line of the address, followed by the second.
+                 ("state", "STATE"), ("country", "COUNTRY"), ("ccode", "DXCC"),
+                 ("cqzone", "CQZ"), ("ituzone", "ITUZ"), ("iota", "IOTA")]
+
+    def get_login_path(self, username, password):
+        return "/xml/current/?username=%s;password=%s;agent=pyqso" % (username, quote(password))  # Percent-escape the password in case there are reserved characters present.
+
+    def get_lookup_path(self, callsign):
+        return "/xml/current/?s=%s;callsign=%s" % (self.session_key, callsign)
+
+
+class CallsignLookupHamQTH(CallsignLookup):
 
     """ Use hamqth.com to lookup details about a particular callsign. """
 
-    def __init__(self, parent):
-        self.parent = parent
-        self.connection = None
-        self.session_id = None
-        return
+    database = "hamqth.com"
+    host = "www.hamqth.com"
+    session_tag = "session"
+    key_tag = "session_id"
+    error_tag = "error"
+    record_tag = "search"
+    field_map = [("nick", "NAME"),
+                 ("adr_street1", "ADDRESS"), ("adr_street2", "ADDRESS"),  # The first line of the address, followed by the second.
+                 ("us_state", "STATE"), ("country", "COUNTRY"),
+                 ("cq", "CQZ"), ("itu", "ITUZ"), ("iota", "IOTA")]
+    session_lifetime = 3600
 
-    def connect(self, username, password):
-        """ Initiate a session with the hamqth.com server. Hopefully this will provide a session key.
+    @property
+    def session_id(self):
+        """ The session ID (i.e. the session key). """
+        return self.session_key
 
-        :arg str username: The username of the hamqth.com user account.
-        :arg str password: The password of the hamqth.com user account.
-        :returns: True if a successful connection was made to the server, and False otherwise.
-        :rtype: bool
+    @session_id.setter
+    def session_id(self, value):
+        self.session_key = value
+
+    def create_connection(self):
+        return http_client.HTTPSConnection(self.host, timeout=CALLSIGN_LOOKUP_TIMEOUT)
+
+    def get_login_path(self, username, password):
+        return "/xml.php?u=%s&p=%s" % (username, quote(password))  # Percent-escape the password in case there are reserved characters present.
+
+    def get_lookup_path(self, callsign):
+        return "/xml.php?id=%s&callsign=%s&prg=pyqso" % (self.session_key, callsign)
+
+
+class CallsignLookupClient:
+
+    """ A process-wide callsign lookup client. One handler is kept per callsign database, so the session key is re-used by every lookup (rather than logging in again each time), and recently looked-up callsigns are answered from the cache.
+    Each thread sends its lookups over its own HTTP connection (using a clone of the handler), so a slow lookup in one thread does not hold up the lookups in the others. Only logging in is serialised. """
+
+    def __init__(self, cache=None):
+        """ Set up the client.
+
+        :arg CallsignLookupCache cache: The cache of callsign lookup results. This is an optional argument.
         """
+        self.cache = cache
+        self.handlers = {}
+        self.lock = threading.Lock()
+        self.workers = threading.local()  # Each thread's own handlers, keyed by callsign database.
+        return
 
-        logging.debug("Connecting to the hamqth.com server...")
+    def get_handler(self, database):
+        """ Return the lookup handler for a callsign database, creating it if necessary.
 
-        # Connect to the server.
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :returns: The lookup handler.
+        :raises ValueError: If the callsign database is not supported.
+        """
+        with self.lock:
+            handler = self.handlers.get(database)
+            if(handler is None):
+                if(database == "qrz.com"):
+                    handler = CallsignLookupQRZ(parent=None, cache=self.cache)
+                elif(database == "hamqth.com"):
+                    handler = CallsignLookupHamQTH(parent=None, cache=self.cache)
+                else:
+                    raise ValueError("Unknown callsign database: %s" % database)
+                self.handlers[database] = handler
+        return handler
+
+    def get_worker(self, database):
+        """ Return the calling thread's own lookup handler for a callsign database, creating it if necessary. This has its own HTTP connection, but shares the session of the handler returned by get_handler.
+
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :returns: The lookup handler.
+        :raises ValueError: If the callsign database is not supported.
+        """
+        handlers = getattr(self.workers, "handlers", None)
+        if(handlers is None):
+            handlers = self.workers.handlers = {}
+        worker = handlers.get(database)
+        if(worker is None):
+            worker = handlers[database] = self.get_handler(database).clone()
+        return worker
+
+    def lookup(self, database, username, password, full_callsign, ignore_prefix_suffix=True, parent=None, errors=None):
+        """ Look up a callsign, only logging in if there is no valid session for the given login details.
+
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
+        :arg str full_callsign: The callsign to look up (without any prefix/suffix stripping).
+        :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
+        :arg parent: The parent Gtk dialog for any error messages.
+        :arg list errors: If given, any error messages are appended to this list instead of being shown to the user. This must be given when looking up a callsign from a background thread.
+        :returns: The data in a dictionary called fields_and_data, or None if a session could not be started.
+        :rtype: dict
+        :raises ValueError: If the callsign database is not supported.
+        """
+        handler = self.get_handler(database)
+
+        # If the callsign has been looked up recently, there is no need to connect to the database at all.
+        if(self.cache is not None):
+            fields_and_data = self.cache.get(database, strip(full_callsign) if ignore_prefix_suffix else full_callsign)
+            if(fields_and_data is not None):
+                return fields_and_data
+
+        # The handler's lock is only held while logging in, and not for the lookup itself.
+        with handler.lock:
+            handler.parent = parent
+            handler.errors = errors
+            try:
+                if(not handler.is_connected(username, password)):
+                    if(not handler.connect(username, password)):
+                        return None
+                session = (handler.session_key, handler.session_started, handler.username, handler.password)
+            finally:
+                handler.errors = None
+
+        worker = self.get_worker(database)
+        (worker.session_key, worker.session_started, worker.username, worker.password) = session
+        worker.parent = parent
+        worker.errors = errors
         try:
-            self.connection = http_client.HTTPSConnection("www.hamqth.com")
-            request = "/xml.php?u=%s&p=%s" % (username, quote(password))  # Percent-escape the password in case there are reserved characters present.
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
-        except Exception as e:
-            logging.exception(e)
-            error(parent=self.parent, message="Could not connect to the hamqth.com server. Check connection to the internets?")
-            return False
+            fields_and_data = worker.lookup(full_callsign, ignore_prefix_suffix=ignore_prefix_suffix)
+        finally:
+            worker.errors = None
+
+        # If the session expired during the lookup, the new session is shared with the other threads.
+        with handler.lock:
+            if(worker.session_key is not None and worker.session_key != session[0] and handler.session_key == session[0]):
+                (handler.session_key, handler.session_started) = (worker.session_key, worker.session_started)
+        return fields_and_data
 
-        # Get the session ID.
-        xml_data = minidom.parseString(response.read())
-        session_node = xml_data.getElementsByTagName("session")[0]  # There should only be one Session element.
-        session_id_node = session_node.getElementsByTagName("session_id")
-        if(session_id_node):
-            self.session_id = session_id_node[0].firstChild.nodeValue
-            logging.debug("Successfully connected to the hamqth.com server. Session ID is: %s." % self.session_id)
-            connected = True
-        else:
-            connected = False
 
-        # If there are any errors or warnings, print them out.
-        session_error_node = session_node.getElementsByTagName("error")
-        if(session_error_node):
-            session_error = session_error_node[0].firstChild.nodeValue
-            error(parent=self.parent, message="hamqth.com session error: %s" % session_error)
+class AsyncCallsignLookup:
 
-        return connected
+    """ Look up callsigns in a pool of worker threads, so that the Gtk main loop is not blocked for the duration of the HTTP requests. Lookups can be prefetched (e.g. while the user is still typing the callsign), so that the result is usually ready by the time the user asks for it. Only the most recent lookup is of interest; the results of older lookups are discarded. """
 
-    def lookup(self, full_callsign, ignore_prefix_suffix=True):
-        """ Parse the XML tree that is returned from the hamqth.com XML server to obtain the NAME, ADDRESS, STATE, COUNTRY, DXCC, CQZ, ITUZ, and IOTA field data (if present),
+    def __init__(self, client, workers=2, delay=750):
+        """ Set up the worker threads.
+
+        :arg CallsignLookupClient client: The client used to perform the lookups.
+        :arg int workers: The number of worker threads.
+        :arg int delay: The time (in milliseconds) to wait after the last call to prefetch before starting the lookup.
+        """
+        self.client = client
+        self.delay = delay
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.generation = 0  # Incremented whenever a new lookup is requested, so that the results of older lookups can be ignored.
+        self.timer = None
+        self.future = None
+        self.request = None  # The arguments of the current lookup.
+        self.result = None  # The result of the current lookup (once complete), as a (fields_and_data, errors) tuple.
+        self.callback = None  # The function to call with the result of the current lookup.
+        return
 
+    def prefetch(self, database, username, password, full_callsign, ignore_prefix_suffix=True):
+        """ Schedule a lookup of a callsign in the background, once no other prefetch has been requested for a short time. Any earlier lookup is cancelled.
+
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
         :arg str full_callsign: The callsign to look up (without any prefix/suffix stripping).
         :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
-        :returns: The data in a dictionary called fields_and_data.
-        :rtype: dict
         """
+        request = (database, username, password, full_callsign, ignore_prefix_suffix)
+        if(request == self.request):
+            return
+        self.cancel()
+        self.request = request
+        self.timer = GLib.timeout_add(self.delay, self.on_timer, self.generation)
+        return
 
-        logging.debug("Looking up callsign. The full callsign (with a prefix and/or suffix) is %s." % full_callsign)
+    def lookup(self, database, username, password, full_callsign, callback, ignore_prefix_suffix=True):
+        """ Look up a callsign in the background. If the same callsign has already been prefetched, its result is re-used (or waited for, if the lookup is still running).
 
-        # Remove any prefix or suffix from the callsign before performing the lookup.
-        if(ignore_prefix_suffix):
-            callsign = strip(full_callsign)
-        else:
-            callsign = full_callsign
+        :arg str database: The name of the callsign database (e.g. "qrz.com").
+        :arg str username: The username of the user account.
+        :arg str password: The password of the user account.
+        :arg str full_callsign: The callsign to look up (without any prefix/suffix stripping).
+        :arg callback: The function to call on the Gtk main loop with the data in a dictionary called fields_and_data (or None if a session could not be started), and a list of any error messages.
+        :arg bool ignore_prefix_suffix: True if callsign prefixes/suffixes should be removed prior to querying the server, False otherwise.
+        """
+        request = (database, username, password, full_callsign, ignore_prefix_suffix)
+        if(request != self.request):
+            self.cancel()
+            self.request = request
+        self.callback = callback
+        if(self.result is not None):
+            self.on_complete(self.generation, None)
+        elif(self.future is None):
+            self.submit()
+        return
 
-        # Commence lookup.
-        fields_and_data = {"NAME": "", "ADDRESS": "", "STATE": "", "COUNTRY": "", "DXCC": "", "CQZ": "", "ITUZ": "", "IOTA": ""}
-        if(self.session_id):
-            request = "/xml.php?id=%s&callsign=%s&prg=pyqso" % (self.session_id, callsign)
-            self.connection.request("GET", request)
-            response = self.connection.getresponse()
-
-            xml_data = minidom.parseString(response.read())
-            search_node = xml_data.getElementsByTagName("search")
-            if(search_node):
-                search_node = search_node[0]  # There should only be a maximum of one Callsign element.
-
-                search_name_node = search_node.getElementsByTagName("nick")
-                if(search_name_node):
-                    fields_and_data["NAME"] = search_name_node[0].firstChild.nodeValue
-
-                search_addr1_node = search_node.getElementsByTagName("adr_street1")
-                search_addr2_node = search_node.getElementsByTagName("adr_street2")
-                if(search_addr1_node):
-                    fields_and_data["ADDRESS"] = search_addr1_node[0].firstChild.nodeValue
-                if(search_addr2_node):  # Add the second line of the address, if present.
-                    fields_and_data["ADDRESS"] = (fields_and_data["ADDRESS"] + ", " if search_addr1_node else "") + search_addr2_node[0].firstChild.nodeValue
-
-                search_state_node = search_node.getElementsByTagName("us_state")
-                if(search_state_node):
-                    fields_and_data["STATE"] = search_state_node[0].firstChild.nodeValue
-
-                search_country_node = search_node.getElementsByTagName("country")
-                if(search_country_node):
-                    fields_and_data["COUNTRY"] = search_country_node[0].firstChild.nodeValue
-
-                search_cqzone_node = search_node.getElementsByTagName("cq")
-                if(search_cqzone_node):
-                    fields_and_data["CQZ"] = search_cqzone_node[0].firstChild.nodeValue
-
-                search_ituzone_node = search_node.getElementsByTagName("itu")
-                if(search_ituzone_node):
-                    fields_and_data["ITUZ"] = search_ituzone_node[0].firstChild.nodeValue
-
-                search_iota_node = search_node.getElementsByTagName("iota")
-                if(search_iota_node):
-                    fields_and_data["IOTA"] = search_iota_node[0].firstChild.nodeValue
-            else:
-                # If there is no Callsign element, then print out the error message in the Session element.
-                session_node = xml_data.getElementsByTagName("session")
-                if(session_node):
-                    session_error_node = session_node[0].getElementsByTagName("error")
-                    if(session_error_node):
-                        session_error = session_error_node[0].firstChild.nodeValue
-                        error(parent=self.parent, message=session_error)
-                # Return empty strings for the field data.
+    def submit(self):
+        """ Hand the current lookup over to the worker threads. """
+        if(self.timer is not None):
+            GLib.source_remove(self.timer)
+            self.timer = None
+        generation = self.generation
+        errors = []
+        self.future = self.executor.submit(self.client.lookup, *self.request, errors=errors)
+        self.future.add_done_callback(lambda future: GLib.idle_add(self.on_complete, generation, (future, errors)))
+        return
 
-            logging.debug("Callsign lookup complete. Returning data...")
-        return fields_and_data
+    def on_timer(self, generation):
+        """ Start a prefetched lookup. This is called on the Gtk main loop.
+
+        :returns: False, so that the timer only fires once.
+        :rtype: bool
+        """
+        self.timer = None
+        if(generation == self.generation and self.future is None):
+            self.submit()
+        return False
+
+    def on_complete(self, generation, outcome):
+        """ Store the result of a lookup and pass it on to the callback (if any). This is called on the Gtk main loop.
+
+        :arg int generation: The lookup that the result belongs to.
+        :arg tuple outcome: The completed future and the list of error messages, or None if the result has already been stored.
+        :returns: False, so that the callback is only called once.
+        :rtype: bool
+        """
+        if(generation != self.generation):
+            return False  # The lookup was cancelled in the meantime.
+        if(outcome is not None):
+            (future, errors) = outcome
+            try:
+                self.result = (future.result(), errors)
+            except Exception as e:
+                logging.exception(e)
+                self.result = (None, errors + ["Could not look up the callsign: %s" % e])
+        if(self.callback is not None):
+            (callback, self.callback) = (self.callback, None)
+            callback(*self.result)
+        return False
+
+    def cancel(self):
+        """ Cancel the current lookup. A lookup which has not started yet is removed from the queue; the result of a lookup which is already running is ignored. A running lookup uses its own worker thread's HTTP connection, so it does not hold up the next lookup. """
+        self.generation += 1
+        if(self.timer is not None):
+            GLib.source_remove(self.timer)
+            self.timer = None
+        if(self.future is not None):
+            self.future.cancel()
+            self.future = None
+        self.request = None
+        self.result = None
+        self.callback = None
+        return
+
+    def shutdown(self):
+        """ Cancel the current lookup and stop the worker threads. """
+        self.cancel()
+        self.executor.shutdown(wait=False)
+        return
+
+
+def get_lookup_settings(cache=None):
+    """ Read the callsign lookup settings from the preferences.
+
+    :arg CallsignLookupCache cache: If given, the cache's time-to-live is set from the preferences. This is an optional argument.
+    :returns: The name of the callsign database, the username and password of the user account, and whether callsign prefixes/suffixes should be ignored.
+    :rtype: tuple
+    :raises ValueError: If the callsign database or the login details have not been specified.
+    """
+
+    # Get the database name.
+    have_config = preferences.have_config
+    if(have_config and preferences.has_option("records", "callsign_database")):
+        database = preferences.get("records", "callsign_database")
+    else:
+        database = ""
+    if(database == ""):
+        raise ValueError("To perform a callsign lookup, please specify the name of the callsign database in the Preferences.")
+
+    # Recent lookup results are kept in a cache, for a configurable number of days.
+    (section, option) = ("records", "callsign_lookup_cache_days")
+    if(cache is not None and have_config and preferences.has_option(section, option)):
+        try:
+            cache.ttl = float(preferences.get(section, option))*24*3600
+        except ValueError:
+            logging.warning("The number of days for which callsign lookup results are cached is not a number. Using %.1f days instead." % (cache.ttl/(24*3600.0)))
+
+    # Get username and password from configuration file.
+    if(have_config and preferences.has_option("records", "callsign_database_username") and preferences.has_option("records", "callsign_database_password")):
+        username = preferences.get("records", "callsign_database_username")
+        password = base64.b64decode(preferences.get("records", "callsign_database_password")).decode("utf-8")
+    else:
+        (username, password) = ("", "")
+    if(not username or not password):
+        raise ValueError("To perform a callsign lookup, please specify your username and password in the Preferences.")
+
+    # Check whether we want to ignore any prefixes (e.g. "IA/") or suffixes "(e.g. "/M") in the callsign
+    # before performing the lookup.
+    if(have_config and preferences.has_option("records", "ignore_prefix_suffix")):
+        ignore_prefix_suffix = (preferences.getboolean("records", "ignore_prefix_suffix"))
+    else:
+        ignore_prefix_suffix = True
+
+    return (database, username, password, ignore_prefix_suffix)
 
 
 def strip(full_callsign):
@@ -323,3 +783,41 @@ def strip(full_callsign):
     except ValueError:
         callsign = full_callsign
     return callsign
+
+
+def normalise(callsign):
+    """ Normalise a callsign for use as a cache key.
+
+    :arg str callsign: The callsign.
+    :returns: The callsign in upper case, with any surrounding whitespace removed.
+    :rtype: str
+    """
+    return callsign.strip().upper()
+
+
+def local_name(tag):
+    """ Remove the namespace (if any) from the name of an XML element.
+
+    :arg str tag: The name of the element, e.g. "{http://xmldata.qrz.com}Callsign".
+    :returns: The name of the element without the namespace, e.g. "Callsign".
+    :rtype: str
+    """
+    return tag.rpartition("}")[2]
+
+
+def is_session_expired(message):
+    """ Check whether an error message from a callsign database means that the session has expired or is otherwise no longer valid.
+
+    :arg str message: The error message.
+    :rtype: bool
+    """
+    return ("session" in message.lower())
+
+
+def is_not_found(message):
+    """ Check whether an error message from a callsign database means that the callsign does not exist (rather than, for example, that the session has expired).
+
+    :arg str message: The error message.
+    :rtype: bool
+    """
+    return ("not found" in message.lower())
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+import logging
+import re
+import socket
+import threading
+import time
+
+# Connection states.
+DISCONNECTED = "DISCONNECTED"
+CONNECTING = "CONNECTING"
+LOGGING_IN = "LOGGING_IN"
+CONNECTED = "CONNECTED"
+WAITING = "WAITING"  # Waiting to reconnect after the connection was lost.
+
+# Telnet commands (RFC 854).
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+LOGIN_PROMPT = re.compile(r"(login|call)\s*:\s*$", re.IGNORECASE)
+PASSWORD_PROMPT = re.compile(r"password\s*:\s*$", re.IGNORECASE)
+
+
+class ClusterConnection:
+
+    """ A non-blocking connection to a Telnet-based DX cluster. The connection is established in a separate thread (so that DNS lookups and slow servers never block the Gtk main loop), and all further I/O is driven by the main loop watching the socket. Text is passed to the on_text callback as soon as it arrives. If an established connection is lost, reconnection is attempted with an exponential backoff. """
+
+    def __init__(self, host, port=23, username=None, password=None, on_text=None, on_state=None, connect_timeout=15, login_timeout=15, reconnect=True, minimum_delay=1, maximum_delay=300):
+        """ Set up the connection's details. No connection is made until the connect method is called.
+
+        :arg str host: The Telnet server's hostname.
+        :arg int port: The Telnet server's port number.
+        :arg str username: The user's username. This is an optional argument.
+        :arg str password: The user's password. This is an optional argument.
+        :arg on_text: The function to call with any text received from the server.
+        :arg on_state: The function to call with the new state and a status message (which may be None) whenever the state of the connection changes.
+        :arg int connect_timeout: The number of seconds to wait for the server to accept the connection.
+        :arg int login_timeout: The number of seconds to wait for the server's login prompts. After this time, the connection is treated as established.
+        :arg bool reconnect: If True, attempt to reconnect if an established connection is lost.
+        :arg int minimum_delay: The number of seconds to wait before the first reconnection attempt.
+        :arg int maximum_delay: The maximum number of seconds to wait between reconnection attempts.
+        """
+
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.on_text = on_text
+        self.on_state = on_state
+        self.connect_timeout = connect_timeout
+        self.login_timeout = login_timeout
+        self.reconnect = reconnect
+        self.minimum_delay = minimum_delay
+        self.maximum_delay = maximum_delay
+
+        self.state = DISCONNECTED
+        self.socket = None
+        self.read_watch = None
+        self.write_watch = None
+        self.timer = None
+        self.generation = 0  # Incremented on every (re)connection attempt, so that the results of cancelled attempts can be ignored.
+        self.attempts = 0  # The number of consecutive reconnection attempts.
+        self.established = False  # Has a connection ever been established?
+        self.connected_at = None
+
+        self.incoming = b""  # Any incomplete Telnet command at the end of the data received so far.
+        self.outgoing = b""  # Data that could not be sent yet because the socket's buffer is full.
+        self.line = ""  # The text received since the last newline, which is checked for login prompts.
+        self.prompts = []
+
+        return
+
+    def connect(self):
+        """ Start connecting to the server. This returns immediately; the on_state callback is called once the connection has been established or has failed. """
+        self.disconnect(notify=False)
+        self.generation += 1
+        self.set_state(CONNECTING, "Connecting to %s:%d..." % (self.host, self.port))
+        thread = threading.Thread(target=self.open_socket, args=(self.generation,))
+        thread.daemon = True
+        thread.start()
+        return
+
+    def open_socket(self, generation):
+        """ Resolve the server's hostname and open a socket. This blocks, so it is run in a separate thread. The result is handed back to the Gtk main loop.
+
+        :arg int generation: The connection attempt that the socket belongs to.
+        """
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            GLib.idle_add(self.on_socket_opened, generation, sock, None)
+        except (OSError, ValueError) as e:
+            GLib.idle_add(self.on_socket_opened, generation, None, e)
+        return
+
+    def on_socket_opened(self, generation, sock, exception):
+        """ Start watching the newly-opened socket, and begin logging in if necessary. This is called on the Gtk main loop.
+
+        :arg int generation: The connection attempt that the socket belongs to.
+        :arg sock: The connected socket, or None if the connection failed.
+        :arg exception: The reason the connection failed, or None if it succeeded.
+        :returns: False, so that the callback is only called once.
+        :rtype: bool
+        """
+        if(generation != self.generation or self.state != CONNECTING):
+            # The attempt has been cancelled in the meantime.
+            if(sock is not None):
+                sock.close()
+            return False
+
+        if(exception is not None):
+            logging.exception(exception)
+            self.on_connection_lost("Could not connect to %s:%d (%s)." % (self.host, self.port, exception))
+            return False
+
+        logging.debug("Connection to %s:%d established." % (self.host, self.port))
+        sock.setblocking(False)
+        self.socket = sock
+        self.incoming = b""
+        self.outgoing = b""
+        self.line = ""
+        self.read_watch = GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_io)
+        self.established = True
+        self.connected_at = time.time()
+
+        self.prompts = []
+        if(self.username):
+            self.prompts.append((LOGIN_PROMPT, self.username))
+        if(self.password):
+            self.prompts.append((PASSWORD_PROMPT, self.password))
+        if(self.prompts):
+            self.set_state(LOGGING_IN, "Logging in to %s:%d..." % (self.host, self.port))
+            self.timer = GLib.timeout_add_seconds(self.login_timeout, self.on_login_timeout)
+        else:
+            self.set_state(CONNECTED, "Connected to %s:%d." % (self.host, self.port))
+        return False
+
+    def on_login_timeout(self):
+        """ Stop waiting for the server's login prompts.
+
+        :returns: False, so that the timer is only called once.
+        :rtype: bool
+        """
+        self.timer = None
+        if(self.state == LOGGING_IN):
+            logging.warning("Timed out waiting for the login prompt from %s:%d." % (self.host, self.port))
+            self.prompts = []
+            self.set_state(CONNECTED, "Connected to %s:%d, but no login prompt was received." % (self.host, self.port))
+        return False
+
+    def on_io(self, source, condition):
+        """ Read all the data that is available from the server. This is called by the Gtk main loop whenever the socket is readable or has been closed.
+
+        :returns: True if the socket should still be watched, and False otherwise.
+        :rtype: bool
+        """
+        if(self.socket is None):
+            return False
+
+        if(condition & GLib.IO_IN):
+            while(True):
+                try:
+                    data = self.socket.recv(4096)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as e:
+                    logging.exception(e)
+                    self.read_watch = None
+                    self.on_connection_lost("The connection to %s:%d was lost." % (self.host, self.port))
+                    return False
+                if(not data):
+                    self.read_watch = None
+                    self.on_connection_lost("The connection was closed by %s:%d." % (self.host, self.port))
+                    return False
+                self.receive(data)
+                if(self.socket is None):
+                    return False  # The connection may have been closed by one of the callbacks.
+        elif(condition & (GLib.IO_HUP | GLib.IO_ERR)):
+            self.read_watch = None
+            self.on_connection_lost("The connection to %s:%d was lost." % (self.host, self.port))
+            return False
+
+        return True
+
+    def receive(self, data):
+        """ Handle data received from the server: reply to any Telnet option negotiation, pass the text on to the on_text callback, and respond to any login prompts.
+
+        :arg bytes data: The data received from the server.
+        """
+        text, replies, self.incoming = parse_telnet(self.incoming + data)
+        if(replies):
+            self.write(replies)
+
+        text = text.decode("ascii", "replace")  # Replace any characters that cannot be decoded with a replacement marker.
+        text = text.replace("\r", "").replace("\u0007", "")  # Remove carriage returns and the BEL character.
+        if(not text):
+            return
+
+        if(self.on_text is not None):
+            self.on_text(text)
+
+        if(self.state == LOGGING_IN and self.prompts):
+            self.line = (self.line + text).rsplit("\n", 1)[-1][-80:]
+            (prompt, response) = self.prompts[0]
+            if(prompt.search(self.line)):
+                self.prompts.pop(0)
+                self.line = ""
+                self.send(response + "\n")
+                if(not self.prompts):
+                    self.remove_source("timer")
+                    self.set_state(CONNECTED, "Logged in to %s:%d." % (self.host, self.port))
+        return
+
+    def send(self, text):
+        """ Send text to the server.
+
+        :arg str text: The text to send.
+        """
+        self.write(text.encode())
+        return
+
+    def write(self, data):
+        """ Send data to the server without blocking. Any data that the socket cannot accept yet is sent once the socket becomes writable.
+
+        :arg bytes data: The data to send.
+        """
+        if(self.socket is None):
+            logging.warning("Not connected to a DX cluster; unable to send data.")
+            return
+        self.outgoing += data
+        self.on_writable()
+        return
+
+    def on_writable(self, source=None, condition=None):
+        """ Send as much of the outgoing data as the socket will accept.
+
+        :returns: True if there is still data waiting to be sent, and False otherwise.
+        :rtype: bool
+        """
+        if(self.socket is None):
+            self.write_watch = None
+            return False
+        try:
+            sent = self.socket.send(self.outgoing)
+            self.outgoing = self.outgoing[sent:]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            # Any error is also reported to the read watch, which handles the lost connection.
+            logging.exception(e)
+            self.outgoing = b""
+
+        if(self.outgoing):
+            if(self.write_watch is None):
+                self.write_watch = GLib.io_add_watch(self.socket.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_OUT, self.on_writable)
+            return True
+        else:
+            if(source is None):
+                self.remove_source("write_watch")
+            else:
+                self.write_watch = None  # Returning False removes the watch.
+            return False
+
+    def on_connection_lost(self, message):
+        """ Clean up after a failed or lost connection, and schedule a reconnection attempt if the connection had been established.
+
+        :arg str message: The reason the connection was lost.
+        """
+        logging.warning(message)
+        self.close()
+        if(self.reconnect and self.established):
+            if(self.connected_at is not None and time.time() - self.connected_at > self.maximum_delay):
+                # The connection was stable for a while, so start backing off from the minimum delay again.
+                self.attempts = 0
+            self.connected_at = None
+            delay = self.get_delay()
+            self.attempts += 1
+            self.set_state(WAITING, "%s Reconnecting in %d seconds..." % (message, delay))
+            self.timer = GLib.timeout_add_seconds(delay, self.on_reconnect_timeout)
+        else:
+            self.set_state(DISCONNECTED, message)
+        return
+
+    def get_delay(self):
+        """ Return the number of seconds to wait before the next reconnection attempt. The delay doubles with every consecutive attempt, up to the maximum delay.
+
+        :rtype: int
+        """
+        return min(self.minimum_delay*(2**min(self.attempts, 16)), self.maximum_delay)
+
+    def on_reconnect_timeout(self):
+        """ Try to reconnect to the server.
+
+        :returns: False, so that the timer is only called once.
+        :rtype: bool
+        """
+        self.timer = None
+        if(self.state == WAITING):
+            self.generation += 1
+            self.set_state(CONNECTING, "Reconnecting to %s:%d..." % (self.host, self.port))
+            thread = threading.Thread(target=self.open_socket, args=(self.generation,))
+            thread.daemon = True
+            thread.start()
+        return False
+
+    def disconnect(self, notify=True):
+        """ Close the connection, and cancel any connection or reconnection attempts in progress.
+
+        :arg bool notify: If True, call the on_state callback.
+        """
+        self.generation += 1
+        self.close()
+        self.attempts = 0
+        self.established = False
+        self.connected_at = None
+        if(notify):
+            self.set_state(DISCONNECTED, None)
+        else:
+            self.state = DISCONNECTED
+        return
+
+    def close(self):
+        """ Close the socket and remove all the watches and timers. """
+        self.remove_source("read_watch")
+        self.remove_source("write_watch")
+        self.remove_source("timer")
+        if(self.socket is not None):
+            try:
+                self.socket.close()
+            except OSError as e:
+                logging.exception(e)
+            self.socket = None
+        self.incoming = b""
+        self.outgoing = b""
+        self.prompts = []
+        return
+
+    def remove_source(self, name):
+        """ Remove a watch or timer from the Gtk main loop.
+
+        :arg str name: The name of the attribute holding the event source's ID.
+        """
+        source = getattr(self, name)
+        if(source is not None):
+            GLib.source_remove(source)
+            setattr(self, name, None)
+        return
+
+    def set_state(self, state, message):
+        """ Change the state of the connection, and notify the on_state callback.
+
+        :arg str state: The new state.
+        :arg str message: A status message, or None.
+        """
+        self.state = state
+        if(message is not None):
+            logging.debug(message)
+        if(self.on_state is not None):
+            self.on_state(state, message)
+        return
+
+
+def parse_telnet(data):
+    """ Separate the text in data received from a Telnet server from any Telnet commands. All requests to enable options are refused, as in telnetlib.
+
+    :arg bytes data: The data received from the server.
+    :returns: The text, the replies to send back to the server, and any incomplete command at the end of the data (which should be prepended to the next data received).
+    :rtype: tuple
+    """
+    text = bytearray()
+    replies = bytearray()
+    i = 0
+    n = len(data)
+    while(i < n):
+        j = data.find(IAC, i)
+        if(j < 0):
+            text += data[i:]
+            i = n
+            break
+        text += data[i:j]
+        i = j
+        if(j + 1 >= n):
+            break  # Incomplete command.
+        command = data[j+1]
+        if(command == IAC):
+            # An escaped 0xFF data byte.
+            text.append(IAC)
+            i = j + 2
+        elif(command in (DO, DONT, WILL, WONT)):
+            if(j + 2 >= n):
+                break  # Incomplete command.
+            option = data[j+2]
+            if(command == DO):
+                replies += bytes([IAC, WONT, option])
+            elif(command == WILL):
+                replies += bytes([IAC, DONT, option])
+            i = j + 3
+        elif(command == SB):
+            end = data.find(bytes([IAC, SE]), j + 2)
+            if(end < 0):
+                break  # Incomplete subnegotiation.
+            i = end + 2
+        else:
+            # Any other command (e.g. NOP or GA) carries no data.
+            i = j + 2
+    return (bytes(text), bytes(replies), bytes(data[i:]))
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import bisect
+import calendar
+from collections import namedtuple
+
+from pyqso.geocoding import Geocoder, normalise, location_prefix
+from pyqso.worked_before import get_field
+
+# The details of a QSO that the contest rules depend on. The time is in seconds since the epoch (UTC), or None if the QSO's date or time is invalid.
+Qso = namedtuple("Qso", ["call", "band", "mode", "time", "country", "cqz", "ituz", "continent", "prefix", "exchange"])
+
+# The details of the contest station (i.e. the user's own station).
+Station = namedtuple("Station", ["call", "country", "cqz", "ituz", "continent"])
+
+# The outcome of adding a QSO to the score: the points it is worth, the multipliers that it is the first to work, and whether it is a duplicate.
+Claim = namedtuple("Claim", ["points", "multipliers", "dupe"])
+
+# The continent of each CQ zone. This is only used if a record does not say which continent the station is on, and is an approximation: a few zones (e.g. 23 and 28) span two continents.
+CQ_ZONE_CONTINENTS = dict([(z, "NA") for z in range(1, 9)] + [(z, "SA") for z in range(9, 14)] + [(z, "EU") for z in range(14, 17)] + [(z, "AS") for z in range(17, 27)]
+                          + [(z, "OC") for z in range(27, 33)] + [(z, "AF") for z in range(33, 40)] + [(40, "EU")])
+
+# The bands on which some contests award extra points.
+LOW_BANDS = set(["160m", "80m", "40m"])
+
+# The countries whose stations work the rest of the world in the ARRL International DX contest.
+ARRL_DX_COUNTRIES = set(["united states", "canada", "alaska", "hawaii"])
+
+# The fields of a record that the score depends on.
+SCORED_FIELDS = ["CALL", "QSO_DATE", "TIME_ON", "BAND", "MODE", "COUNTRY", "DXCC", "CQZ", "ITUZ", "RST_RCVD"]
+
+# The suffixes that do not change a station's prefix.
+SUFFIXES = ["P", "M", "A", "PM", "MM", "AM", "QRP"]
+
+# The letters and numbers at the start of a callsign that form its prefix in the CQ WPX contest (e.g. "K1" for K1ABC, or "9A1" for 9A1A).
+PREFIX_PATTERN = re.compile(r"^([0-9]?[A-Z]+)([0-9]+)")
+
+# The sliding windows (in seconds) over which the QSO rate is measured by default.
+RATE_WINDOWS = (600, 3600)
+
+
+class ContestRules:
+
+    """ The rules used to score a contest. This base class awards one point per QSO, with no multipliers and with duplicate QSOs counted once per band.
+    Each contest's rules are a subclass which overrides the class attributes and (if necessary) the points method. """
+
+    contests = []  # The names of the contests (as listed in cabrillo.CONTESTS) that these rules apply to.
+    multipliers = []  # The kinds of multiplier, out of "DXCC", "CQZ", "ITUZ", "PREFIX" and "SECTION".
+    multipliers_per_band = False  # True if each multiplier counts again on every band.
+    dupes_per_band = True  # True if a station can be worked again on every band...
+    dupes_per_mode = False  # ...and/or with every mode.
+
+    def points(self, qso, station):
+        """ Return the number of points that a (non-duplicate) QSO is worth.
+
+        :arg Qso qso: The QSO.
+        :arg Station station: The contest station.
+        :rtype: int
+        """
+        return 1
+
+    def dupe_key(self, qso):
+        """ Return the key which is the same for any two QSOs that duplicate one another.
+
+        :arg Qso qso: The QSO.
+        :rtype: tuple
+        """
+        return (qso.call, qso.band if self.dupes_per_band else "", qso.mode if self.dupes_per_mode else "")
+
+    def multiplier_keys(self, qso, station):
+        """ Return the multipliers that a QSO counts towards.
+
+        :arg Qso qso: The QSO.
+        :arg Station station: The contest station.
+        :returns: A list of (kind, band, value) tuples, where the band is an empty string if the multiplier only counts once. Multipliers whose value is unknown are left out.
+        :rtype: list
+        """
+        band = qso.band if self.multipliers_per_band else ""
+        keys = []
+        for kind in self.multipliers:
+            value = self.multiplier_value(kind, qso)
+            if(value):
+                keys.append((kind, band, value))
+        return keys
+
+    def multiplier_value(self, kind, qso):
+        """ Return the value of a QSO's multiplier of a given kind (e.g. its CQ zone).
+
+        :arg str kind: The kind of multiplier.
+        :arg Qso qso: The QSO.
+        :rtype: str
+        """
+        if(kind == "DXCC"):
+            return qso.country
+        elif(kind == "CQZ"):
+            return qso.cqz
+        elif(kind == "ITUZ"):
+            return qso.ituz
+        elif(kind == "PREFIX"):
+            return qso.prefix
+        elif(kind == "SECTION"):
+            return get_section(qso.exchange)
+        raise ValueError("Unknown kind of multiplier '%s'." % kind)
+
+
+class CQWorldWideRules(ContestRules):
+
+    """ The CQ World Wide DX contest: DXCC entities and CQ zones are multipliers on each band. QSOs with other continents are worth 3 points, QSOs with other countries on the same continent are worth 1 point (2 points in North America), and QSOs within the station's own country are only worth a multiplier. """
+
+    contests = ["CQ-WW-CW", "CQ-WW-SSB", "CQ-WW-RTTY"]
+    multipliers = ["DXCC", "CQZ"]
+    multipliers_per_band = True
+
+    def points(self, qso, station):
+        if(qso.country and qso.country == station.country):
+            return 0
+        elif(qso.continent and qso.continent != station.continent):
+            return 3
+        elif(station.continent == "NA"):
+            return 2
+        return 1
+
+
+class CQWPXRules(ContestRules):
+
+    """ The CQ WPX contest: each prefix is a multiplier once. QSOs with other continents are worth 3 points, and QSOs with other countries on the same continent are worth 1 point (2 points in North America). These are doubled on the 160m, 80m and 40m bands. QSOs within the station's own country are worth 1 point. """
+
+    contests = ["CQ-WPX-CW", "CQ-WPX-RTTY", "CQ-WPX-SSB"]
+    multipliers = ["PREFIX"]
+
+    def points(self, qso, station):
+        if(qso.country and qso.country == station.country):
+            return 1
+        elif(qso.continent and qso.continent != station.continent):
+            points = 3
+        else:
+            points = 2 if station.continent == "NA" else 1
+        return 2*points if qso.band in LOW_BANDS else points
+
+
+class IARUHFRules(ContestRules):
+
+    """ The IARU HF World Championship: ITU zones are multipliers on each band, and each mode counts as a separate QSO. QSOs within the station's own ITU zone are worth 1 point, QSOs with other zones on the same continent are worth 3 points, and QSOs with other continents are worth 5 points. """
+
+    contests = ["IARU-HF"]
+    multipliers = ["ITUZ"]
+    multipliers_per_band = True
+    dupes_per_mode = True
+
+    def points(self, qso, station):
+        if(not qso.ituz or qso.ituz == station.ituz):
+            return 1
+        elif(qso.continent and qso.continent != station.continent):
+            return 5
+        return 3
+
+
+class ARRLDXRules(ContestRules):
+
+    """ The ARRL International DX contest: every QSO is worth 3 points. Stations in the United States and Canada count each DXCC entity as a multiplier on each band, and all other stations count each state and province (as sent in the exchange) instead. """
+
+    contests = ["ARRL-DX-CW", "ARRL-DX-SSB"]
+    multipliers = ["DXCC", "SECTION"]  # Only one of these applies, depending on where the contest station is.
+    multipliers_per_band = True
+
+    def points(self, qso, station):
+        return 3
+
+    def multiplier_keys(self, qso, station):
+        kind = "DXCC" if station.country in ARRL_DX_COUNTRIES else "SECTION"
+        value = self.multiplier_value(kind, qso)
+        return [(kind, qso.band, value)] if value else []
+
+
+class ARRLSweepstakesRules(ContestRules):
+
+    """ The ARRL November Sweepstakes: every QSO is worth 2 points, each station can only be worked once, and each ARRL/RAC section (the last part of the exchange) is a multiplier once. """
+
+    contests = ["ARRL-SS-CW", "ARRL-SS-SSB"]
+    multipliers = ["SECTION"]
+    dupes_per_band = False
+
+    def points(self, qso, station):
+        return 2
+
+
+# The rules of each contest that has its own rules.
+RULES = dict([(contest, cls) for cls in [CQWorldWideRules, CQWPXRules, IARUHFRules, ARRLDXRules, ARRLSweepstakesRules] for contest in cls.contests])
+
+
+def get_rules(contest):
+    """ Return the rules for a contest.
+
+    :arg str contest: The name of the contest (e.g. "CQ-WW-CW").
+    :returns: The contest's rules, or the default rules (one point per QSO and no multipliers) if the contest does not have its own rules.
+    :rtype: ContestRules
+    """
+    return RULES.get(contest, ContestRules)()
+
+
+class RateMeter:
+
+    """ Measures the QSO rate (in QSOs per hour) over sliding windows of time. Only the QSOs in the longest window are kept. """
+
+    def __init__(self, windows=RATE_WINDOWS):
+        """ Set up a new rate meter.
+
+        :arg tuple windows: The lengths of the sliding windows, in seconds.
+        """
+        self.windows = windows
+        self.times = []  # The sorted times of the QSOs in the longest window.
+        self.start = 0  # The index of the oldest time in the longest window. Older times are removed in batches.
+        return
+
+    def add(self, t):
+        """ Add a QSO.
+
+        :arg float t: The time of the QSO, in seconds since the epoch.
+        """
+        if(not self.times or t >= self.times[-1]):
+            self.times.append(t)
+        else:
+            bisect.insort(self.times, t)  # QSOs are almost always logged in order, so this is rare.
+
+        # Forget the times that are older than the longest window, once they make up half of the list.
+        self.start = bisect.bisect_right(self.times, self.times[-1] - max(self.windows), self.start)
+        if(self.start > len(self.times)//2):
+            del self.times[:self.start]
+            self.start = 0
+        return
+
+    def rate(self, window, now=None):
+        """ Return the QSO rate over a sliding window.
+
+        :arg float window: The length of the window, in seconds.
+        :arg float now: The time at which the window ends, in seconds since the epoch (e.g. time.time() while logging live). By default, this is the time of the latest QSO.
+        :returns: The number of QSOs made in the window, per hour.
+        :rtype: float
+        """
+        if(len(self.times) == self.start):
+            return 0.0
+        if(now is None):
+            now = self.times[-1]
+        count = bisect.bisect_right(self.times, now, self.start) - bisect.bisect_right(self.times, now - window, self.start)
+        return count*3600.0/window
+
+    def rates(self, now=None):
+        """ Return the QSO rate over each of the sliding windows.
+
+        :arg float now: The time at which the windows end, as for the rate method.
+        :returns: The QSO rate (in QSOs per hour) for each window length.
+        :rtype: dict
+        """
+        return dict([(window, self.rate(window, now)) for window in self.windows])
+
+
+class ContestScore:
+
+    """ The claimed score of a contest, which is kept up-to-date as QSOs are added.
+    The duplicate QSOs and the multipliers are kept in sets, so each QSO is scored in O(1) time. A whole log is scored in a single pass over its QSOs in time order. """
+
+    def __init__(self, rules, mycall="", cqz="", ituz="", continent="", geocoder=None, windows=RATE_WINDOWS):
+        """ Set up an empty score.
+
+        :arg ContestRules rules: The contest's rules.
+        :arg str mycall: The callsign used during the contest.
+        :arg str cqz: The contest station's CQ zone.
+        :arg str ituz: The contest station's ITU zone.
+        :arg str continent: The contest station's continent (e.g. "EU"). By default, this is found from the CQ zone.
+        :arg Geocoder geocoder: Used to find the DXCC entity of a callsign from its prefix. By default, a Geocoder without an on-disk cache is created.
+        :arg tuple windows: The lengths (in seconds) of the sliding windows over which the QSO rate is measured.
+        """
+        self.rules = rules
+        self.geocoder = geocoder if geocoder is not None else Geocoder(path=None)
+        mycall = mycall.strip().upper()
+        cqz = get_zone(cqz)
+        self.station = Station(mycall, normalise(self.geocoder.get_country(mycall)), cqz, get_zone(ituz), continent.strip().upper() or get_continent(cqz))
+        self.worked = set()
+        self.multipliers = set()
+        self.points = 0
+        self.qso_count = 0
+        self.dupe_count = 0
+        self.rate_meter = RateMeter(windows)
+        return
+
+    @property
+    def multiplier_count(self):
+        """ The total number of multipliers worked. """
+        return len(self.multipliers)
+
+    @property
+    def claimed_score(self):
+        """ The claimed score, i.e. the total number of points multiplied by the total number of multipliers (or just the total number of points, if the contest has no multipliers). """
+        if(self.rules.multipliers):
+            return self.points*self.multiplier_count
+        return self.points
+
+    def parse(self, record):
+        """ Extract the details of a QSO that the contest rules depend on from a record.
+
+        :arg record: A dictionary of (upper case) field names, or a row from the database.
+        :returns: The details of the QSO, or None if the record has no callsign.
+        :rtype: Qso
+        """
+        call = get_field(record, "CALL").strip().upper()
+        if(not call):
+            return None
+        country = normalise(self.geocoder.get_country(call) or get_field(record, "COUNTRY")) or get_field(record, "DXCC").strip()
+        cqz = get_zone(get_field(record, "CQZ"))
+        continent = get_field(record, "CONT").strip().upper() or get_continent(cqz)
+        return Qso(call, get_field(record, "BAND").strip().lower(), get_field(record, "MODE").strip().upper(), qso_time(get_field(record, "QSO_DATE"), get_field(record, "TIME_ON")),
+                   country, cqz, get_zone(get_field(record, "ITUZ")), continent, wpx_prefix(call), get_field(record, "RST_RCVD").strip().upper())
+
+    def add(self, record):
+        """ Add a QSO to the score.
+
+        :arg record: A dictionary of (upper case) field names, or a row from the database.
+        :returns: The points that the QSO is worth, the multipliers that it is the first to work, and whether it is a duplicate. None is returned if the record has no callsign.
+        :rtype: Claim
+        """
+        qso = self.parse(record)
+        if(qso is None):
+            return None
+        self.qso_count += 1
+        if(qso.time is not None):
+            self.rate_meter.add(qso.time)
+
+        key = self.rules.dupe_key(qso)
+        if(key in self.worked):
+            self.dupe_count += 1
+            return Claim(0, [], True)
+        self.worked.add(key)
+
+        points = self.rules.points(qso, self.station)
+        self.points += points
+        new = [m for m in self.rules.multiplier_keys(qso, self.station) if m not in self.multipliers]
+        self.multipliers.update(new)
+        return Claim(points, new, False)
+
+    def is_dupe(self, record):
+        """ Return True if a QSO would be a duplicate of one that has already been added (e.g. while it is being entered in the record dialog), and False otherwise.
+
+        :arg record: A dictionary of (upper case) field names, or a row from the database.
+        :rtype: bool
+        """
+        qso = self.parse(record)
+        return qso is not None and self.rules.dupe_key(qso) in self.worked
+
+    def score(self, records):
+        """ Add many QSOs to the score, in time order. Which QSO of a pair is the duplicate depends on the order, so the records are sorted by their date and time first.
+
+        :arg records: An iterable of records, as for the add method.
+        :returns: The claimed score.
+        :rtype: int
+        """
+        for record in sorted(records, key=lambda r: (get_field(r, "QSO_DATE"), get_field(r, "TIME_ON"))):
+            self.add(record)
+        return self.claimed_score
+
+    def score_log(self, log):
+        """ Add all the QSOs in a log to the score. The QSOs are sorted by the database, and streamed from it in a single pass.
+
+        :arg Log log: The log.
+        :returns: The claimed score.
+        :rtype: int
+        :raises sqlite.Error: If the QSOs could not be retrieved from the database.
+        """
+        c = log.connection.cursor()
+        c.execute("SELECT %s FROM %s ORDER BY qso_date, time_on, id" % (", ".join(SCORED_FIELDS).lower(), log.name))
+        for row in c:
+            self.add(dict(zip(SCORED_FIELDS, row)))
+        logging.debug("Scored %d QSOs (%d duplicates) in log '%s': %d points and %d multipliers." % (self.qso_count, self.dupe_count, log.name, self.points, self.multiplier_count))
+        return self.claimed_score
+
+
+def qso_time(date, time):
+    """ Return the time of a QSO in seconds since the epoch.
+
+    :arg str date: The date of the QSO, in the ADIF format (YYYYMMDD).
+    :arg str time: The time of the QSO (in UTC), in the ADIF format (HHMM or HHMMSS).
+    :returns: The time of the QSO, or None if the date or time is invalid.
+    :rtype: int
+    """
+    try:
+        if(len(date) != 8 or len(time) not in (4, 6)):
+            return None
+        return calendar.timegm((int(date[0:4]), int(date[4:6]), int(date[6:8]), int(time[0:2]), int(time[2:4]), int(time[4:6] or 0)))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_zone(zone):
+    """ Return a CQ or ITU zone without any leading zeros.
+
+    :arg str zone: The zone (e.g. "05").
+    :returns: The zone (e.g. "5"), or an empty string if the zone is not a number.
+    :rtype: str
+    """
+    zone = str(zone or "").strip()
+    return str(int(zone)) if zone.isdigit() else ""
+
+
+def get_continent(cqz):
+    """ Return the continent of a CQ zone.
+
+    :arg str cqz: The CQ zone.
+    :returns: The two-letter abbreviation of the continent (e.g. "EU"), or an empty string if the zone is unknown.
+    :rtype: str
+    """
+    try:
+        return CQ_ZONE_CONTINENTS.get(int(cqz), "")
+    except ValueError:
+        return ""
+
+
+def get_section(exchange):
+    """ Return the section, state or province in a received exchange, which is taken to be its last part (e.g. "ON" in "59 ON" or "123 A 72 ORG").
+
+    :arg str exchange: The received exchange.
+    :returns: The section, or an empty string if the last part of the exchange is not made of letters.
+    :rtype: str
+    """
+    parts = (exchange or "").split()
+    if(parts and parts[-1].isalpha()):
+        return parts[-1].upper()
+    return ""
+
+
+def wpx_prefix(callsign):
+    """ Return the prefix of a callsign, as defined by the CQ WPX contest. For example, the prefix of "K1ABC" is "K1", the prefix of "F/K1ABC" is "F0" and the prefix of "K1ABC/4" is "K4".
+
+    :arg str callsign: The callsign.
+    :returns: The prefix, or an empty string if the callsign has no letters.
+    :rtype: str
+    """
+    components = [c for c in callsign.strip().upper().split("/") if c and c not in SUFFIXES]
+    if(not components):
+        return ""
+    district = None
+    if(len(components) > 1 and components[-1].isdigit()):
+        district = components.pop()  # A call area, e.g. "/4".
+    call = location_prefix("/".join(components))
+    match = PREFIX_PATTERN.match(call)
+    if(match is not None):
+        (letters, digits) = match.groups()
+    elif(call[:2].isalpha()):
+        (letters, digits) = (call[:2], "0")  # A callsign without a number (or a location prefix such as "F") is given the number 0.
+    elif(call[:1].isalpha()):
+        (letters, digits) = (call[:1], "0")
+    else:
+        return ""
+    return letters + (district if district is not None else digits)
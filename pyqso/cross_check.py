@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import bisect
+from collections import namedtuple
+
+from pyqso.adif import ADIF
+from pyqso.band_plan import band_for_frequency
+from pyqso.cabrillo import read_files
+from pyqso.contest_scoring import qso_time
+from pyqso.worked_before import get_field
+
+# The outcome of cross-checking a QSO, from the best to the worst.
+MATCHED = "MATCHED"  # The other station logged the QSO too, with the same exchange.
+UNCHECKED = "UNCHECKED"  # The other station did not submit a log, but other stations worked it too.
+BUSTED_EXCHANGE = "BUSTED_EXCHANGE"  # The other station logged the QSO, but sent a different exchange to the one that was logged.
+BUSTED_CALL = "BUSTED_CALL"  # The callsign was copied wrongly: a station with a similar callsign logged the QSO instead.
+NOT_IN_LOG = "NOT_IN_LOG"  # The other station submitted a log, but the QSO is not in it.
+UNIQUE = "UNIQUE"  # The other station did not submit a log, and no other station worked it.
+
+# The default time (in seconds) by which the clocks of two stations may differ.
+TIME_TOLERANCE = 300
+
+# The largest number of characters by which a wrongly-copied callsign may differ from the true one.
+MAXIMUM_CALL_DISTANCE = 2
+
+# The outcome of cross-checking a QSO. The detail is the true callsign for a BUSTED_CALL QSO, or the exchange that was actually sent for a BUSTED_EXCHANGE QSO, and an empty string otherwise.
+Result = namedtuple("Result", ["station", "record", "status", "detail"])
+
+# The details of a QSO that are cross-checked. The index is the position of the QSO in its station's log.
+Entry = namedtuple("Entry", ["station", "index", "call", "band", "time", "sent", "rcvd"])
+
+
+class CrossCheck:
+
+    """ Matches up the QSOs in the logs of several stations (e.g. the logs submitted to a club contest), and finds the QSOs that are Unique, Busted, or Not-In-Log (UBN).
+    The QSOs are joined on a hash of the pair of callsigns and the band, so each QSO is only compared with the QSOs that the other station made with it on the same band, within a sorted window of time. """
+
+    def __init__(self, tolerance=TIME_TOLERANCE):
+        """ Set up an empty cross-check.
+
+        :arg float tolerance: The time (in seconds) by which the clocks of two stations may differ.
+        """
+        self.tolerance = tolerance
+        self.logs = {}  # The records of each station's log.
+        self.entries = {}  # The details of each station's QSOs which are cross-checked.
+        return
+
+    def add_log(self, station, records):
+        """ Add a station's log. QSOs without a callsign, band or valid date and time are ignored.
+
+        :arg str station: The callsign that the station used.
+        :arg records: An iterable of records, each of which may be a dictionary of (upper case) field names or a row from the database.
+        """
+        station = normalise(station)
+        if(not station):
+            raise ValueError("The station's callsign is needed to cross-check its log.")
+        if(station in self.logs):
+            logging.warning("The log of %s has already been added. Replacing it..." % station)
+        records = list(records)
+        entries = []
+        for (index, record) in enumerate(records):
+            call = normalise(get_field(record, "CALL"))
+            band = get_field(record, "BAND").strip().lower()
+            if(not band and get_field(record, "FREQ")):
+                try:
+                    band = band_for_frequency(float(get_field(record, "FREQ")))
+                except ValueError:
+                    pass
+            time = qso_time(get_field(record, "QSO_DATE"), get_field(record, "TIME_ON"))
+            if(call and band and time is not None):
+                entries.append(Entry(station, index, call, band, time, exchange(get_field(record, "RST_SENT")), exchange(get_field(record, "RST_RCVD"))))
+        self.logs[station] = records
+        self.entries[station] = entries
+        logging.debug("Added %d QSOs (of which %d can be cross-checked) from the log of %s." % (len(records), len(entries), station))
+        return
+
+    def add_log_table(self, log, station):
+        """ Add a log in the logbook. The records are streamed from the database.
+
+        :arg Log log: The log.
+        :arg str station: The callsign that the station used.
+        :raises sqlite.Error: If the records could not be retrieved from the database.
+        """
+        self.add_log(station, log.iter_records())
+        return
+
+    def add_adif_file(self, path, station=None):
+        """ Add a log from an ADIF file.
+
+        :arg str path: The path to the ADIF file.
+        :arg str station: The callsign that the station used. By default, this is taken from the STATION_CALLSIGN (or OPERATOR) field of the first QSO.
+        :raises IOError: If the ADIF file could not be read.
+        :raises ValueError: If the station's callsign is not known.
+        """
+        records = ADIF().read(path)
+        if(station is None and records):
+            station = get_field(records[0], "STATION_CALLSIGN") or get_field(records[0], "OPERATOR")
+        self.add_log(station, records)
+        return
+
+    def add_cabrillo_files(self, paths, workers=None):
+        """ Add the logs in many Cabrillo files, which are read concurrently. The station's callsign is taken from the CALLSIGN tag in each file's header.
+
+        :arg list paths: The paths to the Cabrillo files.
+        :arg int workers: The number of worker processes used to read the files. By default, this is the number of processors.
+        :returns: The paths of the files that could not be read, or which do not say which callsign the station used.
+        :rtype: list
+        """
+        failed = []
+        for (path, header, records) in read_files(paths, workers):
+            if(header is None):
+                failed.append(path)
+                continue
+            station = header.get("CALLSIGN") or (records and records[0].get("STATION_CALLSIGN"))
+            if(not station):
+                logging.error("The Cabrillo file %s does not say which callsign the station used." % path)
+                failed.append(path)
+                continue
+            self.add_log(station, records)
+        return failed
+
+    def check(self):
+        """ Cross-check the QSOs in every log.
+
+        :returns: The outcome of cross-checking each QSO of each station, in the order that the QSOs appear in the station's log. QSOs that could not be cross-checked (e.g. because they have no band) are left out.
+        :rtype: dict
+        """
+        # Group the QSOs by the pair of callsigns and the band. Each group holds the QSOs logged by each of the two stations, sorted by time.
+        pairs = {}
+        for entries in self.entries.values():
+            for entry in entries:
+                key = (min(entry.station, entry.call), max(entry.station, entry.call), entry.band)
+                pairs.setdefault(key, {}).setdefault(entry.station, []).append(entry)
+
+        results = dict([(station, {}) for station in self.entries])
+        unmatched = []
+        for ((a, b, band), sides) in pairs.items():
+            if(a == b):
+                continue  # The station logged its own callsign.
+            entries_a = sorted(sides.get(a, []), key=lambda e: e.time)
+            entries_b = sorted(sides.get(b, []), key=lambda e: e.time)
+            for (entry, partner) in self.match(entries_a, entries_b):
+                if(partner is None):
+                    unmatched.append(entry)
+                elif(entry.rcvd != partner.sent):
+                    results[entry.station][entry.index] = Result(entry.station, self.logs[entry.station][entry.index], BUSTED_EXCHANGE, " ".join(partner.sent))
+                else:
+                    results[entry.station][entry.index] = Result(entry.station, self.logs[entry.station][entry.index], MATCHED, "")
+
+        # Find out why the other QSOs did not match.
+        unmatched_by_call = {}  # The unmatched QSOs made with each station on each band, sorted by time. These might be QSOs whose callsign was copied wrongly by the other station.
+        for entry in unmatched:
+            unmatched_by_call.setdefault((entry.call, entry.band), []).append(entry)
+        unmatched_times = {}  # The times of the QSOs in unmatched_by_call, which are searched with bisect.
+        for (key, entries) in unmatched_by_call.items():
+            entries.sort(key=lambda e: e.time)
+            unmatched_times[key] = [e.time for e in entries]
+        workers = {}  # The number of stations that worked each callsign.
+        for entries in self.entries.values():
+            for call in set([e.call for e in entries]):
+                workers[call] = workers.get(call, 0) + 1
+
+        for entry in unmatched:
+            (status, detail) = self.classify(entry, unmatched_by_call, unmatched_times, workers)
+            results[entry.station][entry.index] = Result(entry.station, self.logs[entry.station][entry.index], status, detail)
+
+        return dict([(station, [r[i] for i in sorted(r.keys())]) for (station, r) in results.items()])
+
+    def match(self, entries_a, entries_b):
+        """ Match up the QSOs that two stations logged with each other on a band. Each QSO is matched with the closest (in time) QSO in the other station's log that has not already been matched, as long as it is within the time tolerance.
+
+        :arg list entries_a: The QSOs logged by the first station, sorted by time.
+        :arg list entries_b: The QSOs logged by the second station, sorted by time.
+        :returns: An iterator over the (QSO, matching QSO) pairs of every QSO of both stations. The matching QSO is None if there is no match.
+        """
+        times_b = [e.time for e in entries_b]
+        matched_b = [False]*len(entries_b)
+        for entry in entries_a:
+            start = bisect.bisect_left(times_b, entry.time - self.tolerance)
+            end = bisect.bisect_right(times_b, entry.time + self.tolerance)
+            candidates = [j for j in range(start, end) if not matched_b[j]]
+            if(candidates):
+                j = min(candidates, key=lambda j: abs(times_b[j] - entry.time))
+                matched_b[j] = True
+                yield (entry, entries_b[j])
+                yield (entries_b[j], entry)
+            else:
+                yield (entry, None)
+        for j in range(len(entries_b)):
+            if(not matched_b[j]):
+                yield (entries_b[j], None)
+        return
+
+    def classify(self, entry, unmatched_by_call, unmatched_times, workers):
+        """ Find out why a QSO did not match a QSO in the other station's log.
+
+        :arg Entry entry: The QSO.
+        :arg dict unmatched_by_call: The unmatched QSOs made with each (callsign, band), sorted by time.
+        :arg dict unmatched_times: The times of the QSOs in unmatched_by_call, for each (callsign, band).
+        :arg dict workers: The number of stations that worked each callsign.
+        :returns: The status of the QSO (BUSTED_CALL, NOT_IN_LOG, UNIQUE or UNCHECKED), and the true callsign if it is BUSTED_CALL.
+        :rtype: tuple
+        """
+        # A station with a similar callsign may have logged a QSO with this station at the same time, in which case this station copied the callsign wrongly.
+        key = (entry.station, entry.band)
+        candidates = unmatched_by_call.get(key, [])
+        times = unmatched_times.get(key, [])
+        start = bisect.bisect_left(times, entry.time - self.tolerance)
+        end = bisect.bisect_right(times, entry.time + self.tolerance)
+        for j in range(start, end):
+            other = candidates[j]
+            if(other.station != entry.call and distance(other.station, entry.call) <= MAXIMUM_CALL_DISTANCE):
+                return (BUSTED_CALL, other.station)
+
+        if(entry.call in self.entries):
+            return (NOT_IN_LOG, "")
+        elif(workers.get(entry.call, 0) <= 1):
+            return (UNIQUE, "")
+        return (UNCHECKED, "")
+
+    def summary(self, results):
+        """ Count the QSOs of each station with each status.
+
+        :arg dict results: The results, as returned by the check method.
+        :returns: The number of QSOs with each status, for each station.
+        :rtype: dict
+        """
+        counts = {}
+        for (station, station_results) in results.items():
+            counts[station] = dict([(status, 0) for status in [MATCHED, UNCHECKED, BUSTED_EXCHANGE, BUSTED_CALL, NOT_IN_LOG, UNIQUE]])
+            for result in station_results:
+                counts[station][result.status] += 1
+        return counts
+
+
+def normalise(callsign):
+    """ Normalise a callsign for cross-checking.
+
+    :arg str callsign: The callsign.
+    :returns: The callsign in upper case, with any surrounding whitespace removed.
+    :rtype: str
+    """
+    return (callsign or "").strip().upper()
+
+
+def exchange(text):
+    """ Normalise an exchange for cross-checking.
+
+    :arg str text: The exchange (e.g. "59 014").
+    :returns: The parts of the exchange in upper case, with leading zeros removed from numbers (e.g. ("59", "14")).
+    :rtype: tuple
+    """
+    return tuple([(part.lstrip("0") or "0") if part.isdigit() else part for part in (text or "").upper().split()])
+
+
+def distance(a, b):
+    """ Return the edit (Levenshtein) distance between two callsigns.
+
+    :arg str a: The first callsign.
+    :arg str b: The second callsign.
+    :returns: The number of characters that must be inserted, deleted or substituted to turn one callsign into the other.
+    :rtype: int
+    """
+    previous = list(range(len(b) + 1))
+    for (i, ca) in enumerate(a, start=1):
+        current = [i]
+        for (j, cb) in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (ca != cb)))
+        previous = current
+    return previous[-1]
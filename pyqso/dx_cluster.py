@@ -19,25 +19,31 @@
 
 from gi.repository import Gtk, GObject, Gdk
 import logging
-import telnetlib
 try:
     import configparser
 except ImportError:
     import ConfigParser as configparser
 import os.path
+from functools import partial
 
 from pyqso.telnet_connection_dialog import TelnetConnectionDialog
-from pyqso.auxiliary_dialogs import error
+from pyqso.cluster_connection import ClusterConnection, DISCONNECTED, WAITING
+from pyqso.spots import SpotParser, SpotStore, SpotDeduplicator, SourceStatistics, format_spot
+from pyqso.worked_before import NEW_DXCC_BAND, NEW_CALL, NEW_BAND, NEW_MODE
+from pyqso.auxiliary_dialogs import error, info
 
 BOOKMARKS_FILE = os.path.expanduser('~/.config/pyqso/bookmarks.ini')
 
+# The colours used to highlight the callsigns of needed stations, depending on their need status.
+NEED_COLOURS = {NEW_DXCC_BAND: "#cc0000", NEW_CALL: "#ce5c00", NEW_BAND: "#3465a4", NEW_MODE: "#4e9a06"}
+
 
 class DXCluster:
 
-    """ A tool for connecting to a DX cluster (specifically Telnet-based DX clusters). """
+    """ A tool for connecting to one or more DX clusters (specifically Telnet-based DX clusters). When connected to more than one DX cluster, their spots are merged into a single stream with any duplicate spots removed. """
 
     def __init__(self, application):
-        """ Set up the DX cluster, and set up a timer so that PyQSO can retrieve new data from the Telnet server every few seconds.
+        """ Set up the DX cluster tool.
 
         :arg application: The PyQSO application containing the main Gtk window, etc.
         """
@@ -46,11 +52,20 @@ class DXCluster:
 
         self.application = application
         self.builder = self.application.builder
-        self.connection = None
+        self.connections = {}  # The connections to each DX cluster, keyed by "host:port".
+
+        # The spots received from the DX clusters, which can be searched by band, mode, DX callsign and age.
+        # Each connection has its own parser, since each one may be part-way through a line.
+        self.spot_parsers = {}
+        self.spots = SpotStore()
+        self.deduplicator = SpotDeduplicator()
+        self.statistics = {}
 
         # Connect signals.
         self.builder.get_object("mitem_new").connect("activate", self.new_server)
+        self.builder.get_object("mitem_all_bookmarks").connect("activate", self.all_bookmarked_servers)
         self.builder.get_object("mitem_disconnect").connect("activate", self.telnet_disconnect)
+        self.builder.get_object("mitem_statistics").connect("activate", self.show_statistics)
         self.builder.get_object("send").connect("clicked", self.telnet_send_command)
         self.builder.get_object("command").connect("key-press-event", self.on_command_key_press)
 
@@ -58,6 +73,17 @@ class DXCluster:
         self.renderer = self.builder.get_object("renderer")
         self.buffer = self.renderer.get_buffer()
 
+        # The server's output is collected and inserted into the buffer in one go once the main loop is idle, so a burst of lines costs a single insert.
+        # Only the most recent lines are kept; the oldest lines are removed in batches.
+        self.maximum_lines = 5000  # Use 0 to keep all lines.
+        self.trim_lines = 500
+        self.pending = []
+        self.pending_marks = []  # The callsigns in the pending text that should be highlighted, and their need status.
+        self.flush_event = None
+        self.end_mark = self.buffer.create_mark("end", self.buffer.get_end_iter(), False)  # This mark stays at the end of the buffer when text is inserted there.
+        for (status, colour) in NEED_COLOURS.items():
+            self.buffer.create_tag(status, foreground=colour, weight=700)
+
         # Items whose sensitivity may change.
         self.items = {}
         self.items["CONNECT"] = self.builder.get_object("mitem_connect")
@@ -210,6 +236,17 @@ class DXCluster:
 
         return
 
+    def all_bookmarked_servers(self, widget=None):
+        """ Connect to all the bookmarked Telnet servers at once. """
+        config = configparser.ConfigParser()
+        have_config = (config.read(BOOKMARKS_FILE) != [])
+        if(not have_config):
+            logging.error("The bookmarks could not be loaded.")
+            return
+        for bookmark in config.sections():
+            self.bookmarked_server(widget, bookmark)
+        return
+
     def telnet_connect(self, host, port=23, username=None, password=None):
         """ Connect to a user-specified Telnet server.
 
@@ -227,92 +264,180 @@ class DXCluster:
             logging.warning("No port specified. Assuming default port 23...")
             port = 23  # Use the default Telnet port.
 
-        try:
-            logging.debug("Attempting connection to Telnet server %s:%d..." % (host, port))
-            self.connection = telnetlib.Telnet(host, port)
-            assert(self.connection)
-
-            if(username):
-                self.connection.read_until("login: ".encode())
-                self.connection.write((username + "\n").encode())
-            if(password):
-                self.connection.read_until("password: ".encode())
-                self.connection.write((password + "\n").encode())
-        except Exception as e:
-            message = "Could not create a connection to the Telnet server %s:%d. Check connection to the internets? Check connection details?" % (host, port)
-            error(parent=self.application.window, message=message)
-            logging.exception(e)
-            self.connection = None
-            return
-
-        logging.debug("Connection to %s:%d established." % (host, port))
-
+        # Any existing connection to the same server is replaced.
+        name = "%s:%d" % (host, port)
+        if(name in self.connections):
+            self.connections.pop(name).disconnect(notify=False)
+
+        # The connection is made in the background, and the server's output is passed to on_telnet_io as soon as it arrives.
+        logging.debug("Attempting connection to Telnet server %s..." % name)
+        connection = ClusterConnection(host, port, username, password, on_text=partial(self.on_telnet_io, source=name), on_state=partial(self.on_telnet_state, source=name))
+        self.connections[name] = connection
+        self.spot_parsers[name] = SpotParser()
+        if(name not in self.statistics):
+            self.statistics[name] = SourceStatistics()
+        connection.connect()
         self.set_items_sensitive(False)
 
-        self.check_io_event = GObject.timeout_add(1000, self.on_telnet_io)
-
         return
 
     def telnet_disconnect(self, widget=None):
-        """ Disconnect from a Telnet server and remove the I/O timer. """
-        if(self.connection):
-            self.connection.close()
+        """ Disconnect from all Telnet servers. """
+        for connection in self.connections.values():
+            connection.disconnect(notify=False)
+        self.connections = {}
+        self.spot_parsers = {}
+        if(self.flush_event is not None):
+            GObject.source_remove(self.flush_event)
+            self.flush_event = None
+        self.pending = []
+        self.pending_marks = []
         self.buffer.set_text("")
-        self.connection = None
         self.set_items_sensitive(True)
+        return
 
-        # Stop checking for server output once disconnected.
-        try:
-            GObject.source_remove(self.check_io_event)
-        except AttributeError:
-            # This may happen if a connection hasn't yet been established.
-            pass
+    def on_telnet_state(self, state, message, source=None):
+        """ Handle a change in the state of the connection to a Telnet server.
 
+        :arg str state: The new state of the connection.
+        :arg str message: A status message, or None.
+        :arg str source: The name of the connection.
+        """
+        if(state == DISCONNECTED):
+            # The connection could not be established (or re-established).
+            self.connections.pop(source, None)
+            self.spot_parsers.pop(source, None)
+            if(not self.connections):
+                self.set_items_sensitive(True)
+            if(message):
+                error(parent=self.application.window, message="%s Check connection to the internets? Check connection details?" % message)
+        elif(state == WAITING):
+            self.spot_parsers[source].reset()  # Any incomplete line will never be completed.
+            self.print_text("\n*** %s\n" % message)
         return
 
     def telnet_send_command(self, widget=None):
-        """ Send the user-specified command in the Gtk.Entry box to the Telnet server (if PyQSO is connected to one). """
-        if(self.connection):
+        """ Send the user-specified command in the Gtk.Entry box to all the Telnet servers that PyQSO is connected to. """
+        if(self.connections):
             command = self.builder.get_object("command")
-            self.connection.write((command.get_text() + "\n").encode())
+            for connection in self.connections.values():
+                connection.send(command.get_text() + "\n")
             command.set_text("")
         return
 
-    def on_telnet_io(self):
-        """ Retrieve any new data from the Telnet server and print it out in the Gtk.TextView widget.
+    def show_statistics(self, widget=None):
+        """ Show the number of spots received from each DX cluster, the rate at which they arrived, and how far behind the other DX clusters each one was. """
+        lines = []
+        for name in sorted(self.statistics.keys()):
+            statistics = self.statistics[name]
+            lines.append("%s: %d spots (%d first, %d duplicates), %.1f spots/minute, %.1f seconds behind on average." % (name, statistics.spots, statistics.first, statistics.duplicates, statistics.rate(), statistics.mean_lag))
+        if(not lines):
+            lines.append("No spots have been received.")
+        info(parent=self.application.window, message="\n".join(lines))
+        return
+
+    def on_telnet_io(self, text, source=None):
+        """ Handle new data from a Telnet server. Any new spots are stored (duplicates are only counted), and the text is queued up to be printed in the Gtk.TextView widget.
+        When connected to more than one server, only the merged stream of unique spots is printed. The callsigns of needed stations are highlighted.
+
+        :arg str text: The text received from the server.
+        :arg str source: The name of the connection.
+        """
+        if(source not in self.spot_parsers):
+            self.spot_parsers[source] = SpotParser()
+        if(source not in self.statistics):
+            self.statistics[source] = SourceStatistics()
+
+        aggregate = (len(self.connections) > 1)
+        for spot in self.spot_parsers[source].feed(text):
+            earlier = self.deduplicator.check(spot, source)
+            self.statistics[source].record(spot, source, earlier)
+            if(earlier is None):
+                self.spots.add(spot)
+                if(aggregate):
+                    self.print_text(format_spot(spot))
+            if(earlier is None or not aggregate):
+                # The spot will be printed, so check whether the station is needed.
+                status = self.application.logbook.worked_before.spot_status(spot)
+                if(status in NEED_COLOURS):
+                    self.pending_marks.append((spot.dx_call, status))
+
+        if(not aggregate):
+            self.print_text(text)
+        return
+
+    def print_text(self, text):
+        """ Queue up text to be printed in the Gtk.TextView widget.
 
-        :returns: Always returns True to satisfy the GObject timer.
+        :arg str text: The text to print.
+        """
+        self.pending.append(text)
+        if(self.flush_event is None):
+            self.flush_event = GObject.idle_add(self.flush_output)
+        return
+
+    def flush_output(self):
+        """ Print out all the queued data from the Telnet server in the Gtk.TextView widget, highlight any needed stations, and remove the oldest lines if there are too many.
+
+        :returns: False, so that the callback is only called once.
         :rtype: bool
         """
-        if(self.connection):
-            text = self.connection.read_very_eager()
-            text = text.decode("ascii", "replace")  # Replace any characters that cannot be decoded with a replacement marker.
-            try:
-                text = text.replace("\u0007", "")  # Remove the BEL Unicode character from the end of the line
-            except UnicodeDecodeError:
-                pass
-
-            # Allow auto-scrolling to the new text entry if the focus is already at
-            # the very end of the Gtk.TextView. Otherwise, don't auto-scroll
-            # in case the user is reading something further up.
-            # Note: This is based on the code from http://forums.gentoo.org/viewtopic-t-445598-view-next.html
-            end_iter = self.buffer.get_end_iter()
-            end_mark = self.buffer.create_mark(None, end_iter)
-            self.renderer.move_mark_onscreen(end_mark)
-            at_end = self.buffer.get_iter_at_mark(end_mark).equal(end_iter)
-            self.buffer.insert(end_iter, text)
-            if(at_end):
-                end_mark = self.buffer.create_mark(None, end_iter)
-                self.renderer.scroll_mark_onscreen(end_mark)
-
-        return True
+        self.flush_event = None
+        if(not self.pending):
+            return False
+        text = "".join(self.pending)
+        self.pending = []
+
+        # Allow auto-scrolling to the new text entry if the focus is already at
+        # the very end of the Gtk.TextView. Otherwise, don't auto-scroll
+        # in case the user is reading something further up.
+        # Note: This is based on the code from http://forums.gentoo.org/viewtopic-t-445598-view-next.html
+        end_iter = self.buffer.get_end_iter()
+        self.buffer.move_mark(self.end_mark, end_iter)
+        self.renderer.move_mark_onscreen(self.end_mark)
+        at_end = self.buffer.get_iter_at_mark(self.end_mark).equal(end_iter)
+        offset = end_iter.get_offset()
+        self.buffer.insert(end_iter, text)
+
+        if(self.pending_marks):
+            self.highlight(self.buffer.get_iter_at_offset(offset), self.pending_marks)
+            self.pending_marks = []
+
+        line_count = self.buffer.get_line_count()
+        if(self.maximum_lines and line_count > self.maximum_lines + self.trim_lines):
+            self.buffer.delete(self.buffer.get_start_iter(), self.buffer.get_iter_at_line(line_count - self.maximum_lines))
+
+        if(at_end):
+            self.buffer.move_mark(self.end_mark, self.buffer.get_end_iter())
+            self.renderer.scroll_mark_onscreen(self.end_mark)
+
+        return False
+
+    def highlight(self, start, marks):
+        """ Highlight the callsigns of needed stations in the text that has just been printed.
+
+        :arg Gtk.TextIter start: The start of the new text. The search starts at the beginning of this line, since the first spot may have begun in text that was printed earlier.
+        :arg list marks: The callsigns to highlight and their need status, in the order in which they appear in the text.
+        """
+        start.set_line_offset(0)
+        for (call, status) in marks:
+            # The spotted callsign is always surrounded by whitespace, unlike the spotter's callsign (which is followed by a colon).
+            match = start.forward_search(" %s " % call, Gtk.TextSearchFlags.CASE_INSENSITIVE, None)
+            if(match is None):
+                continue
+            (match_start, match_end) = match
+            match_start.forward_char()
+            match_end.backward_char()
+            self.buffer.apply_tag_by_name(status, match_start, match_end)
+            start = match_end
+        return
 
     def set_items_sensitive(self, sensitive):
-        """ Enable/disable the relevant buttons for connecting/disconnecting from a DX cluster, so that users cannot click the connect button if PyQSO is already connected.
+        """ Enable/disable the relevant buttons for disconnecting from the DX clusters and sending commands to them, so that users can only click them if PyQSO is connected to at least one DX cluster. Further connections can always be made.
 
-        :arg bool sensitive: If True, enable the Connect button and disable the Disconnect button. If False, vice versa.
+        :arg bool sensitive: If True, disable the Disconnect and Send buttons (because there are no connections). If False, enable them.
         """
-        self.items["CONNECT"].set_sensitive(sensitive)
+        self.items["CONNECT"].set_sensitive(True)
         self.items["DISCONNECT"].set_sensitive(not sensitive)
         self.items["SEND"].set_sensitive(not sensitive)
         return
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sqlite3 as sqlite
+import csv
+import threading
+from collections import OrderedDict
+from os.path import expanduser, join, realpath, dirname
+from importlib.util import find_spec
+
+# The geocoder module (and its dependencies) take a long time to import, so it is only imported by the first online lookup.
+geocoder = None
+have_geocoder = (find_spec("geocoder") is not None)
+if(not have_geocoder):
+    logging.warning("Could not find the geocoder module!")
+
+GEOCODING_CACHE_FILE = expanduser("~/.config/pyqso/geocoding.db")
+COUNTRY_CENTROIDS_FILE = join(realpath(dirname(__file__)), "res", "country_centroids.csv")
+DXCC_PREFIXES_FILE = join(realpath(dirname(__file__)), "res", "dxcc_prefixes.csv")
+
+
+class Geocoder:
+
+    """ Look up the latitude-longitude coordinates of countries and other locations. Lookups are answered, in order, by an in-memory LRU cache, the bundled table of country centroids, and a persistent on-disk cache. Only locations that are not found in any of these are looked up online (off the main thread). """
+
+    def __init__(self, path=GEOCODING_CACHE_FILE, maximum_size=4096):
+        """ Load the bundled country centroid and callsign prefix tables, and connect to the on-disk cache.
+
+        :arg str path: The path of the SQLite database file used as the persistent cache. If None, nothing is persisted.
+        :arg int maximum_size: The maximum number of entries in the in-memory LRU cache.
+        """
+
+        self.maximum_size = maximum_size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.centroids = {}
+        with open(COUNTRY_CENTROIDS_FILE) as f:
+            for row in csv.DictReader(f):
+                self.centroids[normalise(row["country"])] = (float(row["latitude"]), float(row["longitude"]))
+
+        self.prefixes = {}
+        with open(DXCC_PREFIXES_FILE) as f:
+            for row in csv.DictReader(f):
+                self.prefixes[row["prefix"]] = row["country"]
+        self.longest_prefix = max([len(prefix) for prefix in self.prefixes.keys()])
+
+        self.connection = None
+        if(path is not None):
+            try:
+                # The cache may be written to by the thread that performs online lookups.
+                self.connection = sqlite.connect(path, check_same_thread=False)
+                with self.connection:
+                    self.connection.execute("CREATE TABLE IF NOT EXISTS locations (name TEXT PRIMARY KEY, latitude REAL, longitude REAL)")
+            except sqlite.Error as e:
+                logging.error("Could not open the geocoding cache. Coordinates looked up online will not be remembered.")
+                logging.exception(e)
+                self.connection = None
+
+        return
+
+    def lookup(self, name):
+        """ Look up the coordinates of a location without going online.
+
+        :arg str name: The name of the location (e.g. a country).
+        :returns: The latitude-longitude coordinates, or None if the location is not known offline.
+        :rtype: tuple
+        """
+
+        key = normalise(name)
+        if(not key):
+            return None
+
+        with self.lock:
+            if(key in self.lru):
+                self.lru.move_to_end(key)
+                return self.lru[key]
+
+        coordinates = self.centroids.get(key)
+        if(coordinates is None and self.connection is not None):
+            try:
+                with self.lock:
+                    c = self.connection.cursor()
+                    c.execute("SELECT latitude, longitude FROM locations WHERE name=?", [key])
+                    result = c.fetchone()
+                if(result is not None):
+                    coordinates = (result[0], result[1])
+            except sqlite.Error as e:
+                logging.exception(e)
+
+        if(coordinates is not None):
+            self.remember(key, coordinates)
+        return coordinates
+
+    def lookup_callsign(self, callsign):
+        """ Find the coordinates of the country that a callsign belongs to, using the longest matching prefix in the bundled prefix table.
+
+        :arg str callsign: The callsign, possibly with a location prefix (e.g. "F/MYCALL") or suffix (e.g. "MYCALL/P").
+        :returns: The country name and its latitude-longitude coordinates, or None if no prefix matched.
+        :rtype: tuple
+        """
+        country = self.get_country(callsign)
+        if(country is None):
+            return None
+        coordinates = self.lookup(country)
+        if(coordinates is None):
+            return None
+        return (country, coordinates)
+
+    def get_country(self, callsign):
+        """ Find the country that a callsign belongs to, using the longest matching prefix in the bundled prefix table.
+
+        :arg str callsign: The callsign.
+        :returns: The name of the country, or None if no prefix matched.
+        :rtype: str
+        """
+        if(not callsign):
+            return None
+        call = location_prefix(callsign.upper())
+        for length in range(min(len(call), self.longest_prefix), 0, -1):
+            country = self.prefixes.get(call[:length])
+            if(country is not None):
+                return country
+        return None
+
+    def store(self, name, coordinates):
+        """ Remember the coordinates of a location, both in memory and on disk.
+
+        :arg str name: The name of the location.
+        :arg tuple coordinates: The latitude-longitude coordinates.
+        """
+        key = normalise(name)
+        self.remember(key, coordinates)
+        if(self.connection is not None):
+            try:
+                with self.lock:
+                    with self.connection:
+                        self.connection.execute("INSERT OR REPLACE INTO locations VALUES (?, ?, ?)", [key, coordinates[0], coordinates[1]])
+            except sqlite.Error as e:
+                logging.exception(e)
+        return
+
+    def remember(self, key, coordinates):
+        """ Add an entry to the in-memory LRU cache, evicting the least-recently used entry if the cache is full. """
+        with self.lock:
+            self.lru[key] = coordinates
+            self.lru.move_to_end(key)
+            while(len(self.lru) > self.maximum_size):
+                self.lru.popitem(last=False)
+        return
+
+    def lookup_online(self, name, callback, dispatch=None):
+        """ Look up the coordinates of a location online in a separate thread, so that the GUI is not blocked. Successful lookups are stored in the cache.
+
+        :arg str name: The name of the location.
+        :arg callback: The function to call with the location's name and its coordinates (or None if the lookup failed).
+        :arg dispatch: An optional function used to run the callback on another thread, e.g. GObject.idle_add to run it on the Gtk main loop. By default, the callback is called from the lookup thread.
+        :returns: The thread performing the lookup, or None if the geocoder module is not available.
+        """
+
+        if(not have_geocoder):
+            logging.warning("The geocoder module is not available, so '%s' cannot be looked up online." % name)
+            return None
+
+        def worker():
+            global geocoder
+            coordinates = None
+            try:
+                if(geocoder is None):
+                    import geocoder
+                g = geocoder.google(name)
+                latitude, longitude = g.latlng
+                coordinates = (latitude, longitude)
+                logging.debug("Coordinates for '%s' found online: (%s, %s)", name, str(latitude), str(longitude))
+                self.store(name, coordinates)
+            except ValueError:
+                logging.exception("Unable to lookup the coordinates of '%s'." % name)
+            except Exception:
+                logging.exception("Unable to lookup the coordinates of '%s'. Check connection to the internets? Lookup limit reached?" % name)
+            if(dispatch is not None):
+                dispatch(callback, name, coordinates)
+            else:
+                callback(name, coordinates)
+
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def normalise(name):
+    """ Normalise the name of a location for use as a cache key.
+
+    :arg str name: The name of the location.
+    :returns: The name in lower case, with any surrounding whitespace removed.
+    :rtype: str
+    """
+    if(name is None):
+        return ""
+    return " ".join(name.split()).lower()
+
+
+def location_prefix(callsign):
+    """ Return the part of a callsign that identifies the operator's location. For example, "F/MYCALL" is operating from France, whereas the suffix of "MYCALL/P" is ignored.
+
+    :arg str callsign: The callsign (in upper case).
+    :returns: The part of the callsign whose prefix determines the location.
+    :rtype: str
+    """
+    suffixes = ["P", "M", "A", "PM", "MM", "AM", "QRP"]
+    components = [c for c in callsign.split("/") if c and c not in suffixes and not c.isdigit()]  # A call area (e.g. the "4" in "W1AW/4") does not change the country.
+    if(not components):
+        return callsign
+    if(len(components) == 1):
+        return components[0]
+    # A location prefix (e.g. "F" or "HB9") is usually shorter than the home callsign.
+    return min(components[:2], key=len)
@@ -22,17 +22,19 @@ import logging
 import sqlite3 as sqlite
 
 from pyqso.adif import AVAILABLE_FIELD_NAMES_ORDERED
+from pyqso.worked_before import INDEXED_FIELDS
 
 
 class Log(Gtk.ListStore):
 
     """ A single log inside of the whole logbook. A Log object can store multiple records. This is """
 
-    def __init__(self, connection, name):
+    def __init__(self, connection, name, worked_before=None):
         """ Set up a new Log object.
 
         :arg connection: An sqlite database connection.
         :arg str name: The name of the log (i.e. the database table name).
+        :arg WorkedBefore worked_before: The logbook's index of worked stations, which is kept up-to-date as records are added, edited and deleted. This is an optional argument.
         """
 
         # The ListStore constructor needs to know the data types of the columns.
@@ -43,6 +45,7 @@ class Log(Gtk.ListStore):
 
         self.connection = connection
         self.name = name
+        self.worked_before = worked_before
 
         return
 
@@ -178,6 +181,9 @@ class Log(Gtk.ListStore):
                         liststore_entry.append("")
                 self.append(liststore_entry)
 
+        if(self.worked_before is not None):
+            self.worked_before.add(fields_and_data)
+
         logging.debug("Successfully added the record(s) to the log.")
         return
 
@@ -190,12 +196,19 @@ class Log(Gtk.ListStore):
         """
         logging.debug("Deleting record from log...")
 
+        # The record's current contents are needed to remove it from the index of worked stations.
+        if(self.worked_before is not None):
+            record = self.get_record_by_index(index)
+
         # Delete the selected row in database.
         with self.connection:
             c = self.connection.cursor()
             query = "DELETE FROM %s" % self.name
             c.execute(query+" WHERE id=?", [index])
 
+        if(self.worked_before is not None and record is not None):
+            self.worked_before.remove(record)
+
         # Delete the selected row in the Gtk.ListStore.
         if(iter is not None):
             self.remove(iter)
@@ -214,11 +227,17 @@ class Log(Gtk.ListStore):
         :raises sqlite.Error, IndexError: If the record could not be edited.
         """
         logging.debug("Editing field '%s' in record %d..." % (field_name, index))
+        reindex = (self.worked_before is not None and field_name.upper() in INDEXED_FIELDS)
+        if(reindex):
+            record = self.get_record_by_index(index)
         with self.connection:
             c = self.connection.cursor()
             query = "UPDATE %s SET %s" % (self.name, field_name)
             query = query + "=? WHERE id=?"
             c.execute(query, [data, index])  # First update the SQL database...
+        if(reindex and record is not None):
+            self.worked_before.remove(record)
+            self.worked_before.add(self.get_record_by_index(index))
         if(iter is not None and column_index is not None):
             self.set(iter, column_index, data)  # ...and then the ListStore.
         logging.debug("Successfully edited field '%s' in record %d in the log." % (field_name, index))
@@ -307,6 +326,33 @@ class Log(Gtk.ListStore):
             c.execute(query, [index])
             return c.fetchone()
 
+    def get_records_by_index_range(self, first, last):
+        """ Return the records whose indices lie in a given range.
+
+        :arg int first: The index of the first record in the range.
+        :arg int last: The index of the last record in the range.
+        :returns: The records in the range, sorted by index. Each record is represented by a dictionary.
+        :rtype: list
+        :raises sqlite.Error: If the records could not be retrieved from the database.
+        """
+        with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT * FROM %s WHERE id BETWEEN ? AND ? ORDER BY id" % self.name, [first, last])
+            return c.fetchall()
+
+    @property
+    def indices(self):
+        """ Return the indices of all the records in the log, in ascending order.
+
+        :returns: The indices of all the records in the log.
+        :rtype: list
+        :raises sqlite.Error: If the indices could not be retrieved from the database.
+        """
+        with self.connection:
+            c = self.connection.cursor()
+            c.execute("SELECT id FROM %s ORDER BY id" % self.name)
+            return [row[0] for row in c]
+
     @property
     def records(self):
         """ Return a list of all the records in the log.
@@ -320,6 +366,16 @@ class Log(Gtk.ListStore):
             c.execute("SELECT * FROM %s" % self.name)
             return c.fetchall()
 
+    def iter_records(self):
+        """ Iterate over all the records in the log, fetching them from the database as they are needed rather than all at once.
+
+        :returns: An iterator over all the records in the log. Each record is represented by a dictionary.
+        :raises sqlite.Error: If the records could not be retrieved from the database.
+        """
+        c = self.connection.cursor()
+        c.execute("SELECT * FROM %s" % self.name)
+        return iter(c)
+
     @property
     def record_count(self):
         """ Return the total number of records in the log.
@@ -21,11 +21,6 @@ from gi.repository import Gtk
 import logging
 import sqlite3 as sqlite
 import json
-from os.path import expanduser
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
 
 from pyqso.adif import *
 from pyqso.cabrillo import *
@@ -38,6 +33,10 @@ from pyqso.summary import Summary
 from pyqso.blank import Blank
 from pyqso.printer import Printer
 from pyqso.compare import compare_date_and_time, compare_default
+from pyqso.worked_before import WorkedBefore
+from pyqso.callsign_lookup import get_lookup_settings
+from pyqso.callsign_enrichment import CallsignEnrichment
+from pyqso.preferences import preferences
 
 
 class Logbook:
@@ -56,6 +55,25 @@ class Logbook:
         self.connection = None
         self.logs = []
 
+        # An index of the stations worked in all the logs, used to find out whether a spotted station is needed.
+        self.worked_before = WorkedBefore()
+
+        # Show/hide the fields of each log as soon as they are changed in the preferences.
+        self.treeview = []
+        preferences.subscribe(self.on_preferences_changed)
+
+        return
+
+    def on_preferences_changed(self, changed):
+        """ Show/hide the columns of every open log if the visible fields have been changed in the preferences.
+
+        :arg set changed: The (section, option) tuples of the preferences that have changed.
+        """
+        if(any(section == "view" for (section, option) in changed)):
+            for treeview in self.treeview:
+                columns = treeview.get_columns()
+                for i in range(len(AVAILABLE_FIELD_NAMES_ORDERED)):
+                    columns[i+1].set_visible(preferences.getboolean("view", AVAILABLE_FIELD_NAMES_ORDERED[i].lower(), fallback=True))  # The first column is the record index.
         return
 
     def new(self, widget=None):
@@ -131,6 +149,8 @@ class Logbook:
 
             logging.debug("All logs retrieved successfully.")
 
+            self.worked_before.load(self.logs)
+
             logging.debug("Rendering logs...")
             # For rendering the logs. One treeview and one treeselection per Log.
             self.treeview = []
@@ -149,7 +169,8 @@ class Logbook:
             logging.debug("All logs rendered successfully.")
 
             self.summary.update()
-            self.application.toolbox.awards.count(self)
+            self.application.toolbox.count_awards(self)
+            self.application.toolbox.count_grid_squares(self)
 
             context_id = self.application.statusbar.get_context_id("Status")
             self.application.statusbar.push(context_id, "Logbook: %s" % self.path)
@@ -181,6 +202,7 @@ class Logbook:
                 # so a 'for' loop isn't the best option here.
                 self.notebook.remove_page(0)
             logging.debug("All logs now closed.")
+            self.worked_before.clear()
 
             context_id = self.application.statusbar.get_context_id("Status")
             self.application.statusbar.push(context_id, "No logbook is currently open.")
@@ -290,7 +312,7 @@ class Logbook:
         ln.dialog.destroy()
 
         # Instantiate and populate a new Log object.
-        l = Log(self.connection, log_name)
+        l = Log(self.connection, log_name, self.worked_before)
         l.populate()
 
         self.logs.append(l)
@@ -347,9 +369,11 @@ class Logbook:
             # And finally remove the tab in the Logbook.
             self.notebook.set_current_page(page_index - 1)
             self.notebook.remove_page(page_index)
+            self.worked_before.load(self.logs)
 
         self.summary.update()
-        self.application.toolbox.awards.count(self)
+        self.application.toolbox.count_awards(self)
+        self.application.toolbox.count_grid_squares(self)
         return
 
     def filter_logs(self, widget=None):
@@ -449,11 +473,7 @@ class Logbook:
 
             column.connect("clicked", self.sort_log, i+1)
 
-            config = configparser.ConfigParser()
-            have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
-            (section, option) = ("view", AVAILABLE_FIELD_NAMES_ORDERED[i].lower())
-            if(have_config and config.has_option(section, option)):
-                column.set_visible(config.getboolean(section, option))
+            column.set_visible(preferences.getboolean("view", AVAILABLE_FIELD_NAMES_ORDERED[i].lower(), fallback=True))
             self.treeview[index].append_column(column)
 
         self.notebook.show_all()
@@ -625,7 +645,7 @@ class Logbook:
                                 query = query + s
                             query = query + ")"
                             c.execute(query)
-                            l = Log(self.connection, log_name)
+                            l = Log(self.connection, log_name, self.worked_before)
                             break
                     except sqlite.Error as e:
                         logging.exception(e)
@@ -647,7 +667,8 @@ class Logbook:
 
         # Update statistics, etc.
         self.summary.update()
-        self.application.toolbox.awards.count(self)
+        self.application.toolbox.count_awards(self)
+        self.application.toolbox.update_grid_squares(added=[r.get("GRIDSQUARE") for r in records])
 
         info(parent=self.application.window, message="Imported %d QSOs into log '%s'." % (len(records), l.name))
 
@@ -766,19 +787,14 @@ class Logbook:
                 return
             ced.dialog.destroy()
 
-            # Retrieve the log's records from the database.
+            # Write the records, streaming them from the database as they are written.
+            cabrillo = Cabrillo()
             try:
-                records = log.records
+                count = cabrillo.write(log.iter_records(), path, contest=contest, mycall=mycall)
+                info(parent=self.application.window, message="Exported %d QSOs to %s in Cabrillo format." % (count, path))
             except sqlite.Error as e:
                 logging.exception(e)
-                error(parent=self.application.window, message="Could not retrieve the records from the SQL database. No records have been exported.")
-                return
-
-            # Write the records.
-            cabrillo = Cabrillo()
-            try:
-                cabrillo.write(records, path, contest=contest, mycall=mycall)
-                info(parent=self.application.window, message="Exported %d QSOs to %s in Cabrillo format." % (len(records), path))
+                error(parent=self.application.window, message="Could not retrieve the records from the SQL database. The Cabrillo file is incomplete.")
             except IOError as e:
                 error(parent=self.application.window, message="Could not export the records. I/O error %d: %s" % (e.errno, e.strerror))
             except Exception as e:  # All other exceptions.
@@ -801,18 +817,15 @@ class Logbook:
             return
         log = self.logs[log_index]
 
-        # Retrieve the records.
+        # Print the records. These are retrieved from the database one page at a time.
+        printer = Printer(self.application)
         try:
-            records = log.records
+            printer.print_log(log, title="Log: %s" % log.name)
         except sqlite.Error as e:
             logging.exception(e)
             error(parent=self.application.window, message="Could not retrieve the records from the SQL database. No records have been printed.")
             return
 
-        # Print the records.
-        printer = Printer(self.application)
-        printer.print_records(records, title="Log: %s" % log.name)
-
         return
 
     def add_record_callback(self, widget):
@@ -828,13 +841,7 @@ class Logbook:
         log = self.logs[log_index]
 
         # Keep the dialog open after adding a record?
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
-        (section, option) = ("general", "keep_open")
-        if(have_config and config.has_option(section, option)):
-            keep_open = config.getboolean("general", "keep_open")
-        else:
-            keep_open = False
+        keep_open = preferences.getboolean("general", "keep_open", fallback=False)
 
         adif = ADIF()
 
@@ -872,6 +879,7 @@ class Logbook:
                         # All data has been validated, so we can go ahead and add the new record.
                         try:
                             log.add_record(fields_and_data)
+                            self.application.toolbox.update_grid_squares(added=[fields_and_data["GRIDSQUARE"]])
                         except (sqlite.Error, IndexError) as e:
                             logging.exception(e)
                             error(parent=self.application.window, message="Could not add the record to the log.")
@@ -886,7 +894,7 @@ class Logbook:
 
                         # Update summary, etc.
                         self.summary.update()
-                        self.application.toolbox.awards.count(self)
+                        self.application.toolbox.count_awards(self)
 
                 else:
                     exit = True
@@ -923,14 +931,16 @@ class Logbook:
             # Deletes the record with index 'row_index' from the Records list.
             # 'iter' is needed to remove the record from the ListStore itself.
             try:
+                gridsquare = log.get_record_by_index(row_index)["gridsquare"]
                 log.delete_record(row_index, iter=child_iter)
+                self.application.toolbox.update_grid_squares(removed=[gridsquare])
             except (sqlite.Error, IndexError) as e:
                 logging.exception(e)
                 error(parent=self.application.window, message="Could not delete the record from the log.")
 
             # Update summary, etc.
             self.summary.update()
-            self.application.toolbox.awards.count(self)
+            self.application.toolbox.count_awards(self)
 
         return
 
@@ -993,13 +1003,15 @@ class Logbook:
                                 # Update the record in the database and then in the ListStore.
                                 # We add 1 onto the column_index here because we don't want to consider the index column.
                                 log.edit_record(row_index, field_names[i], fields_and_data[field_names[i]], iter=child_iter, column_index=i+1)
+                        if(record["gridsquare"] != fields_and_data["GRIDSQUARE"]):
+                            self.application.toolbox.update_grid_squares(added=[fields_and_data["GRIDSQUARE"]], removed=[record["gridsquare"]])
                     except(sqlite.Error, IndexError) as e:
                         logging.exception(e)
                         error(parent=rd.dialog, message="Could not edit record %d." % row_index)
 
                     # Update summary, etc.
                     self.summary.update()
-                    self.application.toolbox.awards.count(self)
+                    self.application.toolbox.count_awards(self)
 
         rd.dialog.destroy()
         return
@@ -1026,7 +1038,8 @@ class Logbook:
         if(number_of_duplicates_removed > 0):
             # Update statistics.
             self.summary.update()
-            self.application.toolbox.awards.count(self)
+            self.application.toolbox.count_awards(self)
+            self.application.toolbox.count_grid_squares(self)
 
         return
 
@@ -1053,6 +1066,65 @@ class Logbook:
 
         return
 
+    def enrich_log_callback(self, widget=None):
+        """ A callback function used to fill in the empty callsign-related fields (e.g. NAME and COUNTRY) of every record in the selected log, by looking up the callsigns in an online database. """
+
+        # Get the log index.
+        try:
+            log_index = self.get_log_index()
+            if(log_index is None):
+                raise ValueError("The log index could not be determined. Perhaps the Summary page is selected?")
+        except ValueError as e:
+            error(parent=self.application.window, message=e)
+            return
+        log = self.logs[log_index]
+
+        try:
+            (database, username, password, ignore_prefix_suffix) = get_lookup_settings(self.application.callsign_lookup.cache)
+        except ValueError as e:
+            error(parent=self.application.window, message=str(e))
+            return
+
+        job = CallsignEnrichment(log, self.application.callsign_lookup, database, username, password, ignore_prefix_suffix=ignore_prefix_suffix)
+
+        # Show the progress of the job, and allow the user to stop it. The job can be resumed later.
+        dialog = Gtk.Dialog(title="Looking Up Callsigns", parent=self.application.window, flags=Gtk.DialogFlags.MODAL)
+        dialog.add_button("Stop", Gtk.ResponseType.CANCEL)
+        dialog.connect("response", lambda widget, response: job.cancel())
+        dialog.connect("delete-event", lambda widget, event: job.cancel() or True)
+        progress_bar = Gtk.ProgressBar(show_text=True)
+        dialog.get_content_area().pack_start(progress_bar, True, True, 6)
+        dialog.show_all()
+
+        def progress(done, total):
+            progress_bar.set_fraction(float(done)/total if total else 1)
+            progress_bar.set_text("%d of %d callsigns" % (done, total))
+            while(Gtk.events_pending()):
+                Gtk.main_iteration()
+
+        try:
+            (looked_up, filled) = job.run(progress=progress)
+        except sqlite.Error as e:
+            logging.exception(e)
+            dialog.destroy()
+            error(parent=self.application.window, message="Could not update the records in '%s' because of a database error." % log.name)
+            return
+        dialog.destroy()
+
+        if(filled > 0):
+            log.populate()
+            self.worked_before.load(self.logs)
+            self.summary.update()
+            self.application.toolbox.count_awards(self)
+
+        message = "Looked up %d callsign(s) and filled in %d field(s) in '%s'." % (looked_up, filled, log.name)
+        if(job.cancelled):
+            message += " The job was stopped before all the callsigns were looked up. Run it again to continue."
+        if(job.errors):
+            message += " %d lookup(s) returned an error." % len(job.errors)
+        info(parent=self.application.window, message=message)
+        return
+
     def pinpoint_callback(self, widget=None, path=None):
         """ A callback function used to pinpoint the callsign on the world map. """
 
@@ -1095,6 +1167,7 @@ class Logbook:
     def clipboard_text_received(self, clipboard, text, log):
         r = json.loads(text)
         log.add_record(r)
+        self.application.toolbox.update_grid_squares(added=[r.get("GRIDSQUARE")])
         return
 
     def paste_callback(self, widget=None, path=None):
@@ -1217,7 +1290,7 @@ class Logbook:
             c = self.connection.cursor()
             c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT GLOB 'sqlite_*'")
             for name in c:
-                l = Log(self.connection, name[0])
+                l = Log(self.connection, name[0], self.worked_before)
                 l.populate()
                 logs.append(l)
         return logs
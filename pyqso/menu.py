@@ -18,11 +18,8 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 from gi.repository import Gtk
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
-import os.path
+
+from pyqso.preferences import preferences
 
 
 class Menu:
@@ -109,15 +106,13 @@ class Menu:
         self.items["RECORD_COUNT"] = self.builder.get_object("mitem_record_count")
         self.items["RECORD_COUNT"].connect("activate", self.application.logbook.record_count_callback)
 
+        # Look up missing callsign details
+        self.items["ENRICH_LOG"] = self.builder.get_object("mitem_enrich_log")
+        self.items["ENRICH_LOG"].connect("activate", self.application.logbook.enrich_log_callback)
+
         # View toolbox
         self.items["TOOLBOX"] = self.builder.get_object("mitem_toolbox")
-        config = configparser.ConfigParser()
-        have_config = (config.read(os.path.expanduser('~/.config/pyqso/preferences.ini')) != [])
-        (section, option) = ("general", "show_toolbox")
-        if(have_config and config.has_option(section, option)):
-            self.items["TOOLBOX"].set_active(config.getboolean(section, option))
-        else:
-            self.items["TOOLBOX"].set_active(False)  # Don't show the toolbox by default
+        self.items["TOOLBOX"].set_active(preferences.getboolean("general", "show_toolbox", fallback=False))  # Don't show the toolbox by default
         self.items["TOOLBOX"].connect("activate", self.application.toolbox.toggle_visible_callback)
 
         # About
@@ -157,6 +152,6 @@ class Menu:
         :arg bool sensitive: If True, enable all the record-related menu items. If False, disable them all.
         """
 
-        for item_name in ["ADD_RECORD", "EDIT_RECORD", "DELETE_RECORD", "REMOVE_DUPLICATES", "RECORD_COUNT"]:
+        for item_name in ["ADD_RECORD", "EDIT_RECORD", "DELETE_RECORD", "REMOVE_DUPLICATES", "RECORD_COUNT", "ENRICH_LOG"]:
             self.items[item_name].set_sensitive(sensitive)
         return
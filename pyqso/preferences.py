@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os.path
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+PREFERENCES_FILE = os.path.expanduser("~/.config/pyqso/preferences.ini")
+
+
+class Preferences:
+
+    """ The user's preferences. The configuration file is only read once (when a preference is first needed) and then kept in memory.
+    The preferences dialog is the only writer: it replaces the preferences with save(), and every subscriber is then told which options have changed, so that they can update any values they keep without reading the configuration file again. """
+
+    def __init__(self, path=PREFERENCES_FILE):
+        """ Set up the preferences. Nothing is read until a preference is needed.
+
+        :arg str path: The path of the configuration file.
+        """
+        self.path = path
+        self.config = None
+        self.exists = False  # Whether the configuration file could be read.
+        self.subscribers = []
+        return
+
+    def load(self):
+        """ Read the configuration file. This discards any preferences held in memory. """
+        logging.debug("Reading the preferences from %s..." % self.path)
+        self.config = configparser.ConfigParser()
+        try:
+            self.exists = (self.config.read(self.path) != [])
+        except configparser.Error as e:
+            logging.error("Could not read the preferences. Using the defaults instead.")
+            logging.exception(e)
+            self.config = configparser.ConfigParser()
+            self.exists = False
+        return
+
+    @property
+    def have_config(self):
+        """ True if the configuration file exists (and could be read), and False otherwise. """
+        if(self.config is None):
+            self.load()
+        return self.exists
+
+    def has_option(self, section, option):
+        """ Check whether a preference has been set.
+
+        :arg str section: The section of the configuration file (e.g. "records").
+        :arg str option: The name of the preference (e.g. "autocomplete_band").
+        :rtype: bool
+        """
+        if(self.config is None):
+            self.load()
+        return self.config.has_option(section, option)
+
+    def get(self, section, option, fallback=None):
+        """ Return the value of a preference as a string.
+
+        :arg str section: The section of the configuration file (e.g. "records").
+        :arg str option: The name of the preference (e.g. "default_power").
+        :arg fallback: The value returned if the preference has not been set.
+        :rtype: str
+        """
+        if(self.config is None):
+            self.load()
+        return self.config.get(section, option, fallback=fallback)
+
+    def getboolean(self, section, option, fallback=None):
+        """ Return the value of a preference as a boolean.
+
+        :arg str section: The section of the configuration file (e.g. "records").
+        :arg str option: The name of the preference (e.g. "autocomplete_band").
+        :arg fallback: The value returned if the preference has not been set.
+        :rtype: bool
+        :raises ValueError: If the value is not a boolean.
+        """
+        if(self.config is None):
+            self.load()
+        return self.config.getboolean(section, option, fallback=fallback)
+
+    def getfloat(self, section, option, fallback=None):
+        """ Return the value of a preference as a floating-point number.
+
+        :arg str section: The section of the configuration file (e.g. "world_map").
+        :arg str option: The name of the preference (e.g. "qth_latitude").
+        :arg fallback: The value returned if the preference has not been set.
+        :rtype: float
+        :raises ValueError: If the value is not a number.
+        """
+        if(self.config is None):
+            self.load()
+        return self.config.getfloat(section, option, fallback=fallback)
+
+    def save(self, config):
+        """ Replace all the preferences, write them to the configuration file, and notify the subscribers of the options that have changed.
+
+        :arg configparser.ConfigParser config: The new preferences.
+        :raises IOError, OSError: If the configuration file could not be written.
+        """
+        if(self.config is None):
+            self.load()
+        changed = set()
+        for section in set(self.config.sections()) | set(config.sections()):
+            old = dict(self.config.items(section, raw=True)) if self.config.has_section(section) else {}
+            new = dict(config.items(section, raw=True)) if config.has_section(section) else {}
+            changed.update([(section, option) for option in set(old) | set(new) if old.get(option) != new.get(option)])
+
+        with open(self.path, "w") as f:
+            config.write(f)
+        self.config = config
+        self.exists = True
+
+        if(changed):
+            logging.debug("%d preference(s) changed." % len(changed))
+            for callback in list(self.subscribers):
+                try:
+                    callback(changed)
+                except Exception as e:
+                    logging.exception(e)
+        return
+
+    def subscribe(self, callback):
+        """ Ask to be notified whenever the preferences change.
+
+        :arg callback: The function to call with the set of (section, option) tuples that have changed.
+        """
+        self.subscribers.append(callback)
+        return
+
+    def unsubscribe(self, callback):
+        """ Stop notifying a subscriber of changes to the preferences.
+
+        :arg callback: The function passed to subscribe().
+        """
+        if(callback in self.subscribers):
+            self.subscribers.remove(callback)
+        return
+
+
+# The preferences shared by the whole application.
+preferences = Preferences()
@@ -25,23 +25,21 @@ except ImportError:
     import ConfigParser as configparser
 import os.path
 import base64
+from importlib.util import find_spec
 try:
     import Hamlib
     have_hamlib = True
 except ImportError:
     logging.warning("Could not import the Hamlib module!")
     have_hamlib = False
-try:
-    import geocoder
-    have_geocoder = True
-except ImportError:
-    logging.warning("Could not import the geocoder module!")
-    have_geocoder = False
+# The geocoder module is only imported when the QTH is first looked up, since it takes a long time to import.
+have_geocoder = (find_spec("geocoder") is not None)
+if(not have_geocoder):
+    logging.warning("Could not find the geocoder module!")
 
 from pyqso.adif import AVAILABLE_FIELD_NAMES_ORDERED, MODES
 from pyqso.auxiliary_dialogs import error
-
-PREFERENCES_FILE = os.path.expanduser("~/.config/pyqso/preferences.ini")
+from pyqso.preferences import preferences
 
 
 class PreferencesDialog:
@@ -112,9 +110,8 @@ class PreferencesDialog:
         for key in list(self.world_map.data.keys()):
             config.set("world_map", key.lower(), str(self.world_map.data[key]))
 
-        # Write the preferences to file.
-        with open(os.path.expanduser(PREFERENCES_FILE), 'w') as f:
-            config.write(f)
+        # Write the preferences to file. Any part of PyQSO that depends on the preferences is notified of the changes.
+        preferences.save(config)
 
         return
 
@@ -130,32 +127,29 @@ class GeneralPage:
         self.builder = builder
         self.sources = {}
 
-        # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
-        # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        have_config = preferences.have_config
 
         # Show toolbox.
         self.sources["SHOW_TOOLBOX"] = self.builder.get_object("general_show_toolbox_checkbutton")
         (section, option) = ("general", "show_toolbox")
-        if(have_config and config.has_option(section, option)):
-            self.sources["SHOW_TOOLBOX"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["SHOW_TOOLBOX"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["SHOW_TOOLBOX"].set_active(False)
 
         # Show statistics.
         self.sources["SHOW_YEARLY_STATISTICS"] = self.builder.get_object("general_show_yearly_statistics_checkbutton")
         (section, option) = ("general", "show_yearly_statistics")
-        if(have_config and config.has_option(section, option)):
-            self.sources["SHOW_YEARLY_STATISTICS"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["SHOW_YEARLY_STATISTICS"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["SHOW_YEARLY_STATISTICS"].set_active(False)
 
         # Default logbook.
         self.sources["DEFAULT_LOGBOOK"] = self.builder.get_object("general_default_logbook_checkbutton")
         (section, option) = ("general", "default_logbook")
-        if(have_config and config.has_option(section, option)):
-            self.sources["DEFAULT_LOGBOOK"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["DEFAULT_LOGBOOK"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["DEFAULT_LOGBOOK"].set_active(False)
         self.sources["DEFAULT_LOGBOOK"].connect("toggled", self.on_default_logbook_toggled)
@@ -163,23 +157,23 @@ class GeneralPage:
         self.sources["DEFAULT_LOGBOOK_PATH"] = self.builder.get_object("general_default_logbook_entry")
         (section, option) = ("general", "default_logbook")
         # Disable the text entry box if the default logbook checkbox is not checked.
-        if(have_config and config.has_option(section, option)):
+        if(have_config and preferences.has_option(section, option)):
             self.sources["DEFAULT_LOGBOOK_PATH"].set_sensitive(self.sources["DEFAULT_LOGBOOK"].get_active())
             self.builder.get_object("general_default_logbook_button").set_sensitive(self.sources["DEFAULT_LOGBOOK"].get_active())
         else:
             self.sources["DEFAULT_LOGBOOK_PATH"].set_sensitive(False)
             self.builder.get_object("general_default_logbook_button").set_sensitive(False)
         (section, option) = ("general", "default_logbook_path")
-        if(have_config and config.has_option(section, option)):
-            self.sources["DEFAULT_LOGBOOK_PATH"].set_text(config.get(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["DEFAULT_LOGBOOK_PATH"].set_text(preferences.get(section, option))
 
         self.builder.get_object("general_default_logbook_button").connect("clicked", self.on_default_logbook_clicked)
 
         # Keep 'Add Record' dialog open.
         self.sources["KEEP_OPEN"] = self.builder.get_object("general_keep_open_checkbutton")
         (section, option) = ("general", "keep_open")
-        if(have_config and config.has_option(section, option)):
-            self.sources["KEEP_OPEN"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["KEEP_OPEN"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["KEEP_OPEN"].set_active(False)
 
@@ -233,14 +227,13 @@ class ViewPage:
         self.builder = builder
         self.sources = {}
 
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        have_config = preferences.have_config
 
         # Visible fields
         for field_name in AVAILABLE_FIELD_NAMES_ORDERED:
             self.sources[field_name] = self.builder.get_object("visible_fields_%s" % (field_name.lower()))
-            if(have_config and config.has_option("view", field_name.lower())):
-                self.sources[field_name].set_active(config.getboolean("view", field_name.lower()))
+            if(have_config and preferences.has_option("view", field_name.lower())):
+                self.sources[field_name].set_active(preferences.getboolean("view", field_name.lower()))
             else:
                 self.sources[field_name].set_active(True)
 
@@ -266,23 +259,20 @@ class RecordsPage:
         self.builder = builder
         self.sources = {}
 
-        # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
-        # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        have_config = preferences.have_config
 
         # Autocomplete
         self.sources["AUTOCOMPLETE_BAND"] = self.builder.get_object("records_autocomplete_band_checkbutton")
         (section, option) = ("records", "autocomplete_band")
-        if(have_config and config.has_option(section, option)):
-            self.sources["AUTOCOMPLETE_BAND"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["AUTOCOMPLETE_BAND"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["AUTOCOMPLETE_BAND"].set_active(True)
 
         self.sources["USE_UTC"] = self.builder.get_object("records_autocomplete_utc_checkbutton")
         (section, option) = ("records", "use_utc")
-        if(have_config and config.has_option(section, option)):
-            self.sources["USE_UTC"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["USE_UTC"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["USE_UTC"].set_active(True)
 
@@ -293,8 +283,8 @@ class RecordsPage:
         for mode in sorted(MODES.keys()):
             self.sources["DEFAULT_MODE"].append_text(mode)
         (section, option) = ("records", "default_mode")
-        if(have_config and config.has_option(section, option)):
-            mode = config.get(section, option)
+        if(have_config and preferences.has_option(section, option)):
+            mode = preferences.get(section, option)
         else:
             mode = ""
         self.sources["DEFAULT_MODE"].set_active(sorted(MODES.keys()).index(mode))
@@ -305,8 +295,8 @@ class RecordsPage:
         for submode in MODES[mode]:
             self.sources["DEFAULT_SUBMODE"].append_text(submode)
         (section, option) = ("records", "default_submode")
-        if(have_config and config.has_option(section, option)):
-            submode = config.get(section, option)
+        if(have_config and preferences.has_option(section, option)):
+            submode = preferences.get(section, option)
         else:
             submode = ""
         self.sources["DEFAULT_SUBMODE"].set_active(MODES[mode].index(submode))
@@ -314,8 +304,8 @@ class RecordsPage:
         # Power
         self.sources["DEFAULT_POWER"] = self.builder.get_object("default_values_tx_power_entry")
         (section, option) = ("records", "default_power")
-        if(have_config and config.has_option(section, option)):
-            self.sources["DEFAULT_POWER"].set_text(config.get(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["DEFAULT_POWER"].set_text(preferences.get(section, option))
         else:
             self.sources["DEFAULT_POWER"].set_text("")
 
@@ -325,8 +315,8 @@ class RecordsPage:
         for unit in units:
             self.sources["DEFAULT_FREQUENCY_UNIT"].append_text(unit)
         (section, option) = ("records", "default_frequency_unit")
-        if(have_config and config.has_option(section, option)):
-            self.sources["DEFAULT_FREQUENCY_UNIT"].set_active(units.index(config.get(section, option)))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["DEFAULT_FREQUENCY_UNIT"].set_active(units.index(preferences.get(section, option)))
         else:
             self.sources["DEFAULT_FREQUENCY_UNIT"].set_active(units.index("MHz"))
 
@@ -336,30 +326,37 @@ class RecordsPage:
         for database in callsign_database:
             self.sources["CALLSIGN_DATABASE"].append_text(database)
         (section, option) = ("records", "callsign_database")
-        if(have_config and config.has_option(section, option)):
-            self.sources["CALLSIGN_DATABASE"].set_active(callsign_database.index(config.get(section, option)))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["CALLSIGN_DATABASE"].set_active(callsign_database.index(preferences.get(section, option)))
         else:
             self.sources["CALLSIGN_DATABASE"].set_active(callsign_database.index(""))
 
         # Login details
         self.sources["CALLSIGN_DATABASE_USERNAME"] = self.builder.get_object("callsign_lookup_login_details_username_entry")
         (section, option) = ("records", "callsign_database_username")
-        if(have_config and config.has_option(section, option)):
-            self.sources["CALLSIGN_DATABASE_USERNAME"].set_text(config.get(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["CALLSIGN_DATABASE_USERNAME"].set_text(preferences.get(section, option))
 
         self.sources["CALLSIGN_DATABASE_PASSWORD"] = self.builder.get_object("callsign_lookup_login_details_password_entry")
         (section, option) = ("records", "callsign_database_password")
-        if(have_config and config.has_option(section, option)):
-            password = base64.b64decode(config.get(section, option)).decode("utf-8")
+        if(have_config and preferences.has_option(section, option)):
+            password = base64.b64decode(preferences.get(section, option)).decode("utf-8")
             self.sources["CALLSIGN_DATABASE_PASSWORD"].set_text(password)
 
         self.sources["IGNORE_PREFIX_SUFFIX"] = self.builder.get_object("callsign_lookup_ignore_prefix_suffix_checkbutton")
         (section, option) = ("records", "ignore_prefix_suffix")
-        if(have_config and config.has_option(section, option)):
-            self.sources["IGNORE_PREFIX_SUFFIX"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["IGNORE_PREFIX_SUFFIX"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["IGNORE_PREFIX_SUFFIX"].set_active(True)
 
+        self.sources["CALLSIGN_LOOKUP_CACHE_DAYS"] = self.builder.get_object("callsign_lookup_cache_days_entry")
+        (section, option) = ("records", "callsign_lookup_cache_days")
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["CALLSIGN_LOOKUP_CACHE_DAYS"].set_text(preferences.get(section, option))
+        else:
+            self.sources["CALLSIGN_LOOKUP_CACHE_DAYS"].set_text("30")
+
         return
 
     @property
@@ -378,6 +375,7 @@ class RecordsPage:
         data["CALLSIGN_DATABASE_USERNAME"] = self.sources["CALLSIGN_DATABASE_USERNAME"].get_text()
         data["CALLSIGN_DATABASE_PASSWORD"] = base64.b64encode(self.sources["CALLSIGN_DATABASE_PASSWORD"].get_text().encode("utf-8")).decode("utf-8")  # Need to convert from bytes to str here.
         data["IGNORE_PREFIX_SUFFIX"] = self.sources["IGNORE_PREFIX_SUFFIX"].get_active()
+        data["CALLSIGN_LOOKUP_CACHE_DAYS"] = self.sources["CALLSIGN_LOOKUP_CACHE_DAYS"].get_text()
         return data
 
     def on_mode_changed(self, combo):
@@ -401,16 +399,13 @@ class ImportExportPage:
         self.builder = builder
         self.sources = {}
 
-        # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
-        # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        have_config = preferences.have_config
 
         # Import
         self.sources["MERGE_COMMENT"] = self.builder.get_object("adif_import_merge_comment_checkbutton")
         (section, option) = ("import_export", "merge_comment")
-        if(have_config and config.has_option(section, option)):
-            self.sources["MERGE_COMMENT"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["MERGE_COMMENT"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["MERGE_COMMENT"].set_active(False)
 
@@ -435,13 +430,12 @@ class HamlibPage:
         self.builder = builder
         self.sources = {}
 
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        have_config = preferences.have_config
 
         self.sources["AUTOFILL"] = self.builder.get_object("hamlib_support_checkbutton")
         (section, option) = ("hamlib", "autofill")
-        if(have_config and config.has_option(section, option)):
-            self.sources["AUTOFILL"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["AUTOFILL"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["AUTOFILL"].set_active(False)
 
@@ -461,16 +455,24 @@ class HamlibPage:
         for model in models:
             self.sources["RIG_MODEL"].append_text(model)
         (section, option) = ("hamlib", "rig_model")
-        if(have_config and config.has_option("hamlib", "rig_model")):
-            self.sources["RIG_MODEL"].set_active(models.index(config.get("hamlib", "rig_model")))
+        if(have_config and preferences.has_option("hamlib", "rig_model")):
+            self.sources["RIG_MODEL"].set_active(models.index(preferences.get("hamlib", "rig_model")))
         else:
             self.sources["RIG_MODEL"].set_active(models.index("RIG_MODEL_NONE"))  # Set to RIG_MODEL_NONE as the default option.
 
         # Path to rig
         self.sources["RIG_PATHNAME"] = self.builder.get_object("hamlib_support_path_entry")
         (section, option) = ("hamlib", "rig_pathname")
-        if(have_config and config.has_option(section, option)):
-            self.sources["RIG_PATHNAME"].set_text(config.get(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["RIG_PATHNAME"].set_text(preferences.get(section, option))
+
+        # How often the frequency and mode are read from the rig.
+        self.sources["POLL_INTERVAL"] = self.builder.get_object("hamlib_support_poll_interval_entry")
+        (section, option) = ("hamlib", "poll_interval")
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["POLL_INTERVAL"].set_text(preferences.get(section, option))
+        else:
+            self.sources["POLL_INTERVAL"].set_text("1")
 
         return
 
@@ -481,6 +483,7 @@ class HamlibPage:
         data["AUTOFILL"] = self.sources["AUTOFILL"].get_active()
         data["RIG_PATHNAME"] = self.sources["RIG_PATHNAME"].get_text()
         data["RIG_MODEL"] = self.sources["RIG_MODEL"].get_active_text()
+        data["POLL_INTERVAL"] = self.sources["POLL_INTERVAL"].get_text()
         return data
 
 
@@ -495,16 +498,13 @@ class WorldMapPage:
         self.builder = builder
         self.sources = {}
 
-        # Remember that the have_config conditional in the PyQSO class may be out-of-date the next time the user opens up the preferences dialog
-        # because a configuration file may have been created after launching the application. Let's check to see if one exists again...
-        config = configparser.ConfigParser()
-        have_config = (config.read(PREFERENCES_FILE) != [])
+        have_config = preferences.have_config
 
         # Option to pinpoint QTH on grey line map.
         self.sources["SHOW_QTH"] = self.builder.get_object("world_map_show_qth_checkbutton")
         (section, option) = ("world_map", "show_qth")
-        if(have_config and config.has_option(section, option)):
-            self.sources["SHOW_QTH"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["SHOW_QTH"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["SHOW_QTH"].set_active(False)
 
@@ -517,7 +517,7 @@ class WorldMapPage:
 
         (section, option) = ("world_map", "show_qth")
         # Disable the text entry boxes if the SHOW_QTH checkbox is not checked.
-        if(have_config and config.has_option(section, option)):
+        if(have_config and preferences.has_option(section, option)):
             self.sources["QTH_NAME"].set_sensitive(self.sources["SHOW_QTH"].get_active())
             self.sources["QTH_LATITUDE"].set_sensitive(self.sources["SHOW_QTH"].get_active())
             self.sources["QTH_LONGITUDE"].set_sensitive(self.sources["SHOW_QTH"].get_active())
@@ -528,32 +528,40 @@ class WorldMapPage:
             self.sources["QTH_LONGITUDE"].set_sensitive(False)
             button.set_sensitive(False)
         (section, option) = ("world_map", "qth_name")
-        if(have_config and config.has_option(section, option)):
-            self.sources["QTH_NAME"].set_text(config.get(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["QTH_NAME"].set_text(preferences.get(section, option))
         (section, option) = ("world_map", "qth_latitude")
-        if(have_config and config.has_option(section, option)):
-            self.sources["QTH_LATITUDE"].set_text(config.get(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["QTH_LATITUDE"].set_text(preferences.get(section, option))
         (section, option) = ("world_map", "qth_longitude")
-        if(have_config and config.has_option(section, option)):
-            self.sources["QTH_LONGITUDE"].set_text(config.get(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["QTH_LONGITUDE"].set_text(preferences.get(section, option))
         self.sources["SHOW_QTH"].connect("toggled", self.on_show_qth_toggled)
 
         # Option to show Maidenhead grid squares.
         self.sources["SHOW_GRID_SQUARES"] = self.builder.get_object("world_map_show_grid_squares_checkbutton")
         (section, option) = ("world_map", "show_grid_squares")
-        if(have_config and config.has_option(section, option)):
-            self.sources["SHOW_GRID_SQUARES"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["SHOW_GRID_SQUARES"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["SHOW_GRID_SQUARES"].set_active(False)
 
         # Option to shade in worked Maidenhead grid squares.
         self.sources["SHADE_WORKED_GRID_SQUARES"] = self.builder.get_object("world_map_shade_worked_grid_squares_checkbutton")
         (section, option) = ("world_map", "shade_worked_grid_squares")
-        if(have_config and config.has_option(section, option)):
-            self.sources["SHADE_WORKED_GRID_SQUARES"].set_active(config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["SHADE_WORKED_GRID_SQUARES"].set_active(preferences.getboolean(section, option))
         else:
             self.sources["SHADE_WORKED_GRID_SQUARES"].set_active(False)
 
+        # Option to show a heatmap of the number of QSOs with each Maidenhead grid square.
+        self.sources["SHOW_GRID_SQUARE_HEATMAP"] = self.builder.get_object("world_map_show_grid_square_heatmap_checkbutton")
+        (section, option) = ("world_map", "show_grid_square_heatmap")
+        if(have_config and preferences.has_option(section, option)):
+            self.sources["SHOW_GRID_SQUARE_HEATMAP"].set_active(preferences.getboolean(section, option))
+        else:
+            self.sources["SHOW_GRID_SQUARE_HEATMAP"].set_active(False)
+
         return
 
     @property
@@ -566,6 +574,7 @@ class WorldMapPage:
         data["QTH_LONGITUDE"] = self.sources["QTH_LONGITUDE"].get_text()
         data["SHOW_GRID_SQUARES"] = self.sources["SHOW_GRID_SQUARES"].get_active()
         data["SHADE_WORKED_GRID_SQUARES"] = self.sources["SHADE_WORKED_GRID_SQUARES"].get_active()
+        data["SHOW_GRID_SQUARE_HEATMAP"] = self.sources["SHOW_GRID_SQUARE_HEATMAP"].get_active()
         return data
 
     def on_show_qth_toggled(self, widget, data=None):
@@ -589,6 +598,7 @@ class WorldMapPage:
         logging.debug("Geocoding QTH location...")
         name = self.sources["QTH_NAME"].get_text()
         try:
+            import geocoder
             g = geocoder.google(name)
             latitude, longitude = g.latlng
             self.sources["QTH_LATITUDE"].set_text(str(latitude))
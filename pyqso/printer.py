@@ -23,9 +23,21 @@ import logging
 from pyqso.auxiliary_dialogs import error
 
 
+# The format of each line of the table of records.
+LINE_FORMAT = "%-5s\t%-15s\t%-8s\t%-6s\t%-15s\t%-12s\t%-8s\t%-8s"
+
+# The table's column headings, which are repeated at the top of every page.
+TABLE_HEADER = [LINE_FORMAT % ("Index", "Callsign", "Date", "Time", "Frequency", "Mode", "RST Sent", "RST Rcvd"),
+                LINE_FORMAT % ("-----", "--------", "----", "----", "---------", "----", "--------", "--------")]
+
+# The font used to print the records.
+FONT = "monospace expanded 10"
+
+
 class Printer(object):
 
-    """ Handles the printing of one or more records to file or paper. """
+    """ Handles the printing of one or more records to file or paper.
+    Every line of the printout has the same height, so the page breaks are worked out arithmetically, and each page only formats (and, when printing a log, only fetches from the database) the records that appear on it. """
 
     def __init__(self, application):
         """ Initialise the record printer.
@@ -45,29 +57,54 @@ class Printer(object):
         self.operation.connect("begin_print", self.begin_print)
         self.operation.connect("draw_page", self.draw_page)
 
+        self.title = None
+        self.record_count = 0
+        self.get_records = None  # Returns the records in a given range of positions (from the start position up to, but not including, the stop position).
+        self.line_height = None
+        self.lines_per_page = None
+
         return
 
     def print_records(self, records, title=None):
         """ Perform the print operation.
 
-        :arg dict records: The records to be printed.
+        :arg list records: The records to be printed. This can be any sequence which supports len() and slicing.
         :arg str title: Optional title for the document. Default is None.
         :returns: The result of the print operation.
         :rtype: Gtk.PrintOperationResult
         """
+        return self.run(len(records), lambda start, stop: records[start:stop], title)
 
-        # Add the title, if given.
-        if(title):
-            self.text_to_print = title + "\n\n"
-        else:
-            self.text_to_print = ""
+    def print_log(self, log, title=None):
+        """ Print all the records in a log. Only the indices of the records are retrieved up-front; the records on each page are retrieved from the database when the page is drawn.
 
-        # Assemble the header and records into one string.
-        line_format = "%-5s\t%-15s\t%-8s\t%-6s\t%-15s\t%-12s\t%-8s\t%-8s\n"
-        self.text_to_print += line_format % ("Index", "Callsign", "Date", "Time", "Frequency", "Mode", "RST Sent", "RST Rcvd")
-        self.text_to_print += line_format % ("-----", "--------", "----", "----", "---------", "----", "--------", "--------")
-        for r in records:
-            self.text_to_print += line_format % (str(r["id"]), str(r["CALL"]), str(r["QSO_DATE"]), str(r["TIME_ON"]), str(r["FREQ"]), str(r["MODE"]), str(r["RST_SENT"]), str(r["RST_RCVD"]))
+        :arg Log log: The log to be printed.
+        :arg str title: Optional title for the document. Default is None.
+        :returns: The result of the print operation.
+        :rtype: Gtk.PrintOperationResult
+        :raises sqlite.Error: If the indices of the records could not be retrieved from the database.
+        """
+        indices = log.indices
+
+        def get_records(start, stop):
+            if(start >= stop):
+                return []
+            return log.get_records_by_index_range(indices[start], indices[stop-1])
+
+        return self.run(len(indices), get_records, title)
+
+    def run(self, record_count, get_records, title=None):
+        """ Run the print operation.
+
+        :arg int record_count: The number of records to be printed.
+        :arg get_records: A function which returns the records in a given range of positions (from the start position up to, but not including, the stop position).
+        :arg str title: Optional title for the document. Default is None.
+        :returns: The result of the print operation.
+        :rtype: Gtk.PrintOperationResult
+        """
+        self.title = title
+        self.record_count = record_count
+        self.get_records = get_records
 
         result = self.operation.run(self.action, parent=self.application.window)
         if(result == Gtk.PrintOperationResult.ERROR):
@@ -75,33 +112,53 @@ class Printer(object):
 
         return result
 
+    @property
+    def preamble(self):
+        """ The lines printed at the top of the first page, before the records. """
+        if(self.title):
+            return [self.title, ""] + TABLE_HEADER
+        return TABLE_HEADER
+
+    @property
+    def number_of_pages(self):
+        """ The number of pages needed to print all the records. """
+        first = self.lines_per_page - len(self.preamble)
+        if(self.record_count <= first):
+            return 1
+        rest = self.lines_per_page - len(TABLE_HEADER)
+        return 1 + (self.record_count - first + rest - 1)//rest
+
+    def page_range(self, page_number):
+        """ Return the positions of the records that are printed on a page.
+
+        :arg int page_number: The page number, starting from 0.
+        :returns: The position of the first record on the page, and the position after the last record on the page.
+        :rtype: tuple
+        """
+        first = self.lines_per_page - len(self.preamble)
+        if(page_number == 0):
+            return (0, min(first, self.record_count))
+        rest = self.lines_per_page - len(TABLE_HEADER)
+        start = first + (page_number - 1)*rest
+        return (start, min(start + rest, self.record_count))
+
     def begin_print(self, operation, context):
         """ Specify the layout/position/font of the text on the pages to be printed.
 
         :arg Gtk.PrintOperation operation: The printing API.
         :arg Gtk.PrintContext context: Used to draw/render the pages to print.
         """
-        width = context.get_width()  # Measured in pixels.
-        height = context.get_height()  # Measured in pixels.
         layout = context.create_pango_layout()
-        layout.set_font_description(Pango.FontDescription("monospace expanded 10"))
-        layout.set_width(int(width*Pango.SCALE))
-        layout.set_text(self.text_to_print, -1)
-
-        number_of_pages = 1
-        page_height = 0
-        for line in range(0, layout.get_line_count()):
-            layout_line = layout.get_line(line)
-            ink_rectangle, logical_rectangle = layout_line.get_pixel_extents()
-            self.line_height = logical_rectangle.height + 3.0
-            page_height += self.line_height
-            if((page_height + 2*self.line_height) >= height):
-                # Go on to the next page.
-                number_of_pages += 1
-                page_height = 0.0
-        operation.set_n_pages(number_of_pages)
-        logging.debug("Printing %d pages..." % number_of_pages)
-        self.text_to_print = self.text_to_print.split("\n")
+        layout.set_font_description(Pango.FontDescription(FONT))
+        layout.set_text(TABLE_HEADER[0], -1)
+        ink_rectangle, logical_rectangle = layout.get_line(0).get_pixel_extents()
+        self.line_height = logical_rectangle.height + 3.0
+
+        # The lines are drawn one line height apart, starting one line height from the top, with a line height of space left at the bottom.
+        self.lines_per_page = max(int(context.get_height()//self.line_height) - 2, len(self.preamble) + 1)
+
+        operation.set_n_pages(self.number_of_pages)
+        logging.debug("Printing %d records on %d pages..." % (self.record_count, self.number_of_pages))
         return
 
     def draw_page(self, operation, context, page_number):
@@ -111,22 +168,36 @@ class Printer(object):
         :arg Gtk.PrintContext context: Used to draw/render the pages to print.
         :arg int page_number: The current page number.
         """
+        (start, stop) = self.page_range(page_number)
+        try:
+            records = self.get_records(start, stop)
+        except Exception as e:
+            logging.error("Could not retrieve the records on page %d." % (page_number+1))
+            logging.exception(e)
+            operation.cancel()
+            return
+
         cr = context.get_cairo_context()
         cr.set_source_rgb(0, 0, 0)
         layout = context.create_pango_layout()
-        layout.set_font_description(Pango.FontDescription("monospace expanded 10"))
+        layout.set_font_description(Pango.FontDescription(FONT))
         layout.set_width(int(context.get_width()*Pango.SCALE))
 
-        current_line_number = 1
-        for line in self.text_to_print:
+        lines = self.preamble if page_number == 0 else TABLE_HEADER
+        for (current_line_number, line) in enumerate(lines + [format_record(r) for r in records], start=1):
             layout.set_text(line, -1)
             cr.move_to(5, current_line_number*self.line_height)
             PangoCairo.update_layout(cr, layout)
             PangoCairo.show_layout(cr, layout)
-            current_line_number += 1
-            if((current_line_number+1)*self.line_height >= context.get_height()):
-                for j in range(0, current_line_number-1):
-                    self.text_to_print.pop(0)  # Remove what has been printed already before draw_page is called again.
-                break
 
         return
+
+
+def format_record(r):
+    """ Format a record as a line of the printed table.
+
+    :arg r: The record.
+    :returns: The index, callsign, date, time, frequency, mode and signal reports of the record.
+    :rtype: str
+    """
+    return LINE_FORMAT % (str(r["id"]), str(r["CALL"]), str(r["QSO_DATE"]), str(r["TIME_ON"]), str(r["FREQ"]), str(r["MODE"]), str(r["RST_SENT"]), str(r["RST_RCVD"]))
@@ -20,24 +20,19 @@
 from gi.repository import Gtk, Gdk
 import logging
 import os
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
 from datetime import datetime
-from os.path import expanduser
-import base64
-try:
-    import Hamlib
-    have_hamlib = True
-except ImportError:
-    logging.warning("Could not import the Hamlib module!")
-    have_hamlib = False
 
 from pyqso.adif import *
 from pyqso.callsign_lookup import *
 from pyqso.auxiliary_dialogs import *
 from pyqso.calendar_dialog import CalendarDialog
+from pyqso.preferences import preferences
+from pyqso.band_plan import band_for_frequency
+
+# The position of each band in the BAND combo box.
+BAND_INDICES = dict([(band, i) for (i, band) in enumerate(BANDS)])
+# The position of each mode in the MODE combo box, whose entries are in alphabetical order.
+MODE_INDICES = dict([(mode, i) for (i, mode) in enumerate(sorted(MODES.keys()))])
 
 
 class RecordDialog:
@@ -68,8 +63,7 @@ class RecordDialog:
             self.dialog.set_title("Add Record")
 
         # Check if a configuration file is present, since we might need it to set up the rest of the dialog.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
+        have_config = preferences.have_config
 
         # Create label:entry pairs and store them in a dictionary
         self.sources = {}
@@ -91,8 +85,8 @@ class RecordDialog:
         # FREQ
         self.sources["FREQ"] = self.builder.get_object("qso_frequency_entry")
         (section, option) = ("records", "default_frequency_unit")
-        if(have_config and config.has_option(section, option)):
-            self.frequency_unit = config.get(section, option)
+        if(have_config and preferences.has_option(section, option)):
+            self.frequency_unit = preferences.get(section, option)
             self.builder.get_object("qso_frequency_label").set_label("Frequency (%s)" % self.frequency_unit)
         else:
             self.frequency_unit = "MHz"
@@ -199,7 +193,7 @@ class RecordDialog:
                     converted = self.convert_frequency(data, from_unit="MHz", to_unit=self.frequency_unit)
                     self.sources[field_names[i]].set_text(str(converted))
                 elif(field_names[i] == "MODE"):
-                    self.sources[field_names[i]].set_active(sorted(MODES.keys()).index(data))
+                    self.sources[field_names[i]].set_active(MODE_INDICES[data])
                     # Handle SUBMODE at the same time.
                     submode_data = record["submode"]
                     if(submode_data is None):
@@ -223,47 +217,52 @@ class RecordDialog:
             # Set up default field values
             # Mode
             (section, option) = ("records", "default_mode")
-            if(have_config and config.has_option(section, option)):
-                mode = config.get(section, option)
+            if(have_config and preferences.has_option(section, option)):
+                mode = preferences.get(section, option)
             else:
                 mode = ""
-            self.sources["MODE"].set_active(sorted(MODES.keys()).index(mode))
+            self.sources["MODE"].set_active(MODE_INDICES[mode])
 
             # Submode
             (section, option) = ("records", "default_submode")
-            if(have_config and config.has_option(section, option)):
-                submode = config.get(section, option)
+            if(have_config and preferences.has_option(section, option)):
+                submode = preferences.get(section, option)
             else:
                 submode = ""
             self.sources["SUBMODE"].set_active(MODES[mode].index(submode))
 
             # Power
             (section, option) = ("records", "default_power")
-            if(have_config and config.has_option(section, option)):
-                power = config.get(section, option)
+            if(have_config and preferences.has_option(section, option)):
+                power = preferences.get(section, option)
             else:
                 power = ""
             self.sources["TX_PWR"].set_text(power)
 
-            # If the Hamlib module is present, then use it to fill in various fields if desired.
-            if(have_hamlib):
-                if(have_config and config.has_option("hamlib", "autofill") and config.has_option("hamlib", "rig_model") and config.has_option("hamlib", "rig_pathname")):
-                    autofill = (config.getboolean("hamlib", "autofill"))
-                    rig_model = config.get("hamlib", "rig_model")
-                    rig_pathname = config.get("hamlib", "rig_pathname")
-                    if(autofill):
-                        self.hamlib_autofill(rig_model, rig_pathname)
+            # If the rig is being read via Hamlib, then fill in the frequency and mode using its latest readings.
+            state = self.application.rig.get_state()
+            if(state is not None):
+                self.hamlib_autofill(state)
 
         # Do we want PyQSO to autocomplete the Band field based on the Frequency field?
         (section, option) = ("records", "autocomplete_band")
-        if(have_config and config.has_option(section, option)):
-            autocomplete_band = (config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            autocomplete_band = (preferences.getboolean(section, option))
             if(autocomplete_band):
                 self.sources["FREQ"].connect("changed", self.autocomplete_band)
         else:
             # If no configuration file exists, autocomplete the Band field by default.
             self.sources["FREQ"].connect("changed", self.autocomplete_band)
 
+        # Look up the callsign in the background as it is typed, if the callsign database has been set up.
+        try:
+            self.lookup_settings = get_lookup_settings(self.application.callsign_lookup.cache)
+            self.sources["CALL"].connect("changed", self.on_call_changed)
+        except ValueError:
+            self.lookup_settings = None
+        # Any lookup that is still running when the dialog is closed is no longer needed.
+        self.dialog.connect("destroy", lambda widget: self.application.callsign_lookup_service.cancel())
+
         self.dialog.show_all()
 
         logging.debug("Record dialog ready!")
@@ -331,108 +330,50 @@ class RecordDialog:
         if(self.frequency_unit != "MHz"):
             frequency = self.convert_frequency(frequency, from_unit=self.frequency_unit, to_unit="MHz")
 
-        # Find which band the frequency lies in.
-        for i in range(1, len(BANDS)):
-            if(frequency >= BANDS_RANGES[i][0] and frequency <= BANDS_RANGES[i][1]):
-                self.sources["BAND"].set_active(i)
-                return
-
-        self.sources["BAND"].set_active(0)  # If we've reached this, then the frequency does not lie in any of the specified bands.
+        # Find which band the frequency lies in. If it does not lie in any of the bands, then the BAND field is set to an empty string.
+        self.sources["BAND"].set_active(BAND_INDICES[band_for_frequency(frequency)])
         return
 
-    def hamlib_autofill(self, rig_model, rig_pathname):
-        """ Set the various fields using data from the radio via Hamlib.
+    def hamlib_autofill(self, state):
+        """ Set the various fields using the latest readings from the radio via Hamlib.
 
-        :arg str rig_model: The model of the radio/rig.
-        :arg str rig_pathname: The path to the rig (or rig control device).
+        :arg RigState state: The frequency, mode and submode read from the radio.
         """
 
-        # Open a communication channel to the radio.
-        try:
-            Hamlib.rig_set_debug(Hamlib.RIG_DEBUG_NONE)
-            rig = Hamlib.Rig(Hamlib.__dict__[rig_model])  # Look up the model's numerical index in Hamlib's symbol dictionary.
-            rig.set_conf("rig_pathname", rig_pathname)
-            rig.open()
-        except:
-            logging.error("Could not open a communication channel to the rig via Hamlib!")
-            return
-
         # Frequency
-        try:
-            frequency = "%.6f" % (rig.get_freq()/1.0e6)  # Converting to MHz here.
-            # Convert to the desired unit, if necessary.
-            if(self.frequency_unit != "MHz"):
-                frequency = str(self.convert_frequency(frequency, from_unit="MHz", to_unit=self.frequency_unit))
-            self.sources["FREQ"].set_text(frequency)
-        except:
-            logging.error("Could not obtain the current frequency via Hamlib!")
+        frequency = "%.6f" % state.frequency
+        # Convert to the desired unit, if necessary.
+        if(self.frequency_unit != "MHz"):
+            frequency = str(self.convert_frequency(frequency, from_unit="MHz", to_unit=self.frequency_unit))
+        self.sources["FREQ"].set_text(frequency)
 
         # Mode
         try:
-            (mode, width) = rig.get_mode()
-            mode = Hamlib.rig_strrmode(mode).upper()
-            # Handle USB and LSB as special cases.
-            if(mode == "USB" or mode == "LSB"):
-                submode = mode
-                mode = "SSB"
-                self.sources["MODE"].set_active(sorted(MODES.keys()).index(mode))
-                self.sources["SUBMODE"].set_active(MODES[mode].index(submode))
-            else:
-                self.sources["MODE"].set_active(sorted(MODES.keys()).index(mode))
-        except:
-            logging.error("Could not obtain the current mode (e.g. FM, AM, CW) via Hamlib!")
+            self.sources["MODE"].set_active(MODE_INDICES[state.mode])
+            if(state.submode):
+                self.sources["SUBMODE"].set_active(MODES[state.mode].index(state.submode))
+        except (KeyError, ValueError):
+            logging.error("The mode reported via Hamlib (%s %s) is not a valid ADIF mode." % (state.mode, state.submode))
 
-        # Close communication channel.
-        try:
-            rig.close()
-        except:
-            logging.error("Could not close the communication channel to the rig via Hamlib!")
+        return
 
+    def on_call_changed(self, widget=None):
+        """ Start looking up the callsign in the background once the user has stopped typing, so that the result is usually ready by the time the Lookup button is clicked. """
+        full_callsign = self.sources["CALL"].get_text()
+        if(len(full_callsign) < 3):
+            self.application.callsign_lookup_service.cancel()
+            return
+        (database, username, password, ignore_prefix_suffix) = self.lookup_settings
+        self.application.callsign_lookup_service.prefetch(database, username, password, full_callsign, ignore_prefix_suffix=ignore_prefix_suffix)
         return
 
     def callsign_lookup_callback(self, widget=None):
-        """ Get the callsign-related data from an online database and store it in the relevant Gtk.Entry boxes, but return None. """
+        """ Get the callsign-related data from an online database in the background. The relevant Gtk.Entry boxes are filled in once the lookup is complete. """
 
-        # Get the database name.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
         try:
-            if(have_config and config.has_option("records", "callsign_database")):
-                database = config.get("records", "callsign_database")
-                if(database == ""):
-                    raise ValueError
-            else:
-                raise ValueError
-        except ValueError:
-            error(parent=self.dialog, message="To perform a callsign lookup, please specify the name of the callsign database in the Preferences.")
-            return
-
-        try:
-            if(database == "qrz.com"):
-                # QRZ.com
-                callsign_lookup = CallsignLookupQRZ(parent=self.dialog)
-            elif(database == "hamqth.com"):
-                # HamQTH.com
-                callsign_lookup = CallsignLookupHamQTH(parent=self.dialog)
-            else:
-                raise ValueError("Unknown callsign database: %s" % database)
+            (database, username, password, ignore_prefix_suffix) = get_lookup_settings(self.application.callsign_lookup.cache)
         except ValueError as e:
-            logging.exception(e)
-            error(parent=self.dialog, message=e)
-            return
-
-        # Get username and password from configuration file.
-        if(have_config and config.has_option("records", "callsign_database_username") and config.has_option("records", "callsign_database_password")):
-            username = config.get("records", "callsign_database_username")
-            password = base64.b64decode(config.get("records", "callsign_database_password")).decode("utf-8")
-            if(not username or not password):
-                details_given = False
-            else:
-                details_given = True
-        else:
-            details_given = False
-        if(not details_given):
-            error(parent=self.dialog, message="To perform a callsign lookup, please specify your username and password in the Preferences.")
+            error(parent=self.dialog, message=str(e))
             return
 
         # Get the callsign from the CALL field.
@@ -442,20 +383,25 @@ class RecordDialog:
             error(parent=self.dialog, message="Please enter a callsign to lookup.")
             return
 
-        # Connect to the database.
-        connected = callsign_lookup.connect(username, password)
-        if(connected):
-            # Check whether we want to ignore any prefixes (e.g. "IA/") or suffixes "(e.g. "/M") in the callsign
-            # before performing the lookup.
-            if(have_config and config.has_option("records", "ignore_prefix_suffix")):
-                ignore_prefix_suffix = (config.getboolean("records", "ignore_prefix_suffix"))
-            else:
-                ignore_prefix_suffix = True
+        # Perform the lookup. This re-uses the result of any prefetched lookup of the same callsign, and only logs in to the database if there is no valid session already.
+        self.builder.get_object("callsign_lookup").set_sensitive(False)
+        self.application.callsign_lookup_service.lookup(database, username, password, full_callsign, self.on_callsign_lookup_complete, ignore_prefix_suffix=ignore_prefix_suffix)
+        return
+
+    def on_callsign_lookup_complete(self, fields_and_data, errors):
+        """ Fill in the callsign-related Gtk.Entry boxes with the result of a lookup. This is called on the Gtk main loop.
 
-            # Perform the lookup.
-            fields_and_data = callsign_lookup.lookup(full_callsign, ignore_prefix_suffix=ignore_prefix_suffix)
-            for field_name in list(fields_and_data.keys()):
-                self.sources[field_name].set_text(fields_and_data[field_name])
+        :arg dict fields_and_data: The data returned by the lookup, or None if the database could not be reached.
+        :arg list errors: Any error messages produced by the lookup.
+        """
+        self.builder.get_object("callsign_lookup").set_sensitive(True)
+        for message in errors:
+            error(parent=self.dialog, message=message)
+        if(fields_and_data is None):
+            return  # Could not connect to the database.
+
+        for field_name in list(fields_and_data.keys()):
+            self.sources[field_name].set_text(fields_and_data[field_name])
         return
 
     def calendar_callback(self, widget):
@@ -471,13 +417,12 @@ class RecordDialog:
         """ Insert the current date and time. """
 
         # Check if a configuration file is present.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
+        have_config = preferences.have_config
 
         # Do we want to use UTC or the computer's local time?
         (section, option) = ("records", "use_utc")
-        if(have_config and config.has_option(section, option)):
-            use_utc = (config.getboolean(section, option))
+        if(have_config and preferences.has_option(section, option)):
+            use_utc = (preferences.getboolean(section, option))
             if(use_utc):
                 dt = datetime.utcnow()
             else:
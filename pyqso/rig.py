@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import namedtuple
+try:
+    import Hamlib
+    have_hamlib = True
+except ImportError:
+    logging.warning("Could not import the Hamlib module!")
+    have_hamlib = False
+
+from pyqso.preferences import preferences
+
+# The frequency (in MHz), mode and submode most recently read from the rig, and the time (as given by time.monotonic) at which they were read.
+RigState = namedtuple("RigState", ["frequency", "mode", "submode", "time"])
+
+# The longest time to wait before trying to open the communication channel to the rig again, in seconds.
+MAXIMUM_RETRY_INTERVAL = 60
+
+
+class RigService:
+
+    """ Keeps a single communication channel to the radio/rig open via Hamlib, and reads the rig's frequency and mode at a regular interval on a background thread.
+    The latest readings are published as an immutable RigState object, which replaces the previous one in a single assignment. The user interface can therefore read them at any time (e.g. when a record dialog is opened) without taking a lock or waiting on the rig.
+    Each background thread is given its own stop event, so a thread that is still blocked on the rig after being stopped cannot be revived by a later start, and never publishes readings once it has been stopped. """
+
+    def __init__(self, rig_model=None, rig_pathname=None, interval=1.0):
+        """ Set up the service. The rig is not opened until the service is started.
+
+        :arg str rig_model: The name of the rig model in Hamlib (e.g. "RIG_MODEL_DUMMY").
+        :arg str rig_pathname: The path to the rig (or rig control device).
+        :arg float interval: The time between readings, in seconds.
+        """
+        self.rig_model = rig_model
+        self.rig_pathname = rig_pathname
+        self.interval = interval
+        self.state = None  # The latest RigState, or None if the rig could not be read.
+        self.thread = None
+        self.stopped = None  # The stop event of the current background thread.
+        self.lock = threading.Lock()  # Held while the readings are published or withdrawn, so that a stopped thread cannot publish after the stop.
+        return
+
+    @property
+    def running(self):
+        """ True if the background thread is running, and False otherwise. """
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """ Start reading the rig on a background thread, unless this has been done already. """
+        if(self.running):
+            return
+        if(not have_hamlib):
+            logging.warning("The Hamlib module is not available, so the rig cannot be read.")
+            return
+        logging.debug("Starting to poll the rig (%s at %s) every %.1f second(s)..." % (self.rig_model, self.rig_pathname, self.interval))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stopped,), name="RigService")
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    def stop(self, wait=False, timeout=5):
+        """ Stop reading the rig. The background thread closes the communication channel to the rig once any call to Hamlib that it is blocked on has returned.
+
+        :arg bool wait: If True, wait for the background thread to finish. This should only be done when PyQSO is closing, since opening or reading the rig can block for a long time.
+        :arg float timeout: The maximum time to wait for the background thread to finish, in seconds.
+        """
+        thread = self.thread
+        with self.lock:
+            if(self.stopped is not None):
+                self.stopped.set()
+            self.thread = None
+            self.stopped = None
+            self.state = None
+        if(wait and thread is not None):
+            thread.join(timeout)
+        return
+
+    def get_state(self, maximum_age=None):
+        """ Return the latest readings from the rig.
+
+        :arg float maximum_age: If specified, readings that are older than this (in seconds) are ignored.
+        :returns: The latest readings, or None if there are none.
+        :rtype: RigState
+        """
+        state = self.state
+        if(state is not None and maximum_age is not None and time.monotonic() - state.time > maximum_age):
+            return None
+        return state
+
+    def open(self, rig_model, rig_pathname):
+        """ Open a communication channel to the rig. This is only called by the background thread.
+
+        :arg str rig_model: The name of the rig model in Hamlib.
+        :arg str rig_pathname: The path to the rig (or rig control device).
+        :returns: The rig.
+        :raises IOError: If the communication channel could not be opened.
+        """
+        Hamlib.rig_set_debug(Hamlib.RIG_DEBUG_NONE)
+        rig = Hamlib.Rig(getattr(Hamlib, rig_model))  # Look up the model's numerical index in the Hamlib module.
+        rig.set_conf("rig_pathname", rig_pathname)
+        rig.open()
+        self.check(rig)
+        return rig
+
+    def close(self, rig):
+        """ Close the communication channel to the rig.
+
+        :arg rig: The rig.
+        """
+        try:
+            rig.close()
+        except Exception as e:
+            logging.error("Could not close the communication channel to the rig via Hamlib!")
+            logging.exception(e)
+        return
+
+    def check(self, rig):
+        """ Check whether the last command sent to the rig succeeded.
+
+        :arg rig: The rig.
+        :raises IOError: If the last command failed.
+        """
+        if(rig.error_status != Hamlib.RIG_OK):
+            raise IOError(Hamlib.rigerror(rig.error_status))
+        return
+
+    def read(self, rig):
+        """ Read the frequency and mode from the rig. USB and LSB are reported as the SSB mode with a USB or LSB submode.
+
+        :arg rig: The rig.
+        :returns: The readings.
+        :rtype: RigState
+        :raises IOError: If the frequency or mode could not be read.
+        """
+        frequency = rig.get_freq()/1.0e6  # Converting to MHz here.
+        self.check(rig)
+        (mode, width) = rig.get_mode()
+        self.check(rig)
+        mode = Hamlib.rig_strrmode(mode).upper()
+        submode = ""
+        if(mode == "USB" or mode == "LSB"):
+            submode = mode
+            mode = "SSB"
+        return RigState(frequency, mode, submode, time.monotonic())
+
+    def publish(self, stopped, state):
+        """ Publish (or withdraw) the readings from the rig, unless the background thread that made them has been stopped.
+
+        :arg threading.Event stopped: The stop event of the background thread.
+        :arg RigState state: The readings, or None to withdraw the previous readings.
+        :returns: True if the readings were published, and False if the thread has been stopped.
+        :rtype: bool
+        """
+        with self.lock:
+            if(stopped.is_set()):
+                return False
+            self.state = state
+        return True
+
+    def run(self, stopped):
+        """ Read the rig until the given stop event is set. If the rig cannot be opened or read, the communication channel is re-opened after a delay which doubles after every failure.
+
+        :arg threading.Event stopped: The stop event of this thread.
+        """
+        (rig_model, rig_pathname, interval) = (self.rig_model, self.rig_pathname, self.interval)
+        rig = None
+        retry_interval = interval
+        while(not stopped.is_set()):
+            try:
+                if(rig is None):
+                    rig = self.open(rig_model, rig_pathname)
+                    logging.debug("Opened a communication channel to the rig via Hamlib.")
+                    continue  # Opening the rig can take a long time, so check whether this thread has been stopped in the meantime.
+                if(not self.publish(stopped, self.read(rig))):
+                    break
+                retry_interval = interval
+                stopped.wait(interval)
+            except Exception as e:
+                if(not self.publish(stopped, None)):
+                    break
+                logging.error("Could not read the frequency and mode from the rig via Hamlib! Trying again in %.1f second(s)." % retry_interval)
+                logging.exception(e)
+                if(rig is not None):
+                    self.close(rig)
+                    rig = None
+                stopped.wait(retry_interval)
+                retry_interval = min(2*retry_interval, MAXIMUM_RETRY_INTERVAL)
+        if(rig is not None):
+            self.close(rig)
+        return
+
+    def apply_preferences(self):
+        """ Start (or re-start) the service if the user has asked for the record dialog's fields to be filled in via Hamlib, and stop it otherwise. This does not wait for the previous background thread to finish, so it is safe to call from the GTK main thread. """
+        autofill = preferences.getboolean("hamlib", "autofill", fallback=False)
+        rig_model = preferences.get("hamlib", "rig_model", fallback=None)
+        rig_pathname = preferences.get("hamlib", "rig_pathname", fallback=None)
+        try:
+            interval = float(preferences.get("hamlib", "poll_interval", fallback=1))
+            if(interval <= 0):
+                raise ValueError
+        except ValueError:
+            logging.warning("The rig polling interval must be a positive number. Using 1 second instead.")
+            interval = 1.0
+
+        self.stop()
+        if(autofill and rig_model and rig_model != "RIG_MODEL_NONE" and rig_pathname is not None):
+            (self.rig_model, self.rig_pathname, self.interval) = (rig_model, rig_pathname, interval)
+            self.start()
+        return
+
+    def on_preferences_changed(self, changed):
+        """ Re-start the service if any of the Hamlib preferences have changed.
+
+        :arg set changed: The (section, option) tuples of the preferences that have changed.
+        """
+        if(any(section == "hamlib" for (section, option) in changed)):
+            self.apply_preferences()
+        return
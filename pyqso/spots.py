@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+from collections import namedtuple, deque
+
+from pyqso.adif import MODES
+from pyqso.band_plan import band_for_frequency
+
+# A single DX spot. The frequency is in kHz, and 'received' is the time (in seconds since the epoch) at which the spot arrived.
+Spot = namedtuple("Spot", ["spotter", "frequency", "dx_call", "comment", "time", "locator", "band", "mode", "received"])
+
+# e.g. "DX de W3LPL:     14025.0  JA1ABC       CW 599                      1234Z FM19"
+SPOT_PATTERN = re.compile(r"^DX de\s+([^\s:]+):?\s+(\d+(?:\.\d*)?)\s+(\S+)\s+(.*?)\s*(\d{4})Z(?:\s+([A-Ra-r]{2}\d\d))?\s*$")
+
+# Modes that may be mentioned in a spot's comment. Sideband modes are all treated as SSB.
+SPOT_MODES = set(MODES.keys()) | set([submode for submodes in MODES.values() for submode in submodes])
+SPOT_MODES.discard("")
+MODE_PATTERN = re.compile(r"\b(%s)\b" % "|".join(sorted([re.escape(m) for m in SPOT_MODES], key=len, reverse=True)))
+MODE_ALIASES = {"USB": "SSB", "LSB": "SSB"}
+
+
+def get_band(frequency):
+    """ Return the band that a frequency lies in.
+
+    :arg float frequency: The frequency in kHz.
+    :returns: The band (e.g. "20m"), or an empty string if the frequency is not in any band.
+    :rtype: str
+    """
+    return band_for_frequency(frequency/1e3)
+
+
+def get_mode(comment):
+    """ Return the mode mentioned in a spot's comment.
+
+    :arg str comment: The spot's comment.
+    :returns: The mode (e.g. "CW"), or an empty string if no mode is mentioned.
+    :rtype: str
+    """
+    m = MODE_PATTERN.search(comment.upper())
+    if(m):
+        mode = m.group(1)
+        return MODE_ALIASES.get(mode, mode)
+    return ""
+
+
+def parse_spot(line, received=None):
+    """ Parse a single line of DX cluster output.
+
+    :arg str line: The line of text (without the newline character).
+    :arg float received: The time at which the line was received. By default, this is the current time.
+    :returns: The spot, or None if the line is not a DX spot.
+    :rtype: Spot
+    """
+    if(not line.startswith("DX de")):
+        return None  # This check is much cheaper than the regular expression.
+    m = SPOT_PATTERN.match(line)
+    if(not m):
+        return None
+    (spotter, frequency, dx_call, comment, hhmm, locator) = m.groups()
+    frequency = float(frequency)
+    return Spot(spotter.upper(), frequency, dx_call.upper(), comment, hhmm, (locator or "").upper(), get_band(frequency), get_mode(comment),
+                received if received is not None else time.time())
+
+
+class SpotParser:
+
+    """ Extracts DX spots from a DX cluster's output. The output may be split across several reads at arbitrary points, so any incomplete line is kept until the rest of it arrives. """
+
+    def __init__(self):
+        self.partial = ""
+        return
+
+    def feed(self, text, received=None):
+        """ Parse any complete lines in the text received from the DX cluster.
+
+        :arg str text: The text received from the DX cluster.
+        :arg float received: The time at which the text was received. By default, this is the current time.
+        :returns: The spots that were found.
+        :rtype: list
+        """
+        if(received is None):
+            received = time.time()
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        spots = []
+        for line in lines:
+            spot = parse_spot(line.rstrip("\r"), received)
+            if(spot is not None):
+                spots.append(spot)
+        return spots
+
+    def reset(self):
+        """ Discard any incomplete line (e.g. when the connection is lost). """
+        self.partial = ""
+        return
+
+
+class SpotStore:
+
+    """ A bounded, in-memory store of DX spots, indexed by band, mode and DX callsign. Spots are kept in the order in which they arrived, so insertion and expiry are O(1) and queries only need to look at the most recent spots that match the most selective index. """
+
+    def __init__(self, maximum_size=10000, maximum_age=3600):
+        """ Set up the store.
+
+        :arg int maximum_size: The maximum number of spots to keep. The oldest spots are removed first.
+        :arg float maximum_age: The maximum age of the spots to keep, in seconds.
+        """
+        self.maximum_size = maximum_size
+        self.maximum_age = maximum_age
+        self.spots = deque()
+        self.indices = {"band": {}, "mode": {}, "dx_call": {}}
+        return
+
+    def __len__(self):
+        return len(self.spots)
+
+    def add(self, spot):
+        """ Add a spot to the store, and remove any spots that are too old.
+
+        :arg Spot spot: The spot to add. This should not be older than any spot already in the store.
+        """
+        self.spots.append(spot)
+        for field, index in self.indices.items():
+            key = getattr(spot, field)
+            if(key in index):
+                index[key].append(spot)
+            else:
+                index[key] = deque([spot])
+        self.expire(spot.received)
+        return
+
+    def expire(self, now=None):
+        """ Remove the spots that are older than the maximum age, and the oldest spots if there are too many.
+
+        :arg float now: The current time. By default, this is the current system time.
+        """
+        if(now is None):
+            now = time.time()
+        cutoff = now - self.maximum_age
+        while(self.spots and (len(self.spots) > self.maximum_size or self.spots[0].received < cutoff)):
+            spot = self.spots.popleft()
+            # The spots in each index are also in order of arrival, so the expired spot is at the front.
+            for field, index in self.indices.items():
+                key = getattr(spot, field)
+                spots = index[key]
+                spots.popleft()
+                if(not spots):
+                    del index[key]
+        return
+
+    def query(self, band=None, mode=None, dx_call=None, age=None, now=None):
+        """ Find the spots that match all of the given criteria.
+
+        :arg str band: Only include spots on this band (e.g. "20m").
+        :arg str mode: Only include spots with this mode (e.g. "CW").
+        :arg str dx_call: Only include spots of this DX callsign.
+        :arg float age: Only include spots that arrived within this many seconds.
+        :arg float now: The current time. By default, this is the current system time.
+        :returns: The matching spots, in the order in which they arrived.
+        :rtype: list
+        """
+        if(now is None):
+            now = time.time()
+        self.expire(now)
+
+        criteria = [(field, value) for (field, value) in [("band", band), ("mode", mode), ("dx_call", dx_call.upper() if dx_call else dx_call)] if value is not None]
+        if(criteria):
+            # Start from the smallest of the matching indices.
+            candidates = min([self.indices[field].get(value, ()) for (field, value) in criteria], key=len)
+        else:
+            candidates = self.spots
+        cutoff = now - age if age is not None else None
+
+        matches = []
+        for spot in reversed(candidates):
+            if(cutoff is not None and spot.received < cutoff):
+                break  # All the remaining spots are older.
+            if(all([getattr(spot, field) == value for (field, value) in criteria])):
+                matches.append(spot)
+        matches.reverse()
+        return matches
+
+    def clear(self):
+        """ Remove all the spots. """
+        self.spots.clear()
+        for index in self.indices.values():
+            index.clear()
+        return
+
+
+def format_spot(spot):
+    """ Format a spot in the same way as a DX cluster.
+
+    :arg Spot spot: The spot to format.
+    :returns: The formatted spot, ending with a newline character.
+    :rtype: str
+    """
+    line = "%-15s %9.1f  %-12s %-30s %sZ" % ("DX de %s:" % spot.spotter, spot.frequency, spot.dx_call, spot.comment, spot.time)
+    if(spot.locator):
+        line += " " + spot.locator
+    return line + "\n"
+
+
+class SpotDeduplicator:
+
+    """ Detects near-duplicate spots, i.e. spots of the same DX callsign on (almost) the same frequency which arrive within a short time of each other, e.g. from several DX clusters or from several skimmers. Spots are hashed by DX callsign and frequency bin into time buckets, so each check is O(1). """
+
+    def __init__(self, tolerance=1.0, window=120):
+        """ Set up the hash index.
+
+        :arg float tolerance: The maximum difference in frequency (in kHz) between two duplicate spots.
+        :arg float window: The maximum time (in seconds) between two duplicate spots.
+        """
+        self.tolerance = tolerance
+        self.window = window
+        self.buckets = {}
+        return
+
+    def check(self, spot, source=None):
+        """ Check whether a spot is a duplicate of an earlier spot. If it is not, the spot is remembered.
+
+        :arg Spot spot: The spot to check.
+        :arg source: The name of the DX cluster that the spot came from.
+        :returns: The earlier spot and the name of its DX cluster, or None if the spot is not a duplicate.
+        :rtype: tuple
+        """
+        bucket = int(spot.received // self.window)
+        frequency_bin = int(round(spot.frequency / self.tolerance))
+
+        # A duplicate can only be in the current or the previous time bucket, and in the same or an adjacent frequency bin.
+        for b in (bucket, bucket - 1):
+            entries = self.buckets.get(b)
+            if(entries):
+                for f in (frequency_bin, frequency_bin - 1, frequency_bin + 1):
+                    entry = entries.get((spot.dx_call, f))
+                    if(entry is not None):
+                        (earlier, earlier_source) = entry
+                        if(abs(earlier.frequency - spot.frequency) <= self.tolerance and 0 <= spot.received - earlier.received <= self.window):
+                            return entry
+
+        if(bucket not in self.buckets):
+            # Forget the spots that can no longer be matched.
+            for b in [b for b in self.buckets if b < bucket - 1]:
+                del self.buckets[b]
+            self.buckets[bucket] = {}
+        self.buckets[bucket][(spot.dx_call, frequency_bin)] = (spot, source)
+        return None
+
+
+class SourceStatistics:
+
+    """ Counters for the spots received from a single DX cluster, used to compare the coverage and speed of several DX clusters. """
+
+    def __init__(self, window=600):
+        """ Set up the counters.
+
+        :arg float window: The length of the sliding window (in seconds) over which the spot rate is measured.
+        """
+        self.window = window
+        self.spots = 0  # The total number of spots received.
+        self.first = 0  # The number of spots which this DX cluster delivered before any other.
+        self.duplicates = 0
+        self.lagged = 0  # The number of duplicates of spots first delivered by another DX cluster...
+        self.total_lag = 0.0  # ...and the total time (in seconds) by which they were late.
+        self.recent = deque()
+        return
+
+    def record(self, spot, source=None, earlier=None):
+        """ Record a spot.
+
+        :arg Spot spot: The spot.
+        :arg source: The name of the DX cluster that the spot came from.
+        :arg tuple earlier: The earlier spot and the name of its DX cluster, if the spot is a duplicate.
+        """
+        self.spots += 1
+        if(earlier is None):
+            self.first += 1
+        else:
+            self.duplicates += 1
+            (earlier_spot, earlier_source) = earlier
+            if(earlier_source != source):
+                self.lagged += 1
+                self.total_lag += spot.received - earlier_spot.received
+        self.recent.append(spot.received)
+        self.expire(spot.received)
+        return
+
+    def expire(self, now):
+        """ Forget the arrival times that are outside of the sliding window. """
+        cutoff = now - self.window
+        while(self.recent and self.recent[0] < cutoff):
+            self.recent.popleft()
+        return
+
+    def rate(self, now=None):
+        """ Return the number of spots received per minute over the sliding window.
+
+        :arg float now: The current time. By default, this is the current system time.
+        :rtype: float
+        """
+        if(now is None):
+            now = time.time()
+        self.expire(now)
+        return len(self.recent) * 60.0 / self.window
+
+    @property
+    def mean_lag(self):
+        """ Return the mean time (in seconds) by which this DX cluster was behind the first DX cluster to deliver the same spot.
+
+        :rtype: float
+        """
+        if(self.lagged == 0):
+            return 0.0
+        return self.total_lag / self.lagged
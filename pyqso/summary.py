@@ -19,24 +19,34 @@
 
 from gi.repository import Gtk
 import logging
-from os.path import basename, getmtime, expanduser, dirname, join, realpath
+from os.path import basename, getmtime, dirname, join, realpath
 from datetime import datetime, date
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
-try:
-    import matplotlib
-    matplotlib.use('Agg')
-    matplotlib.rcParams['font.size'] = 10.0
-    from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas
-    from matplotlib.figure import Figure
-    from matplotlib.dates import DateFormatter, MonthLocator
-    have_matplotlib = True
-except ImportError as e:
-    logging.warning(e)
-    logging.warning("Could not import matplotlib, so you will not be able to plot annual logbook statistics. Check that all the PyQSO dependencies are satisfied.")
-    have_matplotlib = False
+from importlib.util import find_spec
+
+from pyqso.preferences import preferences
+
+# matplotlib takes a long time to import, so it is only imported when the annual statistics are first plotted.
+matplotlib = None
+Figure = None
+have_matplotlib = (find_spec("matplotlib") is not None)
+if(not have_matplotlib):
+    logging.warning("Could not find matplotlib, so you will not be able to plot annual logbook statistics. Check that all the PyQSO dependencies are satisfied.")
+
+
+def import_matplotlib():
+    """ Import the parts of matplotlib needed to plot the annual statistics, unless they have been imported already.
+
+    :raises ImportError: If matplotlib could not be imported.
+    """
+    global matplotlib, FigureCanvas, Figure, DateFormatter, MonthLocator
+    if(Figure is None):
+        import matplotlib
+        matplotlib.use('Agg')
+        matplotlib.rcParams['font.size'] = 10.0
+        from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas
+        from matplotlib.dates import DateFormatter, MonthLocator
+        from matplotlib.figure import Figure
+    return
 
 
 class Summary(object):
@@ -63,11 +73,9 @@ class Summary(object):
         self.items["DATE_MODIFIED"] = self.builder.get_object("date_modified")
 
         # Yearly statistics
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
         (section, option) = ("general", "show_yearly_statistics")
-        if(have_config and config.has_option(section, option)):
-            if(config.getboolean("general", "show_yearly_statistics") and have_matplotlib):
+        if(preferences.has_option(section, option)):
+            if(preferences.getboolean(section, option) and have_matplotlib):
                 hbox = Gtk.HBox()
                 label = Gtk.Label(label="Display statistics for year: ", halign=Gtk.Align.START)
                 hbox.pack_start(label, False, False, 6)
@@ -81,11 +89,11 @@ class Summary(object):
                 hbox.pack_start(year_select, False, False, 6)
                 self.summary_page.pack_start(hbox, False, False, 4)
 
-                self.items["YEARLY_STATISTICS"] = Figure()
-                canvas = FigureCanvas(self.items["YEARLY_STATISTICS"])
-                canvas.set_size_request(800, 175)
-                canvas.show()
-                self.summary_page.pack_start(canvas, True, True, 0)
+                # The figure is only created when a year is first selected.
+                self.items["YEARLY_STATISTICS"] = None
+                self.statistics_box = Gtk.Box()
+                self.statistics_box.set_size_request(800, 175)
+                self.summary_page.pack_start(self.statistics_box, True, True, 0)
 
         # Summary tab label and icon.
         tab = Gtk.HBox(homogeneous=False, spacing=0)
@@ -101,7 +109,19 @@ class Summary(object):
         return
 
     def on_year_changed(self, combo):
-        """ Re-plot the statistics for the year selected by the user. """
+        """ Re-plot the statistics for the year selected by the user. The figure is created the first time this is called. """
+
+        if(self.items["YEARLY_STATISTICS"] is None):
+            try:
+                import_matplotlib()
+            except ImportError as e:
+                logging.error("Could not import matplotlib, so the annual logbook statistics cannot be plotted.")
+                logging.exception(e)
+                return
+            self.items["YEARLY_STATISTICS"] = Figure()
+            canvas = FigureCanvas(self.items["YEARLY_STATISTICS"])
+            canvas.show()
+            self.statistics_box.pack_start(canvas, True, True, 0)
 
         # Clear figure
         self.items["YEARLY_STATISTICS"].clf()
@@ -17,6 +17,9 @@
 #    You should have received a copy of the GNU General Public License
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
+from gi.repository import GObject
+import logging
+
 from pyqso.dx_cluster import DXCluster
 from pyqso.world_map import WorldMap
 from pyqso.awards import Awards
@@ -24,10 +27,10 @@ from pyqso.awards import Awards
 
 class Toolbox:
 
-    """ Contains a Gtk.Notebook full of amateur radio-related tools. """
+    """ Contains a Gtk.Notebook full of amateur radio-related tools. Each tool is only built when its page is first shown, and tools that are not visible are not kept up-to-date; instead, they are marked as dirty and updated in one go when they are next shown. """
 
     def __init__(self, application):
-        """ Instantiate and insert the various tools into the toolbox.
+        """ Set up the toolbox. The tools themselves are built when they are first shown.
 
         :arg application: The PyQSO application containing the main Gtk window, etc.
         """
@@ -37,12 +40,118 @@ class Toolbox:
 
         self.tools = self.builder.get_object("tools")
 
-        self.dx_cluster = DXCluster(self.application)
-        self.world_map = WorldMap(self.application)
-        self.awards = Awards(self.application)
+        # The class of the tool on each page of the notebook, in order.
+        self.pages = [("dx_cluster", DXCluster), ("world_map", WorldMap), ("awards", Awards)]
+        self.instances = {}  # The tools that have been built so far, keyed by name.
+        self.dirty = set()  # The names of the tools which need updating when they are next shown.
 
         self.tools.connect_after("switch-page", self.on_switch_page)
+        toolbox_frame = self.builder.get_object("toolbox")
+        toolbox_frame.connect("map", self.on_map)
+        toolbox_frame.connect("unmap", self.on_unmap)
+
+        return
+
+    @property
+    def dx_cluster(self):
+        """ The DX cluster tool. This is built if it has not been built already. """
+        return self.get_tool("dx_cluster")
+
+    @property
+    def world_map(self):
+        """ The World Map tool. This is built if it has not been built already. """
+        return self.get_tool("world_map")
+
+    @property
+    def awards(self):
+        """ The Awards tool. This is built if it has not been built already. """
+        return self.get_tool("awards")
+
+    def get_tool(self, name):
+        """ Return a tool, building it if necessary.
+
+        :arg str name: The name of the tool (e.g. "world_map").
+        :returns: The tool.
+        """
+        if(name not in self.instances):
+            logging.debug("Building the '%s' tool..." % name)
+            self.instances[name] = dict(self.pages)[name](self.application)
+        return self.instances[name]
+
+    def is_visible(self, name):
+        """ Check whether a tool is currently shown to the user.
+
+        :arg str name: The name of the tool (e.g. "world_map").
+        :returns: True if the toolbox is visible and the tool's page is selected, and False otherwise.
+        :rtype: bool
+        """
+        if(not self.builder.get_object("toolbox").get_visible()):
+            return False
+        return self.pages[self.tools.get_current_page()][0] == name
+
+    def show_tool(self, name):
+        """ Build a tool if it has not been built already, and apply any updates made while it was not visible.
+
+        :arg str name: The name of the tool that has just been shown.
+        """
+        dirty = (name in self.dirty)
+        self.dirty.discard(name)
+        built = (name in self.instances)
+        tool = self.get_tool(name)
+        logbook = self.application.logbook
+        if(name == "world_map"):
+            if(dirty and tool.heatmap is not None):
+                tool.count_grid_squares(logbook)  # This also re-draws the map.
+            else:
+                tool.draw()
+            tool.resume()
+        elif(name == "awards"):
+            if(dirty and built):
+                tool.count(logbook)  # A newly-built Awards tool counts the QSOs itself.
+        return
 
+    def show_current_tool(self):
+        """ Show the tool on the selected page, if the toolbox is visible.
+
+        :returns: False, so that this is only called once when dispatched by GObject.idle_add.
+        :rtype: bool
+        """
+        if(self.builder.get_object("toolbox").get_visible()):
+            page = self.tools.get_current_page()
+            if(page >= 0):
+                self.show_tool(self.pages[page][0])
+        return False
+
+    def count_awards(self, logbook):
+        """ Update the Awards tool after QSOs have been added, edited or deleted. If the tool is not visible, this is postponed until it is next shown.
+
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        if("awards" in self.instances and self.is_visible("awards")):
+            self.awards.count(logbook)
+        else:
+            self.dirty.add("awards")
+        return
+
+    def count_grid_squares(self, logbook):
+        """ Count the worked grid squares on the World Map after a logbook has been opened or changed. If the World Map is not visible, this is postponed until it is next shown.
+
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        if("world_map" in self.instances and self.is_visible("world_map")):
+            self.world_map.count_grid_squares(logbook)
+        else:
+            self.dirty.add("world_map")
+        return
+
+    def update_grid_squares(self, added=(), removed=()):
+        """ Update the worked grid square counts on the World Map after QSOs have been added, edited or deleted. Nothing is done if the World Map has not been built, or is going to count the grid squares from scratch when it is next shown.
+
+        :arg added: The grid squares of the QSOs that have been added.
+        :arg removed: The grid squares of the QSOs that have been removed.
+        """
+        if("world_map" in self.instances and "world_map" not in self.dirty):
+            self.world_map.update_grid_squares(added=added, removed=removed)
         return
 
     def toggle_visible_callback(self, widget=None):
@@ -51,8 +160,21 @@ class Toolbox:
         toolbox_frame.set_visible(not toolbox_frame.get_visible())
         return
 
+    def on_map(self, widget):
+        """ Show the selected tool once the toolbox has been shown. This is done once the main loop is idle, since the toolbox may be hidden again straight away (e.g. when the main window is first shown). """
+        GObject.idle_add(self.show_current_tool)
+        return
+
+    def on_unmap(self, widget):
+        """ Stop re-drawing the World Map while the toolbox is hidden. """
+        if("world_map" in self.instances):
+            self.world_map.pause()
+        return
+
     def on_switch_page(self, widget, label, new_page):
-        """ Re-draw the WorldMap if the user switches to the World Map tab. """
-        if(widget.get_tab_label(label).get_text() == "World Map"):
-            self.world_map.draw()
+        """ Show the tool on the page that the user has switched to, and stop re-drawing the World Map if it is no longer visible. """
+        if(self.pages[new_page][0] != "world_map" and "world_map" in self.instances):
+            self.world_map.pause()
+        if(self.builder.get_object("toolbox").get_visible()):
+            self.show_tool(self.pages[new_page][0])
         return
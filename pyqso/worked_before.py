@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sqlite3 as sqlite
+
+from pyqso.geocoding import Geocoder, normalise
+
+# The need status of a station, from the most to the least wanted.
+NEW_DXCC_BAND = "NEW_DXCC_BAND"  # The station's DXCC entity has not been worked on this band.
+NEW_CALL = "NEW_CALL"  # The station has never been worked.
+NEW_BAND = "NEW_BAND"  # The station has been worked, but not on this band.
+NEW_MODE = "NEW_MODE"  # The station has been worked on this band, but not with this mode.
+WORKED = "WORKED"  # The station has already been worked on this band with this mode.
+
+# The fields of a record that the index depends on.
+INDEXED_FIELDS = ["CALL", "BAND", "MODE", "COUNTRY"]
+
+
+class WorkedBefore:
+
+    """ An in-memory index of the stations, bands, modes and DXCC entities worked in a logbook, so that the need status of a spotted station can be found in O(1) time rather than with an SQL query over every log.
+    Each key is mapped to the number of records that contain it, so that records can be removed from the index as well as added. """
+
+    def __init__(self, geocoder=None):
+        """ Set up an empty index.
+
+        :arg Geocoder geocoder: Used to find the DXCC entity of a callsign from its prefix. By default, a Geocoder without an on-disk cache is created.
+        """
+        self.geocoder = geocoder if geocoder is not None else Geocoder(path=None)
+        self.calls = {}
+        self.call_bands = {}
+        self.call_band_modes = {}
+        self.entity_bands = {}
+        return
+
+    def __len__(self):
+        return sum(self.calls.values())
+
+    def get_keys(self, call, band, mode, country=None):
+        """ Return the keys under which a QSO is indexed.
+
+        :arg str call: The station's callsign.
+        :arg str band: The band (e.g. "20m").
+        :arg str mode: The mode (e.g. "CW").
+        :arg str country: The station's country as logged. This is only used if the DXCC entity cannot be found from the callsign's prefix.
+        :returns: The keys for the call, call+band, call+band+mode and DXCC entity+band indices, or None if there is no callsign.
+        :rtype: tuple
+        """
+        call = (call or "").strip().upper()
+        if(not call):
+            return None
+        band = (band or "").strip().lower()
+        mode = (mode or "").strip().upper()
+        entity = normalise(self.geocoder.get_country(call) or country)
+        return (call, (call, band), (call, band, mode), (entity, band))
+
+    def add(self, records):
+        """ Add one or more records to the index.
+
+        :arg records: A single record, or a list of records. Each record may be a dictionary of (upper case) field names, or a row from the database.
+        """
+        if(isinstance(records, (dict, sqlite.Row))):
+            records = [records]
+        for record in records:
+            keys = self.get_keys(*[get_field(record, field_name) for field_name in INDEXED_FIELDS])
+            if(keys is not None):
+                for (index, key) in zip(self.indices, keys):
+                    index[key] = index.get(key, 0) + 1
+        return
+
+    def remove(self, records):
+        """ Remove one or more records from the index.
+
+        :arg records: A single record, or a list of records, as for the add method.
+        """
+        if(isinstance(records, (dict, sqlite.Row))):
+            records = [records]
+        for record in records:
+            keys = self.get_keys(*[get_field(record, field_name) for field_name in INDEXED_FIELDS])
+            if(keys is not None):
+                for (index, key) in zip(self.indices, keys):
+                    count = index.get(key, 0) - 1
+                    if(count > 0):
+                        index[key] = count
+                    else:
+                        index.pop(key, None)
+        return
+
+    @property
+    def indices(self):
+        """ Return the call, call+band, call+band+mode and DXCC entity+band indices, in the same order as the keys returned by get_keys. """
+        return (self.calls, self.call_bands, self.call_band_modes, self.entity_bands)
+
+    def load(self, logs):
+        """ Rebuild the index from scratch, using only the indexed fields of every record in the logs.
+
+        :arg list logs: The logs in the logbook.
+        """
+        self.clear()
+        for log in logs:
+            try:
+                with log.connection:
+                    c = log.connection.cursor()
+                    c.execute("SELECT %s FROM %s" % (", ".join(INDEXED_FIELDS).lower(), log.name))
+                    self.add(c.fetchall())
+            except sqlite.Error as e:
+                logging.error("Could not index the QSOs in log '%s'." % log.name)
+                logging.exception(e)
+        logging.debug("Indexed %d QSOs with %d different callsigns." % (len(self), len(self.calls)))
+        return
+
+    def clear(self):
+        """ Remove everything from the index. """
+        for index in self.indices:
+            index.clear()
+        return
+
+    def status(self, call, band, mode=""):
+        """ Return the need status of a station.
+
+        :arg str call: The station's callsign.
+        :arg str band: The band (e.g. "20m").
+        :arg str mode: The mode (e.g. "CW"). If this is unknown (i.e. an empty string), then the mode is not taken into account.
+        :returns: One of NEW_DXCC_BAND, NEW_CALL, NEW_BAND, NEW_MODE or WORKED.
+        :rtype: str
+        """
+        keys = self.get_keys(call, band, mode)
+        if(keys is None):
+            return WORKED
+        (call, call_band, call_band_mode, entity_band) = keys
+        if(not call_band[1]):
+            # The band is unknown, so only the callsign can be checked.
+            return NEW_CALL if call not in self.calls else WORKED
+        elif(entity_band[0] and entity_band not in self.entity_bands):
+            return NEW_DXCC_BAND
+        elif(call not in self.calls):
+            return NEW_CALL
+        elif(call_band not in self.call_bands):
+            return NEW_BAND
+        elif(call_band_mode[2] and call_band_mode not in self.call_band_modes):
+            return NEW_MODE
+        return WORKED
+
+    def spot_status(self, spot):
+        """ Return the need status of a spotted station.
+
+        :arg Spot spot: The DX spot.
+        :returns: One of NEW_DXCC_BAND, NEW_CALL, NEW_BAND, NEW_MODE or WORKED.
+        :rtype: str
+        """
+        return self.status(spot.dx_call, spot.band, spot.mode)
+
+
+def get_field(record, field_name):
+    """ Return the value of a field in a record, or an empty string if the record does not have that field.
+
+    :arg record: A dictionary of (upper case) field names, or a row from the database.
+    :arg str field_name: The name of the field.
+    :rtype: str
+    """
+    try:
+        return record[field_name] or ""
+    except (KeyError, IndexError):
+        return ""
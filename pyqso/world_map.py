@@ -21,38 +21,74 @@ from gi.repository import GObject
 import logging
 import sqlite3 as sqlite
 import re
+import os
+from collections import OrderedDict
 from os.path import expanduser
 from datetime import datetime
-try:
-    import configparser
-except ImportError:
-    import ConfigParser as configparser
-try:
-    import numpy
-    logging.info("Using version %s of numpy." % (numpy.__version__))
-    import matplotlib
-    logging.info("Using version %s of matplotlib." % (matplotlib.__version__))
-    import cartopy
-    logging.info("Using version %s of cartopy." % (cartopy.__version__))
-    from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas
-    from matplotlib.backends.backend_gtk3 import NavigationToolbar2GTK3
-    have_necessary_modules = True
-except ImportError as e:
-    logging.warning(e)
-    logging.warning("Could not import a non-standard Python module needed by the WorldMap class, or the version of the non-standard module is too old. Check that all the PyQSO dependencies are satisfied.")
-    have_necessary_modules = False
-try:
-    import geocoder
-    have_geocoder = True
-except ImportError:
-    logging.warning("Could not import the geocoder module!")
-    have_geocoder = False
-
-if(have_necessary_modules):
-    class NavigationToolbar(NavigationToolbar2GTK3):
-        """ Navigation tools for the World Map. """
-        # Only include a subset of the tools.
-        toolitems = [t for t in NavigationToolbar2GTK3.toolitems if t[0] in ("Home", "Zoom", "Save")]
+from pyqso.geocoding import Geocoder
+from pyqso.preferences import preferences
+
+# The non-standard modules below take a long time to import, so they are only imported when the world map is first drawn (or a grid square array is first needed), rather than when PyQSO starts.
+numpy = None
+matplotlib = None
+cartopy = None
+have_necessary_modules = None  # Unknown until import_modules has been called.
+
+HEATMAP_CACHE_FILE = expanduser("~/.config/pyqso/heatmap.npz")
+
+
+def import_numpy():
+    """ Import numpy, unless it has been imported already.
+
+    :returns: The numpy module.
+    :raises ImportError: If numpy could not be imported.
+    """
+    global numpy
+    if(numpy is None):
+        import numpy
+        logging.info("Using version %s of numpy." % (numpy.__version__))
+    return numpy
+
+
+def import_modules():
+    """ Import all the non-standard modules needed to draw the world map, unless this has been attempted already.
+
+    :returns: True if the modules could be imported, and False otherwise.
+    :rtype: bool
+    """
+    global matplotlib, cartopy, FigureCanvas, NavigationToolbar, PathCollection, FontProperties, MarkerStyle, TextPath, have_necessary_modules
+    if(have_necessary_modules is not None):
+        return have_necessary_modules
+    try:
+        import_numpy()
+        import matplotlib
+        logging.info("Using version %s of matplotlib." % (matplotlib.__version__))
+        import cartopy
+        logging.info("Using version %s of cartopy." % (cartopy.__version__))
+        import cartopy.crs
+        import cartopy.feature
+        import cartopy.mpl.gridliner
+        from matplotlib.backends.backend_gtk3agg import FigureCanvasGTK3Agg as FigureCanvas  # The Agg-based canvas supports blitting.
+        from matplotlib.backends.backend_gtk3 import NavigationToolbar2GTK3
+        from matplotlib.collections import PathCollection
+        from matplotlib.font_manager import FontProperties
+        from matplotlib.markers import MarkerStyle
+        from matplotlib.textpath import TextPath
+        import matplotlib.colors
+        import matplotlib.figure
+        import matplotlib.transforms
+
+        class NavigationToolbar(NavigationToolbar2GTK3):
+            """ Navigation tools for the World Map. """
+            # Only include a subset of the tools.
+            toolitems = [t for t in NavigationToolbar2GTK3.toolitems if t[0] in ("Home", "Zoom", "Save")]
+
+        have_necessary_modules = True
+    except ImportError as e:
+        logging.warning(e)
+        logging.warning("Could not import a non-standard Python module needed by the WorldMap class, or the version of the non-standard module is too old. Check that all the PyQSO dependencies are satisfied.")
+        have_necessary_modules = False
+    return have_necessary_modules
 
 
 class Point:
@@ -72,6 +108,22 @@ class Point:
         self.style = style
         return
 
+    @property
+    def color_and_marker(self):
+        """ Split the point's matplotlib-style format string (e.g. "yo") into its colour and marker components.
+
+        :returns: The colour and marker of the point. These default to yellow and a filled circle respectively.
+        :rtype: tuple
+        """
+        color = "y"
+        marker = "o"
+        for character in self.style:
+            if(character in "bgrcmykw"):
+                color = character
+            elif(character in "o.,v^<>12348spP*hH+xXDd|_"):
+                marker = character
+        return (color, marker)
+
 
 class Maidenhead:
 
@@ -140,13 +192,285 @@ class Maidenhead:
     def longitude4(self, g):
         return 20*(ord(g[0]) - ord("A")) + 2*int(g[2])-180
 
+    def parse_array(self, grid_squares):
+        """ Split an array of Maidenhead grid square locators into the indices of their field, square and subsquare components. Locators are treated case-insensitively, and only the first 6 characters of longer locators are considered.
+
+        :arg grid_squares: A sequence of 2-, 4- or 6-character Maidenhead grid square locators. Empty values (e.g. None) are allowed.
+        :rtype: tuple
+        :returns: A tuple of two arrays: the integer indices of each component, with shape (number of locators, 6) and ordered as they appear in the locator, and the number of valid characters in each locator (0 if the locator is invalid).
+        """
+
+        import_numpy()
+        codes = numpy.array([(g or "")[:6].encode("ascii", "replace") for g in grid_squares], dtype="S6")
+        codes = numpy.frombuffer(codes.tobytes(), dtype=numpy.uint8).reshape(-1, 6).astype(numpy.int16)
+        lengths = numpy.count_nonzero(codes, axis=1)
+
+        # Letters are converted to lower case, so that e.g. "IO91gb" and "io91GB" are both accepted.
+        indices = numpy.empty(codes.shape, dtype=numpy.int16)
+        indices[:, 0:2] = (codes[:, 0:2] | 0x20) - ord("a")
+        indices[:, 2:4] = codes[:, 2:4] - ord("0")
+        indices[:, 4:6] = (codes[:, 4:6] | 0x20) - ord("a")
+
+        limits = numpy.array([len(self.upper)]*2 + [10]*2 + [len(self.lower)]*2)
+        valid_characters = (indices >= 0) & (indices < limits)
+        # Only the characters within the length of each locator need to be valid.
+        valid = numpy.all(valid_characters | (numpy.arange(6) >= lengths[:, numpy.newaxis]), axis=1) & numpy.isin(lengths, [2, 4, 6])
+        lengths[~valid] = 0
+
+        return (indices, lengths)
+
+    def gs2ll_array(self, grid_squares):
+        """ Convert an array of Maidenhead grid square locators to latitude-longitude coordinates, giving the centre of each field, square or subsquare.
+
+        :arg grid_squares: A sequence of 2-, 4- or 6-character Maidenhead grid square locators.
+        :rtype: tuple
+        :returns: The arrays of latitudes and longitudes. These are NaN for any locators that could not be parsed.
+        """
+
+        indices, lengths = self.parse_array(grid_squares)
+        latitudes = numpy.full(len(lengths), numpy.nan)
+        longitudes = numpy.full(len(lengths), numpy.nan)
+
+        fields = (lengths == 2)
+        latitudes[fields] = 10*indices[fields, 1] - 90 + 5.0
+        longitudes[fields] = 20*indices[fields, 0] - 180 + 10.0
+
+        squares = (lengths == 4)
+        latitudes[squares] = 10*indices[squares, 1] + indices[squares, 3] - 90 + 0.5
+        longitudes[squares] = 20*indices[squares, 0] + 2*indices[squares, 2] - 180 + 1.0
+
+        subsquares = (lengths == 6)
+        latitudes[subsquares] = 10*indices[subsquares, 1] + indices[subsquares, 3] - 90 + (1.0/60.0)*2.5*(indices[subsquares, 5]+0.5)
+        longitudes[subsquares] = 20*indices[subsquares, 0] + 2*indices[subsquares, 2] - 180 + (1.0/60.0)*5*(indices[subsquares, 4]+0.5)
+
+        return (latitudes, longitudes)
+
+    def ll2gs_array(self, latitudes, longitudes, subsquare=False):
+        """ Convert arrays of latitude-longitude coordinates to Maidenhead grid square locators.
+
+        :arg latitudes: The array of latitudes.
+        :arg longitudes: The array of longitudes.
+        :arg bool subsquare: Option to include the subsquare (thereby obtaining 6-character Maidenhead locators).
+        :rtype: numpy.array
+        :returns: The array of Maidenhead grid square locators.
+        """
+
+        import_numpy()
+        adjusted_latitudes = numpy.asarray(latitudes, dtype=float) + 90
+        adjusted_longitudes = numpy.asarray(longitudes, dtype=float) + 180
+        # Coordinates on the north pole or the antimeridian belong to the last field.
+        adjusted_latitudes = numpy.clip(adjusted_latitudes, 0, 180 - 1e-9)
+        adjusted_longitudes = numpy.clip(adjusted_longitudes, 0, 360 - 1e-9)
+
+        length = 6 if subsquare else 4
+        codes = numpy.empty((len(adjusted_latitudes), length), dtype=numpy.uint8)
+        codes[:, 0] = ord("A") + (adjusted_longitudes/20).astype(int)
+        codes[:, 1] = ord("A") + (adjusted_latitudes/10).astype(int)
+        codes[:, 2] = ord("0") + ((adjusted_longitudes/2) % 10).astype(int)
+        codes[:, 3] = ord("0") + (adjusted_latitudes % 10).astype(int)
+        if(subsquare):
+            codes[:, 4] = ord("a") + (((adjusted_longitudes - (adjusted_longitudes/2).astype(int)*2) * 60)/5).astype(int)
+            codes[:, 5] = ord("a") + (((adjusted_latitudes - adjusted_latitudes.astype(int)) * 60)/2.5).astype(int)
+
+        return codes.view("S%d" % length).ravel().astype("U%d" % length)
+
+    def histogram(self, grid_squares, level="field", sparse=False):
+        """ Count the number of times each field, square or subsquare appears in an array of Maidenhead grid square locators. Locators that are not precise enough for the requested level (e.g. 4-character locators when counting subsquares) are ignored.
+
+        :arg grid_squares: A sequence of Maidenhead grid square locators.
+        :arg str level: The level at which to count the locators. This is either "field" (18 x 18 cells), "square" (180 x 180 cells) or "subsquare" (4320 x 4320 cells).
+        :arg bool sparse: If True, only return the locators that appear at least once, along with their counts. This is recommended at the subsquare level, to avoid allocating the full array of counts.
+        :rtype: numpy.array
+        :returns: A two-dimensional array of counts, where the first index is the latitude and the second index is the longitude (as per the locator's characters). If sparse is True, a tuple containing an array of locators and an array of counts is returned instead.
+        """
+
+        if(level == "field"):
+            (length, rows, columns) = (2, len(self.upper), len(self.upper))
+        elif(level == "square"):
+            (length, rows, columns) = (4, len(self.upper)*10, len(self.upper)*10)
+        elif(level == "subsquare"):
+            (length, rows, columns) = (6, len(self.upper)*10*len(self.lower), len(self.upper)*10*len(self.lower))
+        else:
+            raise ValueError("Unknown grid square level '%s'." % level)
+
+        indices, lengths = self.parse_array(grid_squares)
+        indices = indices[lengths >= length].astype(numpy.int64)
+
+        row = indices[:, 1]
+        column = indices[:, 0]
+        if(length >= 4):
+            row = row*10 + indices[:, 3]
+            column = column*10 + indices[:, 2]
+        if(length >= 6):
+            row = row*len(self.lower) + indices[:, 5]
+            column = column*len(self.lower) + indices[:, 4]
+        flat = row*columns + column
+
+        if(sparse):
+            flat, counts = numpy.unique(flat, return_counts=True)
+            (row, column) = numpy.divmod(flat, columns)
+            return (self.index2gs_array(row, column, level), counts)
+        else:
+            return numpy.bincount(flat, minlength=rows*columns).reshape(rows, columns)
+
+    def index2gs_array(self, rows, columns, level="field"):
+        """ Convert arrays of row (latitude) and column (longitude) indices, as used by the histogram method, to Maidenhead grid square locators.
+
+        :arg rows: The array of row indices.
+        :arg columns: The array of column indices.
+        :arg str level: The level of the indices. This is either "field", "square" or "subsquare".
+        :rtype: numpy.array
+        :returns: The array of Maidenhead grid square locators.
+        """
+
+        import_numpy()
+        length = {"field": 2, "square": 4, "subsquare": 6}[level]
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        columns = numpy.asarray(columns, dtype=numpy.int64)
+        codes = numpy.empty((len(rows), length), dtype=numpy.uint8)
+        if(length == 6):
+            codes[:, 4] = ord("a") + columns % len(self.lower)
+            codes[:, 5] = ord("a") + rows % len(self.lower)
+            (rows, columns) = (rows // len(self.lower), columns // len(self.lower))
+        if(length >= 4):
+            codes[:, 2] = ord("0") + columns % 10
+            codes[:, 3] = ord("0") + rows % 10
+            (rows, columns) = (rows // 10, columns // 10)
+        codes[:, 0] = ord("A") + columns
+        codes[:, 1] = ord("A") + rows
+        return codes.view("S%d" % length).ravel().astype("U%d" % length)
+
+
+class GridSquareHeatmap:
+
+    """ The number of QSOs made with each Maidenhead grid square, at both the field (e.g. IO) and the square (e.g. IO91) level. The counts are updated incrementally as QSOs are added, edited and deleted, and are cached on disk so that they only need to be counted from scratch when the logbook has been modified outside of PyQSO. """
+
+    def __init__(self, maidenhead, path=HEATMAP_CACHE_FILE):
+        """ Set up the arrays of counts.
+
+        :arg maidenhead: The Maidenhead object used to convert grid squares to array indices.
+        :arg str path: The path of the file in which the counts are cached. If None, the counts are not cached.
+        """
+        import_numpy()
+        self.maidenhead = maidenhead
+        self.path = path
+        self.fields = numpy.zeros((len(self.maidenhead.upper), len(self.maidenhead.upper)), dtype=numpy.int64)
+        self.squares = numpy.zeros((len(self.maidenhead.upper)*10, len(self.maidenhead.upper)*10), dtype=numpy.int64)
+        self.logbook_path = None
+        self.version = 0  # Incremented whenever the counts change, so that the map only re-renders the heatmap when necessary.
+        return
+
+    def add(self, grid_squares):
+        """ Add QSOs with the given grid squares to the counts.
+
+        :arg grid_squares: A sequence of Maidenhead grid square locators.
+        """
+        self.fields += self.maidenhead.histogram(grid_squares, level="field")
+        self.squares += self.maidenhead.histogram(grid_squares, level="square")
+        self.version += 1
+        return
+
+    def remove(self, grid_squares):
+        """ Remove QSOs with the given grid squares from the counts.
+
+        :arg grid_squares: A sequence of Maidenhead grid square locators.
+        """
+        self.fields -= self.maidenhead.histogram(grid_squares, level="field")
+        self.squares -= self.maidenhead.histogram(grid_squares, level="square")
+        numpy.clip(self.fields, 0, None, out=self.fields)
+        numpy.clip(self.squares, 0, None, out=self.squares)
+        self.version += 1
+        return
+
+    def count(self, logbook):
+        """ Get the counts for all the logs in a logbook, either from the cache or by counting the grid squares in the database.
+
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        if(not self.load(logbook.path)):
+            self.rebuild(logbook)
+        return
+
+    def rebuild(self, logbook):
+        """ Count the grid squares of all the QSOs in a logbook from scratch. Only the GRIDSQUARE column is retrieved from the database.
+
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        logging.debug("Counting the worked grid squares...")
+        self.fields[:] = 0
+        self.squares[:] = 0
+        self.logbook_path = logbook.path
+        for log in logbook.logs:
+            try:
+                c = log.connection.cursor()
+                c.execute("SELECT gridsquare FROM %s WHERE gridsquare IS NOT NULL AND gridsquare != ''" % log.name)
+                self.add([row[0] for row in c.fetchall()])
+            except sqlite.Error as e:
+                logging.error("Could not count the worked grid squares for log '%s' because of a database error." % log.name)
+                logging.exception(e)
+        self.version += 1
+        self.save()
+        return
+
+    def get_key(self, logbook_path):
+        """ Return the key which identifies the cached counts. The counts must be recomputed if the logbook file has been modified since they were cached.
+
+        :arg str logbook_path: The path of the logbook's database file.
+        :returns: The key, or None if the logbook file could not be found.
+        :rtype: numpy.array
+        """
+        try:
+            stat = os.stat(logbook_path)
+        except (OSError, TypeError):
+            return None
+        return numpy.array([os.path.realpath(logbook_path), str(stat.st_mtime_ns), str(stat.st_size)])
+
+    def load(self, logbook_path):
+        """ Load the cached counts for a logbook.
+
+        :arg str logbook_path: The path of the logbook's database file.
+        :returns: True if valid cached counts were found, and False otherwise.
+        :rtype: bool
+        """
+        key = self.get_key(logbook_path)
+        if(self.path is None or key is None or not os.path.exists(self.path)):
+            return False
+        try:
+            with numpy.load(self.path) as cache:
+                if(not numpy.array_equal(cache["key"], key) or cache["squares"].shape != self.squares.shape):
+                    logging.debug("The cached grid square counts are out-of-date.")
+                    return False
+                self.fields[:] = cache["fields"]
+                self.squares[:] = cache["squares"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.exception(e)
+            return False
+        self.logbook_path = logbook_path
+        self.version += 1
+        return True
+
+    def save(self):
+        """ Cache the counts on disk, along with the key identifying the current state of the logbook file. """
+        key = self.get_key(self.logbook_path)
+        if(self.path is None or key is None):
+            return
+        try:
+            # Write to a temporary file first, so that an interrupted write never leaves a corrupt cache behind.
+            with open(self.path + ".tmp", "wb") as f:
+                numpy.savez(f, key=key, fields=self.fields, squares=self.squares)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logging.error("Could not cache the worked grid squares.")
+            logging.exception(e)
+        return
+
 
 class WorldMap:
 
     """ A tool for visualising the world map. """
 
     def __init__(self, application):
-        """ Set up the drawing canvas and the timer which will re-plot the world map every 30 minutes.
+        """ Set up the world map. The drawing canvas and the timer which will re-plot the world map every 30 minutes are only set up when the world map is first drawn.
 
         :arg application: The PyQSO application containing the main Gtk window, etc.
         """
@@ -155,46 +479,110 @@ class WorldMap:
         self.application = application
         self.builder = self.application.builder
         self.points = []
-
-        if(have_necessary_modules):
-            self.fig = matplotlib.figure.Figure()
-            self.canvas = FigureCanvas(self.fig)  # For embedding in the Gtk application
-            self.builder.get_object("world_map").pack_start(self.canvas, True, True, 0)
-            toolbar = NavigationToolbar(self.canvas, self.application.window)
-            self.builder.get_object("world_map").pack_start(toolbar, False, False, 0)
-            self.refresh_event = GObject.timeout_add(1800000, self.draw)  # Re-draw the world map automatically after 30 minutes (if the world map tool is visible).
-
-        # Add the QTH coordinates for plotting, if available.
-        config = configparser.ConfigParser()
-        have_config = (config.read(expanduser('~/.config/pyqso/preferences.ini')) != [])
-        (section, option) = ("world_map", "show_qth")
-        if(have_config and config.has_option(section, option)):
-            if(config.getboolean(section, option)):
-                try:
-                    qth_name = config.get("world_map", "qth_name")
-                    qth_latitude = float(config.get("world_map", "qth_latitude"))
-                    qth_longitude = float(config.get("world_map", "qth_longitude"))
-                    self.add_point(qth_name, qth_latitude, qth_longitude, "ro")
-                except ValueError:
-                    logging.warning("Unable to get the QTH name, latitude and/or longitude. The QTH will not be pinpointed on the world map. Check preferences?")
+        self.point_label_limit = 250  # Only the names of the most recent points are shown, otherwise the map becomes unreadable.
+        self.label_paths = OrderedDict()  # An LRU cache of the labels' text paths, keyed by the label text, font size and placement.
+        self.label_path_limit = 1024  # Enough for the point labels and the grid square labels on a single map.
+        self.geocoder = Geocoder()
+        self.pending_lookups = {}  # The callsigns of the QSOs waiting on an online lookup, keyed by country.
+
+        self.fig = None
+        self.canvas = None
+        self.refresh_event = None
+
+        # The static parts of the map (land, ocean, coastlines, borders and gridlines) are only rendered when the size/DPI of the figure (or the view limits) change.
+        # The rendered basemap is cached as a background image, and everything else is blitted on top of it.
+        self.ax = None
+        self.background = None
+        self.background_key = None
+        self.overlays = []
+        self.grid_square_labels = None
 
         # Maidenhead grid squares.
         self.maidenhead = Maidenhead()
-        self.show_grid_squares = False
-        self.shade_worked_grid_squares = False
-        (section, option) = ("world_map", "show_grid_squares")
-        if(have_config and config.has_option(section, option)):
-            self.show_grid_squares = config.getboolean(section, option)
-            (section, option) = ("world_map", "shade_worked_grid_squares")
-            if(have_config and config.has_option(section, option)):
-                self.shade_worked_grid_squares = config.getboolean(section, option)
 
-        self.builder.get_object("world_map").show_all()
+        # Add the QTH coordinates for plotting (if available), and find out which grid square overlays to show.
+        self.qth = None
+        self.apply_preferences()
+        preferences.subscribe(self.on_preferences_changed)
+
+        # The number of QSOs with each grid square. This is counted when the world map is first drawn, and then kept up-to-date by the logbook.
+        self.heatmap = None
+        self.heatmap_image = None
+        self.heatmap_version = None
 
         logging.debug("World map ready!")
 
         return
 
+    def setup_canvas(self):
+        """ Import the modules needed to draw the world map, and set up the drawing canvas, the navigation toolbar, the re-draw timer and the grid square counts.
+
+        :returns: True if the canvas could be set up, and False otherwise.
+        :rtype: bool
+        """
+        if(self.canvas is not None):
+            return True
+        if(not import_modules()):
+            return False
+
+        logging.debug("Setting up the world map canvas...")
+        self.fig = matplotlib.figure.Figure()
+        self.canvas = FigureCanvas(self.fig)  # For embedding in the Gtk application
+        self.builder.get_object("world_map").pack_start(self.canvas, True, True, 0)
+        toolbar = NavigationToolbar(self.canvas, self.application.window)
+        self.builder.get_object("world_map").pack_start(toolbar, False, False, 0)
+        self.canvas.mpl_connect("draw_event", self.on_draw_event)
+        self.builder.get_object("world_map").show_all()
+        self.resume()
+
+        self.heatmap = GridSquareHeatmap(self.maidenhead)
+        if(self.application.logbook.connection is not None):
+            self.heatmap.count(self.application.logbook)
+        return True
+
+    def pause(self):
+        """ Stop re-drawing the world map automatically. This is done while the world map tool is not visible. """
+        if(self.refresh_event is not None):
+            GObject.source_remove(self.refresh_event)
+            self.refresh_event = None
+        return
+
+    def resume(self):
+        """ Re-draw the world map automatically every 30 minutes, provided that the drawing canvas has been set up. """
+        if(self.canvas is not None and self.refresh_event is None):
+            self.refresh_event = GObject.timeout_add(1800000, self.draw)
+        return
+
+    def apply_preferences(self):
+        """ Set up the QTH point and the grid square overlays according to the preferences. The map is not re-drawn. """
+        if(self.qth is not None and self.qth in self.points):
+            self.points.remove(self.qth)
+        self.qth = None
+        if(preferences.getboolean("world_map", "show_qth", fallback=False)):
+            try:
+                qth_name = preferences.get("world_map", "qth_name")
+                qth_latitude = float(preferences.get("world_map", "qth_latitude"))
+                qth_longitude = float(preferences.get("world_map", "qth_longitude"))
+                self.qth = Point(qth_name, qth_latitude, qth_longitude, "ro")
+                self.points.append(self.qth)
+            except (ValueError, TypeError):
+                logging.warning("Unable to get the QTH name, latitude and/or longitude. The QTH will not be pinpointed on the world map. Check preferences?")
+
+        self.show_grid_squares = preferences.getboolean("world_map", "show_grid_squares", fallback=False)
+        self.shade_worked_grid_squares = (self.show_grid_squares and preferences.getboolean("world_map", "shade_worked_grid_squares", fallback=False))
+        self.show_grid_square_heatmap = preferences.getboolean("world_map", "show_grid_square_heatmap", fallback=False)
+        return
+
+    def on_preferences_changed(self, changed):
+        """ Re-draw the map if any of the World Map preferences have changed.
+
+        :arg set changed: The (section, option) tuples of the preferences that have changed.
+        """
+        if(any(section == "world_map" for (section, option) in changed)):
+            self.apply_preferences()
+            self.draw()
+        return
+
     def add_point(self, name, latitude, longitude, style="yo"):
         """ Add a point and re-draw the map.
 
@@ -203,8 +591,15 @@ class WorldMap:
         :arg float longitude: The longitude of the point on the map.
         :arg str style: The style of the point when plotted. By default it is a filled yellow circle.
         """
-        p = Point(name, latitude, longitude, style)
-        self.points.append(p)
+        self.add_points([Point(name, latitude, longitude, style)])
+        return
+
+    def add_points(self, points):
+        """ Add many points at once and re-draw the map only once.
+
+        :arg list points: The Point objects to add.
+        """
+        self.points.extend(points)
         self.draw()
         return
 
@@ -213,34 +608,100 @@ class WorldMap:
 
         :arg r: The QSO record containing the location to pinpoint.
         """
+        self.pinpoint_records([r])
+        return
+
+    def pinpoint_records(self, records):
+        """ Pinpoint the locations of many QSOs on the world map, re-drawing the map only once. Any countries that are not known offline are looked up online in the background, and the corresponding QSOs are pinpointed once the lookup completes.
+
+        :arg records: The QSO records containing the locations to pinpoint.
+        """
+        points = []
+        for r in records:
+            coordinates = self.get_coordinates(r)
+            if(coordinates is not None):
+                points.append(Point(r["CALL"], coordinates[0], coordinates[1]))
+            elif(r["COUNTRY"]):
+                # Only look up each unknown country once, no matter how many QSOs are waiting on it.
+                country = r["COUNTRY"]
+                if(country in self.pending_lookups):
+                    self.pending_lookups[country].append(r["CALL"])
+                else:
+                    self.pending_lookups[country] = [r["CALL"]]
+                    self.geocoder.lookup_online(country, self.on_lookup_online, dispatch=GObject.idle_add)
+        if(points):
+            self.add_points(points)
+        return
+
+    def on_lookup_online(self, country, coordinates):
+        """ Pinpoint the QSOs that were waiting on the online lookup of a country's coordinates. This is called on the Gtk main loop.
+
+        :arg str country: The country that was looked up.
+        :arg tuple coordinates: The latitude-longitude coordinates of the country, or None if the lookup failed.
+        :returns: False, so that the callback is only called once.
+        :rtype: bool
+        """
+        callsigns = self.pending_lookups.pop(country, [])
+        if(coordinates is not None and callsigns):
+            self.add_points([Point(callsign, coordinates[0], coordinates[1]) for callsign in callsigns])
+        return False
+
+    def get_coordinates(self, r):
+        """ Get the latitude-longitude coordinates of a QSO without going online. Use any GRIDSQUARE information first since this is likely to be more accurate than the COUNTRY field, and fall back to the callsign's prefix if the COUNTRY is unknown.
+
+        :arg r: The QSO record containing the location.
+        :returns: The latitude-longitude coordinates, or None if they could not be determined.
+        :rtype: tuple
+        """
+
+        gridsquare = r["GRIDSQUARE"]
+        country = r["COUNTRY"]
+
+        if(gridsquare):
+            try:
+                latitude, longitude = self.maidenhead.gs2ll(gridsquare)
+                logging.debug("QTH coordinates found: (%s, %s)", str(latitude), str(longitude))
+                return (latitude, longitude)
+            except ValueError:
+                logging.exception("Unable to lookup QTH coordinates.")
+
+        if(country):
+            coordinates = self.geocoder.lookup(country)
+            if(coordinates is not None):
+                return coordinates
+            # The COUNTRY field will be looked up online instead.
+            return None
+
+        result = self.geocoder.lookup_callsign(r["CALL"])
+        if(result is not None):
+            return result[1]
+
+        return None
+
+    def count_grid_squares(self, logbook):
+        """ Count the worked grid squares in a logbook (using the cached counts if they are still valid) and re-draw the map. If the world map has not been drawn yet, the grid squares are counted when it is first drawn instead.
+
+        :arg logbook: The logbook containing logs which in turn contain QSOs.
+        """
+        if(self.heatmap is not None):
+            self.heatmap.count(logbook)
+            self.draw()
+        return
 
-        if(have_geocoder):
-            callsign = r["CALL"]
-            gridsquare = r["GRIDSQUARE"]
-            country = r["COUNTRY"]
-
-            # Get the latitude-longitude coordinates. Use any GRIDSQUARE information first since this is likely to be more accurate than the COUNTRY field.
-            if(gridsquare):
-                try:
-                    latitude, longitude = self.maidenhead.gs2ll(gridsquare)
-                    logging.debug("QTH coordinates found: (%s, %s)", str(latitude), str(longitude))
-                    self.add_point(callsign, latitude, longitude)
-                    return
-                except ValueError:
-                    logging.exception("Unable to lookup QTH coordinates.")
-
-            if(country):
-                try:
-                    g = geocoder.google(country)
-                    latitude, longitude = g.latlng
-                    logging.debug("QTH coordinates found: (%s, %s)", str(latitude), str(longitude))
-                    self.add_point(callsign, latitude, longitude)
-                    return
-                except ValueError:
-                    logging.exception("Unable to lookup QTH coordinates.")
-                except Exception:
-                    logging.exception("Unable to lookup QTH coordinates. Check connection to the internets? Lookup limit reached?")
+    def update_grid_squares(self, added=(), removed=()):
+        """ Update the worked grid square counts after QSOs have been added to, edited in, or deleted from the logbook, and re-draw the map if necessary.
 
+        :arg added: The grid squares of the QSOs that have been added.
+        :arg removed: The grid squares of the QSOs that have been removed.
+        """
+        if(self.heatmap is not None):
+            if(removed):
+                self.heatmap.remove(removed)
+            if(added):
+                self.heatmap.add(added)
+            self.heatmap.save()
+            if(self.shade_worked_grid_squares or self.show_grid_square_heatmap):
+                self.draw()
         return
 
     def get_worked_grid_squares(self, logbook):
@@ -251,111 +712,229 @@ class WorldMap:
         :rtype: numpy.array
         """
 
-        worked_grid_squares = numpy.zeros((len(self.maidenhead.upper), len(self.maidenhead.upper)), dtype=bool)
-
+        grid_squares = []
         for log in logbook.logs:
             try:
-                records = log.records
-                for r in records:
-                    if(r["GRIDSQUARE"]):
-                        grid_square = r["GRIDSQUARE"][0:2].upper()  # Only consider the field value (e.g. IO).
-                        worked_grid_squares[self.maidenhead.upper.index(grid_square[1]), self.maidenhead.upper.index(grid_square[0])] = True
-
+                grid_squares.extend([r["GRIDSQUARE"] for r in log.records])
             except sqlite.Error as e:
                 logging.error("Could not update the array of worked grid squares for log '%s' because of a database error." % log.name)
                 logging.exception(e)
 
+        # Only consider the field value (e.g. IO).
+        worked_grid_squares = (self.maidenhead.histogram(grid_squares, level="field") > 0)
+
         return worked_grid_squares
 
     def draw(self):
-        """ Draw the world map and the grey line on top of it.
+        """ Draw the world map and the grey line on top of it. The basemap is only re-rendered if no cached copy is available for the current figure size and DPI; otherwise the cached background is restored and only the overlays are re-drawn.
+
+        The drawing canvas is set up (and the modules needed to draw the map are imported) the first time the world map is drawn while it is visible.
 
         :returns: Always returns True to satisfy the GObject timer, unless the necessary WorldMap dependencies are not satisfied (in which case, the method returns False so as to not re-draw the canvas).
         :rtype: bool
         """
 
-        if(have_necessary_modules):
-            toolbox = self.builder.get_object("toolbox")
-            tools = self.builder.get_object("tools")
-            if(tools.get_current_page() != 1 or not toolbox.get_visible()):
-                # Don't re-draw if the world map is not visible.
-                return True  # We need to return True in case this is method was called by a timer event.
+        toolbox = self.builder.get_object("toolbox")
+        tools = self.builder.get_object("tools")
+        if(tools.get_current_page() != 1 or not toolbox.get_visible()):
+            # Don't re-draw if the world map is not visible.
+            return True  # We need to return True in case this is method was called by a timer event.
+        if(not self.setup_canvas()):
+            return False  # Don't try to re-draw the canvas if the necessary modules to do so could not be imported.
+
+        if(self.ax is None):
+            self.draw_basemap()
+        if(self.background is None or self.background_key != self.get_background_key()):
+            # Render everything from scratch. The background will be cached (and the overlays drawn) by the draw_event handler.
+            logging.debug("Drawing the world map...")
+            self.canvas.draw()
+        else:
+            logging.debug("Re-drawing the world map overlays using the cached basemap...")
+            self.canvas.restore_region(self.background)
+            self.draw_overlays()
+            self.canvas.blit(self.fig.bbox)
+        return True
+
+    def draw_basemap(self):
+        """ Set up the axes and add the static map features. These are rasterised once per figure size and cached by on_draw_event. """
+
+        logging.debug("Setting up the basemap...")
+        self.fig.clf()
+        self.ax = self.fig.add_subplot(111, projection=cartopy.crs.PlateCarree())
+        self.ax.set_extent([-180, 180, -90, 90])
+        self.ax.set_aspect("auto")
+
+        gl = self.ax.gridlines(draw_labels=True)
+        gl.xlabels_top = False
+        gl.ylabels_right = False
+        gl.xformatter = cartopy.mpl.gridliner.LONGITUDE_FORMATTER
+        gl.yformatter = cartopy.mpl.gridliner.LATITUDE_FORMATTER
+        self.ax.add_feature(cartopy.feature.LAND, facecolor="olivedrab")
+        self.ax.add_feature(cartopy.feature.OCEAN, facecolor="cornflowerblue")
+        self.ax.add_feature(cartopy.feature.COASTLINE)
+        self.ax.add_feature(cartopy.feature.BORDERS, alpha=0.4)
+
+        # Any existing overlays belonged to the old axes.
+        self.overlays = []
+        self.grid_square_labels = None
+        self.heatmap_image = None
+        self.background = None
+        self.background_key = None
+        return
+
+    def get_background_key(self):
+        """ Return the key which identifies the cached background image. The basemap must be re-rendered if the figure's size or DPI change, or if the user has zoomed/panned the map.
+
+        :returns: The figure's width and height (in pixels), its DPI, and the view limits of the axes.
+        :rtype: tuple
+        """
+        return (int(self.fig.bbox.width), int(self.fig.bbox.height), self.fig.dpi, tuple(self.ax.get_xlim()), tuple(self.ax.get_ylim()))
+
+    def on_draw_event(self, event):
+        """ Cache the freshly-rendered basemap as a background image, and then draw the overlays on top of it. This is called by matplotlib whenever the whole figure is drawn (e.g. after a resize or zoom). """
+        if(self.ax is None):
+            return
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.background_key = self.get_background_key()
+        self.draw_overlays()
+        return
+
+    def draw_overlays(self):
+        """ Draw the grey line, the Maidenhead grid squares and the points on top of the basemap. All these artists are animated, so they are never part of the cached background. """
+
+        for artist in self.overlays:
+            artist.remove()
+        self.overlays = []
+
+        # Draw the grey line. This is based on the code from the Cartopy Aurora Forecast example (http://scitools.org.uk/cartopy/docs/latest/gallery/aurora_forecast.html) and used under the Open Government Licence (http://scitools.org.uk/cartopy/docs/v0.15/copyright.html).
+        logging.debug("Drawing the grey line...")
+        dt = datetime.utcnow()
+        axial_tilt = 23.5
+        reference_solstice = datetime(2016, 6, 21, 22, 22)
+        days_per_year = 365.2425
+        seconds_per_day = 86400.0
+
+        days_since_reference = (dt - reference_solstice).total_seconds()/seconds_per_day
+        latitude = axial_tilt*numpy.cos(2*numpy.pi*days_since_reference/days_per_year)
+        seconds_since_midnight = (dt - datetime(dt.year, dt.month, dt.day)).seconds
+        longitude = -(seconds_since_midnight/seconds_per_day - 0.5)*360
+
+        pole_longitude = longitude
+        if latitude > 0:
+            pole_latitude = -90 + latitude
+            central_rotated_longitude = 180
+        else:
+            pole_latitude = 90 + latitude
+            central_rotated_longitude = 0
+
+        rotated_pole = cartopy.crs.RotatedPole(pole_latitude=pole_latitude, pole_longitude=pole_longitude, central_rotated_longitude=central_rotated_longitude)
+
+        x = numpy.empty(360)
+        y = numpy.empty(360)
+        x[:180] = -90
+        y[:180] = numpy.arange(-90, 90.)
+        x[180:] = 90
+        y[180:] = numpy.arange(90, -90., -1)
+
+        self.overlays.extend(self.ax.fill(x, y, transform=rotated_pole, color="black", alpha=0.5, animated=True))
+
+        # Plot points on the map. All the points are drawn with a single scatter plot, and their names with a single collection of text paths.
+        if(self.points):
+            logging.debug("Plotting QTHs on the map...")
+            longitudes = numpy.fromiter((p.longitude for p in self.points), dtype=float, count=len(self.points))
+            latitudes = numpy.fromiter((p.latitude for p in self.points), dtype=float, count=len(self.points))
+            colors, markers = zip(*[p.color_and_marker for p in self.points])
+            scatter = self.ax.scatter(longitudes, latitudes, c=list(colors), marker=markers[0], edgecolors="face", zorder=3, transform=cartopy.crs.PlateCarree(), animated=True)
+            if(len(set(markers)) > 1):
+                # A path collection can hold a different marker path for each point.
+                scatter.set_paths([MarkerStyle(m).get_path().transformed(MarkerStyle(m).get_transform()) for m in markers])
+            self.overlays.append(scatter)
+
+            n = min(len(self.points), self.point_label_limit)
+            if(n > 0):
+                names = [p.name for p in self.points[-n:]]
+                self.overlays.append(self.get_label_collection(names, longitudes[-n:], latitudes[-n:], size=7, offset=(0, 2.5), facecolors="white", zorder=4, animated=True))
+
+        # Draw Maidenhead grid squares and shade in the worked squares.
+        x = numpy.linspace(-180, 180, len(list(self.maidenhead.upper))+1)
+        y = numpy.linspace(-90, 90, len(list(self.maidenhead.upper))+1)
+        if(self.show_grid_squares):
+            if(self.shade_worked_grid_squares):
+                worked_grid_squares = (self.heatmap.fields > 0)
+                masked = numpy.ma.masked_array(worked_grid_squares, worked_grid_squares == 0)
             else:
-                # Set up the world map.
-                logging.debug("Drawing the world map...")
-                self.fig.clf()
-                ax = self.fig.add_subplot(111, projection=cartopy.crs.PlateCarree())
-                ax.set_extent([-180, 180, -90, 90])
-                ax.set_aspect("auto")
-
-                gl = ax.gridlines(draw_labels=True)
-                gl.xlabels_top = False
-                gl.ylabels_right = False
-                gl.xformatter = cartopy.mpl.gridliner.LONGITUDE_FORMATTER
-                gl.yformatter = cartopy.mpl.gridliner.LATITUDE_FORMATTER
-                ax.add_feature(cartopy.feature.LAND, facecolor="olivedrab")
-                ax.add_feature(cartopy.feature.OCEAN, facecolor="cornflowerblue")
-                ax.add_feature(cartopy.feature.COASTLINE)
-                ax.add_feature(cartopy.feature.BORDERS, alpha=0.4)
-
-                # Draw the grey line. This is based on the code from the Cartopy Aurora Forecast example (http://scitools.org.uk/cartopy/docs/latest/gallery/aurora_forecast.html) and used under the Open Government Licence (http://scitools.org.uk/cartopy/docs/v0.15/copyright.html).
-                logging.debug("Drawing the grey line...")
-                dt = datetime.utcnow()
-                axial_tilt = 23.5
-                reference_solstice = datetime(2016, 6, 21, 22, 22)
-                days_per_year = 365.2425
-                seconds_per_day = 86400.0
-
-                days_since_reference = (dt - reference_solstice).total_seconds()/seconds_per_day
-                latitude = axial_tilt*numpy.cos(2*numpy.pi*days_since_reference/days_per_year)
-                seconds_since_midnight = (dt - datetime(dt.year, dt.month, dt.day)).seconds
-                longitude = -(seconds_since_midnight/seconds_per_day - 0.5)*360
-
-                pole_longitude = longitude
-                if latitude > 0:
-                    pole_latitude = -90 + latitude
-                    central_rotated_longitude = 180
+                z = numpy.zeros((len(self.maidenhead.upper), len(self.maidenhead.upper)), dtype=bool)
+                masked = numpy.ma.masked_array(z, z == 0)
+            self.overlays.append(self.ax.pcolormesh(x, y, masked, transform=cartopy.crs.PlateCarree(), cmap="Reds", vmin=0, vmax=1, edgecolors="k", linewidth=1.5, alpha=0.4, animated=True))
+
+            # Grid square labels. These never change, so they are only created once (as a single collection of text paths).
+            if(self.grid_square_labels is None):
+                labels = [self.maidenhead.upper[i]+self.maidenhead.upper[j] for i in range(len(self.maidenhead.upper)) for j in range(len(self.maidenhead.upper))]
+                centres_x = numpy.repeat((x[:-1]+x[1:])/2.0, len(self.maidenhead.upper))
+                centres_y = numpy.tile((y[:-1]+y[1:])/2.0, len(self.maidenhead.upper))
+                self.grid_square_labels = self.get_label_collection(labels, centres_x, centres_y, size=8, centred=True, facecolors="w", alpha=0.4, animated=True)
+
+        # Draw the heatmap of worked grid squares (at the 4-character square level) as a single image.
+        # The image is only updated when the counts have changed since it was last drawn.
+        if(self.show_grid_square_heatmap):
+            if(self.heatmap_image is None or self.heatmap_version != self.heatmap.version):
+                squares = numpy.ma.masked_array(self.heatmap.squares, self.heatmap.squares == 0)
+                norm = matplotlib.colors.LogNorm(vmin=1, vmax=max(2, self.heatmap.squares.max()))
+                if(self.heatmap_image is None):
+                    self.heatmap_image = self.ax.imshow(squares, origin="lower", extent=[-180, 180, -90, 90], transform=cartopy.crs.PlateCarree(), cmap="YlOrRd", norm=norm,
+                                                        interpolation="nearest", alpha=0.7, zorder=2, animated=True)
                 else:
-                    pole_latitude = 90 + latitude
-                    central_rotated_longitude = 0
-
-                rotated_pole = cartopy.crs.RotatedPole(pole_latitude=pole_latitude, pole_longitude=pole_longitude, central_rotated_longitude=central_rotated_longitude)
-
-                x = numpy.empty(360)
-                y = numpy.empty(360)
-                x[:180] = -90
-                y[:180] = numpy.arange(-90, 90.)
-                x[180:] = 90
-                y[180:] = numpy.arange(90, -90., -1)
-
-                ax.fill(x, y, transform=rotated_pole, color="black", alpha=0.5)
-
-                # Plot points on the map.
-                if(self.points):
-                    logging.debug("Plotting QTHs on the map...")
-                    for p in self.points:
-                        ax.plot(p.longitude, p.latitude, p.style, transform=cartopy.crs.PlateCarree())
-                        projected_x, projected_y = ax.projection.transform_point(p.longitude, p.latitude, src_crs=cartopy.crs.PlateCarree())
-                        ax.annotate(p.name, xy=(projected_x, projected_y), xytext=(0, 2.5), textcoords="offset points", color="white", size="small", weight="bold")
-
-                # Draw Maidenhead grid squares and shade in the worked squares.
-                x = numpy.linspace(-180, 180, len(list(self.maidenhead.upper))+1)
-                y = numpy.linspace(-90, 90, len(list(self.maidenhead.upper))+1)
-                if(self.show_grid_squares):
-                    if(self.shade_worked_grid_squares):
-                        worked_grid_squares = self.get_worked_grid_squares(self.application.logbook)
-                        masked = numpy.ma.masked_array(worked_grid_squares, worked_grid_squares == 0)
-                    else:
-                        z = numpy.zeros((len(self.maidenhead.upper), len(self.maidenhead.upper)), dtype=bool)
-                        masked = numpy.ma.masked_array(z, z == 0)
-                    ax.pcolormesh(x, y, masked, transform=cartopy.crs.PlateCarree(), cmap="Reds", vmin=0, vmax=1, edgecolors="k", linewidth=1.5, alpha=0.4)
-
-                    # Grid square labels.
-                    for i in range(len(self.maidenhead.upper)):
-                        for j in range(len(self.maidenhead.upper)):
-                            text = self.maidenhead.upper[i]+self.maidenhead.upper[j]
-                            ax.text((x[i]+x[i+1])/2.0, (y[j]+y[j+1])/2.0, text, ha="center", va="center", size="small", color="w", family="monospace", alpha=0.4)
-
-                return True
+                    self.heatmap_image.set_data(squares)
+                    self.heatmap_image.set_norm(norm)
+                self.heatmap_version = self.heatmap.version
+            self.ax.draw_artist(self.heatmap_image)
+
+        for artist in self.overlays:
+            self.ax.draw_artist(artist)
+        if(self.show_grid_squares):
+            self.ax.draw_artist(self.grid_square_labels)
+
+        return
+
+    def get_label_collection(self, labels, longitudes, latitudes, size=8, offset=(0, 0), centred=False, **kwargs):
+        """ Create a single collection of text paths, rather than a separate Text artist for each label.
+
+        :arg list labels: The label strings.
+        :arg longitudes: The longitudes at which the labels are placed.
+        :arg latitudes: The latitudes at which the labels are placed.
+        :arg float size: The font size in points.
+        :arg tuple offset: The offset of each label (in points) from its coordinates. This is only used if the labels are not centred.
+        :arg bool centred: If True, centre the labels on their coordinates. Otherwise the coordinates mark the bottom-left corner of the labels.
+        :returns: The collection of labels, which has already been added to the axes.
+        :rtype: matplotlib.collections.PathCollection
+        """
+        font = FontProperties(family="monospace", weight="bold")
+        paths = []
+        for label in labels:
+            key = (label, size, centred, offset)
+            path = self.label_paths.get(key)
+            if(path is not None):
+                self.label_paths.move_to_end(key)
+            else:
+                path = TextPath((0, 0), label, size=size, prop=font)
+                if(centred):
+                    extents = path.get_extents()
+                    shift = (-(extents.x0+extents.x1)/2.0, -(extents.y0+extents.y1)/2.0)
+                else:
+                    shift = offset
+                path = path.transformed(matplotlib.transforms.Affine2D().translate(*shift))
+                self.label_paths[key] = path
+                while(len(self.label_paths) > self.label_path_limit):
+                    self.label_paths.popitem(last=False)
+            paths.append(path)
+
+        # The paths are measured in points, so scale them to pixels. The offsets are measured in degrees.
+        offsets = numpy.column_stack([longitudes, latitudes])
+        # matplotlib 3.6 renamed the transOffset keyword argument to offset_transform.
+        if(hasattr(PathCollection, "set_offset_transform")):
+            kwargs["offset_transform"] = self.ax.transData
         else:
-            return False  # Don't try to re-draw the canvas if the necessary modules to do so could not be imported.
+            kwargs["transOffset"] = self.ax.transData
+        collection = PathCollection(paths, offsets=offsets, transform=matplotlib.transforms.Affine2D().scale(self.fig.dpi/72.0), linewidths=0, **kwargs)
+        self.ax.add_collection(collection, autolim=False)
+        return collection
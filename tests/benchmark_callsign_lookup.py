@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Compare the cost of extracting the fields from a callsign lookup response with the old minidom-based parser and the single-pass ElementTree parser, using the recorded responses in tests/res.
+Run with: python3 tests/benchmark_callsign_lookup.py """
+
+import os
+import timeit
+from xml.dom import minidom
+
+from pyqso.callsign_lookup import CallsignLookupQRZ, CallsignLookupHamQTH, LOOKUP_FIELD_NAMES
+
+
+def parse_minidom(handler, data):
+    """ Extract the fields in the same way as the old parser: build a DOM, and then search it once per element. """
+    fields_and_data = dict.fromkeys(LOOKUP_FIELD_NAMES, "")
+    record_node = minidom.parseString(data).getElementsByTagName(handler.record_tag)[0]
+    for (tag, field_name) in handler.field_map:
+        node = record_node.getElementsByTagName(tag)
+        if(node):
+            if(fields_and_data[field_name]):
+                fields_and_data[field_name] += handler.separators.get(field_name, " ") + node[0].firstChild.nodeValue
+            else:
+                fields_and_data[field_name] = node[0].firstChild.nodeValue
+    return fields_and_data
+
+
+def parse_elementtree(handler, data):
+    """ Extract the fields with the handler's single-pass parser. """
+    return handler.get_fields(handler.parse(data)["record"])
+
+
+if(__name__ == "__main__"):
+    number = 2000
+    for (handler, name) in [(CallsignLookupQRZ(parent=None), "qrz_lookup.xml"), (CallsignLookupHamQTH(parent=None), "hamqth_lookup.xml")]:
+        with open(os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", name), "rb") as f:
+            data = f.read()
+        assert(parse_minidom(handler, data) == parse_elementtree(handler, data))
+        for parser in [parse_minidom, parse_elementtree]:
+            seconds = min(timeit.repeat(lambda: parser(handler, data), number=number, repeat=5))
+            print("%s, %s: %.1f microseconds per lookup" % (name, parser.__name__, 1e6*seconds/number))
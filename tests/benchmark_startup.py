@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Measure the time taken to import the PyQSO modules needed at start-up, using Python's -X importtime option, and check that none of the slow, non-standard modules used by the World Map and the annual statistics are imported until they are needed.
+Run with: python3 tests/benchmark_startup.py [target in milliseconds] """
+
+import os
+import re
+import subprocess
+import sys
+
+# The modules imported by bin/pyqso.
+MODULES = ["pyqso.adif", "pyqso.logbook", "pyqso.menu", "pyqso.popup", "pyqso.toolbar", "pyqso.toolbox", "pyqso.preferences_dialog", "pyqso.callsign_lookup"]
+
+# The modules which should only be imported on first use.
+DEFERRED = ["numpy", "matplotlib", "cartopy", "geocoder"]
+
+# The maximum acceptable cumulative import time, in milliseconds.
+TARGET = 500
+
+
+def get_import_times():
+    """ Import the start-up modules in a fresh interpreter.
+
+    :returns: The total import time (in microseconds), and the cumulative import time of each module that was imported.
+    :rtype: tuple
+    """
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % ", ".join(MODULES)], stderr=subprocess.PIPE, env=environment, universal_newlines=True, check=True)
+    total = 0
+    times = {}
+    for line in process.stderr.splitlines():
+        # Each line has the form "import time: self [us] | cumulative | imported package", where the package name is indented according to how deeply it is nested.
+        m = re.match(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)", line)
+        if(m):
+            times[m.group(4)] = int(m.group(2))
+            if(len(m.group(3)) == 1):
+                total += int(m.group(2))  # Only count the top-level imports, since their cumulative times include everything they import.
+    return (total, times)
+
+
+if(__name__ == "__main__"):
+    target = (float(sys.argv[1]) if len(sys.argv) > 1 else TARGET)
+    (total, times) = get_import_times()
+    print("Import time of the start-up modules: %.1f milliseconds (target: %.1f milliseconds)" % (total/1000.0, target))
+    for (module, t) in sorted(times.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print("    %s: %.1f milliseconds" % (module, t/1000.0))
+    imported = [module for module in DEFERRED if module in times]
+    assert(not imported), "These modules should not be imported at start-up: %s" % ", ".join(imported)
+    assert(total/1000.0 <= target), "The start-up modules took too long to import."
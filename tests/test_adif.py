@@ -41,6 +41,14 @@ class TestADIF(unittest.TestCase):
         assert(len(list(records[0].keys())) == len(list(expected_records[0].keys())))
         assert(records == expected_records)
 
+    def test_check_bands(self):
+        """ Check that a missing BAND field is filled in using the FREQ field, and that an existing BAND field is left as it is. """
+        records = [{"CALL": "TEST1", "FREQ": "14.205"}, {"CALL": "TEST2", "FREQ": "7.050", "BAND": "20m"}, {"CALL": "TEST3", "FREQ": "9001"}, {"CALL": "TEST4"}]
+        self.adif.check_bands(records)
+        assert(records[0]["BAND"] == "20m")
+        assert(records[1]["BAND"] == "20m")
+        assert("BAND" not in records[2] and "BAND" not in records[3])
+
     def test_read_multiple(self):
         """ Check that multiple ADIF records can be read and parsed correctly. """
         path = os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", "ADIF.test_read_multiple.adi")
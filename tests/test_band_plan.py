@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import tempfile
+from pyqso.band_plan import *
+
+
+class TestBandPlan(unittest.TestCase):
+
+    """ The unit tests for the BandPlan class. """
+
+    def test_band_for_frequency(self):
+        """ Check that the band of a frequency is found correctly, including at the edges of the bands. """
+        assert(ADIF_BAND_PLAN.band_for_frequency(145.525) == "2m")
+        assert(ADIF_BAND_PLAN.band_for_frequency(14.0) == "20m")
+        assert(ADIF_BAND_PLAN.band_for_frequency(14.35) == "20m")
+        assert(ADIF_BAND_PLAN.band_for_frequency(14.351) == "")
+        assert(ADIF_BAND_PLAN.band_for_frequency(0.1) == "")
+        assert(ADIF_BAND_PLAN.band_for_frequency(9001) == "")
+        assert(ADIF_BAND_PLAN.band_for_frequency(250000.0) == "1mm")
+
+    def test_bands_for_frequencies(self):
+        """ Check that the vectorised search agrees with the binary search, and copes with invalid frequencies. """
+        frequencies = ["145.525", 7.1, "14.351", "", None, "abc", 0.1, 250000.0]
+        assert(ADIF_BAND_PLAN.bands_for_frequencies(frequencies) == ["2m", "40m", "", "", "", "", "", "1mm"])
+        assert(ADIF_BAND_PLAN.bands_for_frequencies([]) == [])
+
+    def test_load_band_plan(self):
+        """ Check that a region-specific band plan can be loaded from a file, and that invalid band plans are rejected. """
+        (fd, path) = tempfile.mkstemp(suffix=".csv")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("band,lower,upper\n40m,7.0,7.2\n20M,14.0,14.35\n")
+            band_plan = load_band_plan(path)
+            assert(band_plan.band_for_frequency(7.25) == "")
+            assert(band_plan.band_for_frequency(14.2) == "20m")
+
+            with open(path, "w") as f:
+                f.write("band,lower,upper\n40m,7.0,7.2\n41m,7.1,7.3\n")
+            self.assertRaises(ValueError, load_band_plan, path)
+        finally:
+            os.remove(path)
+        self.assertRaises(ValueError, BandPlan, [("40m", 7.0, 7.3), ("30m", 7.2, 10.15)])
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -18,7 +18,16 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+import os
+import tempfile
+import sqlite3 as sqlite
 from pyqso.cabrillo import *
+from pyqso.adif import AVAILABLE_FIELD_NAMES_ORDERED
+from pyqso.log import Log
 
 
 class TestCabrillo(unittest.TestCase):
@@ -57,5 +66,97 @@ END-OF-LOG:"""
         print("Actual Cabrillo file contents: ", actual)
         assert(expected == actual)
 
+    def test_write_iterable(self):
+        """ Check that QSOs can be streamed from any iterable (rather than a list), and that missing frequencies and unknown modes are handled. """
+        records = ({'TIME_ON': '1955', 'CALL': 'TEST%d' % i, 'FREQ': None if i == 1 else "7.050", 'MODE': 'AM' if i == 2 else 'CW', 'QSO_DATE': '20130322', 'RST_SENT': '599', 'RST_RCVD': '599'} for i in range(3))
+        path = "Cabrillo.test_write_iterable.log"
+        count = self.cabrillo.write(records, path, contest="MYCONTEST", mycall="MYCALL")
+        assert(count == 3)
+
+        with open(path, "r") as f:
+            lines = f.read().split("\n")
+        os.remove(path)
+        assert(lines[4:] == ["QSO: 7050.0 CW 2013-03-22 1955 MYCALL 599 TEST0 599 0", "QSO:  CW 2013-03-22 1955 MYCALL 599 TEST1 599 0", "QSO: 7050.0 RY 2013-03-22 1955 MYCALL 599 TEST2 599 0", "END-OF-LOG:"])
+
+    def test_read(self):
+        """ Check that a Cabrillo file written by PyQSO can be read back in, along with its header. """
+        records = [{'TIME_ON': '1955', 'CALL': 'TEST', 'FREQ': "145.550", 'MODE': 'FM', 'QSO_DATE': '20130322', 'RST_SENT': '59 001', 'RST_RCVD': '59 002'},
+                   {'TIME_ON': '0820', 'CALL': 'TEST2ABC', 'FREQ': "14.2", 'MODE': 'SSB', 'QSO_DATE': '20150227', 'RST_SENT': '55 020', 'RST_RCVD': '57 003'}]
+        path = "Cabrillo.test_read.log"
+        self.cabrillo.write(records, path, contest="MYCONTEST", mycall="MYCALL")
+
+        header = {}
+        actual = self.cabrillo.read(path, header)
+        os.remove(path)
+        assert(header == {"START-OF-LOG": "3.0", "CREATED-BY": "PyQSO v1.1.0", "CALLSIGN": "MYCALL", "CONTEST": "MYCONTEST"})
+        assert(actual[0] == {"FREQ": "145.55", "BAND": "2m", "MODE": "FM", "QSO_DATE": "20130322", "TIME_ON": "1955", "STATION_CALLSIGN": "MYCALL", "RST_SENT": "59 001", "CALL": "TEST", "RST_RCVD": "59 002"})
+        assert((actual[1]["FREQ"], actual[1]["BAND"], actual[1]["MODE"]) == ("14.2", "20m", "SSB"))
+
+    def test_parse_qso(self):
+        """ Check that QSO lines with band designators, transmitter IDs and longer exchanges are parsed, and that invalid lines are rejected. """
+        record = self.cabrillo.parse_qso(" 144 RY 2017-11-25 00:10 g0abc 59 io91 k1abc 59 fn31 1")
+        assert((record["BAND"], record["MODE"], record["TIME_ON"], record["CALL"], record["RST_RCVD"]) == ("2m", "RTTY", "0010", "K1ABC", "59 fn31"))
+        assert("FREQ" not in record)
+        record = self.cabrillo.parse_qso("7002 CW 2017-11-04 2101 K1ABC 123 A 72 CT W6ABC 45 B 80 SCV")
+        assert((record["FREQ"], record["BAND"], record["RST_SENT"], record["RST_RCVD"]) == ("7.002", "40m", "123 A 72 CT", "45 B 80 SCV"))
+        self.assertRaises(ValueError, self.cabrillo.parse_qso, "7002 CW 2017-11-04 2101 K1ABC")
+        self.assertRaises(ValueError, self.cabrillo.parse_qso, "7002 CW 04/11/2017 2101 K1ABC 599 W6ABC 599")
+        self.assertRaises(ValueError, self.cabrillo.parse_qso, "40m CW 2017-11-04 2101 K1ABC 599 W6ABC 599")
+
+    def test_import_log(self):
+        """ Check that the QSOs in a Cabrillo file are added to a log in batches. """
+        path = "Cabrillo.test_import_log.log"
+        with open(path, "w") as f:
+            f.write("START-OF-LOG: 3.0\n")
+            for i in range(5):
+                f.write("QSO: 14025 CW 2017-11-25 %04d G0ABC 599 14 K%dABC 599 5\n" % (i, i))
+            f.write("QSO: 14025 CW\nEND-OF-LOG:\n")
+        log = mock.MagicMock()
+        try:
+            assert(self.cabrillo.import_log(path, log, batch_size=2) == 5)
+        finally:
+            os.remove(path)
+        assert([len(call[0][0]) for call in log.add_record.call_args_list] == [2, 2, 1])
+
+    def test_import_log_into_log(self):
+        """ Check which fields of the QSOs in a Cabrillo file are kept when they are imported into a real log. """
+        connection = sqlite.connect(":memory:")
+        connection.row_factory = sqlite.Row
+        connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, %s)" % ", ".join(["%s TEXT" % f.lower() for f in AVAILABLE_FIELD_NAMES_ORDERED]))
+        log = Log(connection, "test")
+        path = "Cabrillo.test_import_log_into_log.log"
+        with open(path, "w") as f:
+            f.write("START-OF-LOG: 3.0\nCALLSIGN: G0ABC\nQSO: 14025 CW 2017-11-25 0010 G0ABC 599 14 K1ABC 599 5\nQSO: 144 PH 2017-11-25 0020 G0ABC 59 IO91 G4ABC 59 IO80\nEND-OF-LOG:\n")
+        try:
+            assert(self.cabrillo.import_log(path, log, batch_size=1) == 2)
+        finally:
+            os.remove(path)
+
+        records = log.records
+        connection.close()
+        expected = [("K1ABC", "20171125", "0010", "14.025", "20m", "CW", "599 14", "599 5"), ("G4ABC", "20171125", "0020", "", "2m", "SSB", "59 IO91", "59 IO80")]
+        assert([(r["CALL"], r["QSO_DATE"], r["TIME_ON"], r["FREQ"], r["BAND"], r["MODE"], r["RST_SENT"], r["RST_RCVD"]) for r in records] == expected)
+        assert("STATION_CALLSIGN" not in [k.upper() for k in records[0].keys()])  # The log has no column for the callsign sent.
+
+    def test_read_files(self):
+        """ Check that many Cabrillo files can be read concurrently, and that files which cannot be read are reported. """
+        directory = tempfile.mkdtemp()
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(directory, "%d.log" % i))
+            with open(paths[-1], "w") as f:
+                f.write("START-OF-LOG: 3.0\nCALLSIGN: G%dABC\nQSO: 14025 CW 2017-11-25 0000 G%dABC 599 14 K1ABC 599 5\nEND-OF-LOG:\n" % (i, i))
+        paths.append(os.path.join(directory, "missing.log"))
+        try:
+            results = list(read_files(paths, workers=2))
+        finally:
+            for path in paths[:-1]:
+                os.remove(path)
+            os.rmdir(directory)
+        assert([r[0] for r in results] == paths)
+        assert([r[1]["CALLSIGN"] for r in results[:3]] == ["G0ABC", "G1ABC", "G2ABC"])
+        assert(all(len(r[2]) == 1 for r in results[:3]))
+        assert(results[3] == (paths[3], None, None))
+
 if(__name__ == '__main__'):
     unittest.main()
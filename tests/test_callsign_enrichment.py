@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import threading
+import time
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from pyqso.log import *
+from pyqso.callsign_lookup import CallsignLookupClient, CallsignLookupCache
+from pyqso.callsign_enrichment import *
+
+# The callsigns known to the stand-in qrz.com server, and their countries.
+COUNTRIES = {"MYCALL": "United Kingdom", "OTHERCALL": "France"}
+
+
+class QRZRequestHandler(BaseHTTPRequestHandler):
+
+    """ A stand-in for the qrz.com XML server. """
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if("username=" in self.path):
+            body = "<Session><Key>testkey</Key></Session>"
+        else:
+            callsign = self.path.split("callsign=")[1]
+            if(callsign in COUNTRIES):
+                body = "<Callsign><call>%s</call><country>%s</country><cqzone>14</cqzone></Callsign>" % (callsign, COUNTRIES[callsign])
+            else:
+                body = "<Session><Key>testkey</Key><Error>Not found: %s</Error></Session>" % callsign
+        body = ('<?xml version="1.0" ?>\n<QRZDatabase version="1.33" xmlns="http://xmldata.qrz.com">%s</QRZDatabase>' % body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        return
+
+
+class TestCallsignEnrichment(unittest.TestCase):
+
+    """ The unit tests for the CallsignEnrichment class. """
+
+    def setUp(self):
+        """ Start the stand-in server, and create a log with some records whose callsign-related fields are missing. """
+        self.server = HTTPServer(("localhost", 0), QRZRequestHandler)
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.connection = sqlite.connect(":memory:")
+        self.connection.row_factory = sqlite.Row
+        self.connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, call TEXT, name TEXT, address TEXT, state TEXT, country TEXT, dxcc TEXT, cqz TEXT, ituz TEXT, iota TEXT)")
+        self.connection.executemany("INSERT INTO test (call, country, cqz) VALUES (?, ?, ?)", [("MYCALL", "", ""), ("MYCALL", "", ""), ("F/OTHERCALL", "Monaco", ""), ("UNKNOWN", "", "")])
+        self.log = Log(self.connection, "test")
+
+        self.client = CallsignLookupClient(cache=CallsignLookupCache(path=None))
+        self.client.get_handler("qrz.com").host = "localhost:%d" % self.server.server_address[1]
+
+    def tearDown(self):
+        """ Stop the stand-in server and destroy the connection to the temporary database. """
+        self.server.shutdown()
+        self.server.server_close()
+        self.connection.close()
+
+    def test_run(self):
+        """ Check that each distinct callsign is looked up once, that only the empty fields are filled in, and that a second run is answered by the cache. """
+        job = CallsignEnrichment(self.log, self.client, "qrz.com", "hello", "world", rate=None, batch_size=1)
+        assert(job.get_callsigns() == ["F/OTHERCALL", "MYCALL", "UNKNOWN"])
+        (looked_up, filled) = job.run()
+        assert(looked_up == 3)
+        assert(filled == 5)  # COUNTRY and CQZ for both MYCALL records, and CQZ (but not COUNTRY) for F/OTHERCALL.
+        assert(len(job.errors) == 1)  # UNKNOWN could not be found.
+
+        records = self.log.records
+        assert([r["country"] for r in records] == ["United Kingdom", "United Kingdom", "Monaco", ""])
+        assert([r["cqz"] for r in records] == ["14", "14", "14", ""])
+        assert(len([p for p in self.server.paths if "username=" in p]) == 1)
+        assert(len([p for p in self.server.paths if "callsign=" in p]) == 3)
+
+        # Resuming the job does not send any more requests.
+        (looked_up, filled) = CallsignEnrichment(self.log, self.client, "qrz.com", "hello", "world", rate=None).run()
+        assert(filled == 0)
+        assert(len(self.server.paths) == 4)
+
+    def test_cancel(self):
+        """ Check that a cancelled job stops looking up callsigns. """
+        job = CallsignEnrichment(self.log, self.client, "qrz.com", "hello", "world", rate=None, workers=1)
+        (looked_up, filled) = job.run(progress=lambda done, total: job.cancel())
+        assert(job.cancelled)
+        assert(looked_up < 3)
+
+    def test_login_in_background(self):
+        """ Check that logging in is done by a worker thread, and that the progress function is called while waiting for it. """
+        job = CallsignEnrichment(self.log, self.client, "qrz.com", "hello", "world", rate=None)
+        release = threading.Event()
+        threads = []
+
+        def login():
+            threads.append(threading.current_thread())
+            release.wait(5)
+            return False
+
+        def progress(done, total):
+            release.set()
+
+        job.login = login
+        (looked_up, filled) = job.run(progress=progress)
+        assert(threads and threads[0] is not threading.current_thread())
+        assert(release.is_set())
+        assert(looked_up == 0 and filled == 0)
+        assert(not any("callsign=" in p for p in self.server.paths))
+
+    def test_rate_limiter(self):
+        """ Check that the rate limiter spaces out the requests. """
+        limiter = RateLimiter(rate=100)
+        start = time.monotonic()
+        for i in range(5):
+            limiter.wait()
+        assert(time.monotonic() - start >= 0.04)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -18,6 +18,9 @@
 #    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import os
+import threading
+import time
 try:
     import unittest.mock as mock
 except ImportError:
@@ -137,5 +140,182 @@ class TestCallsignLookup(unittest.TestCase):
         assert(fields_and_data["ITUZ"] == "ITU")
         assert(fields_and_data["IOTA"] == "IOTA")
 
+    def test_lookup_recorded_responses(self):
+        """ Check that every field is extracted from complete qrz.com and hamqth.com responses, and that the other elements are ignored. """
+
+        for (handler, name, expected) in [(self.qrz, "qrz_lookup.xml", {"NAME": "FIRSTNAME LASTNAME", "ADDRESS": "1 ADDRESS LINE, TOWN", "STATE": "STATE", "COUNTRY": "England", "DXCC": "223", "CQZ": "14", "ITUZ": "27", "IOTA": "EU-005"}),
+                                          (self.hamqth, "hamqth_lookup.xml", {"NAME": "NAME", "ADDRESS": "1 ADDRESS LINE, TOWN", "STATE": "STATE", "COUNTRY": "England", "DXCC": "", "CQZ": "14", "ITUZ": "27", "IOTA": "EU-005"})]:
+            with open(os.path.join(os.path.realpath(os.path.dirname(__file__)), "res", name), "rb") as f:
+                data = f.read()
+            handler.session_key = "key"
+            with mock.patch.object(handler, "request", return_value=data):
+                assert(handler.lookup("MYCALL") == expected)
+
+    def test_cache(self):
+        """ Check that looked-up callsigns (including those that could not be found) are answered from the cache until they expire. """
+
+        cache = CallsignLookupCache(path=None, ttl=100, negative_ttl=10, maximum_size=2)
+        cache.store("qrz.com", "MYCALL", {"NAME": "NAME", "COUNTRY": "COUNTRY"}, now=0)
+        cache.store("qrz.com", "NOCALL", None, now=0)
+        assert(cache.get("qrz.com", " mycall ", now=50)["NAME"] == "NAME")
+        assert(cache.get("qrz.com", "MYCALL", now=50)["IOTA"] == "")
+        assert(cache.get("hamqth.com", "MYCALL", now=50) is None)
+        assert(cache.get("qrz.com", "MYCALL", now=150) is None)
+        assert(cache.get("qrz.com", "NOCALL", now=5) == dict.fromkeys(LOOKUP_FIELD_NAMES, ""))
+        assert(cache.get("qrz.com", "NOCALL", now=50) is None)
+        cache.store("qrz.com", "OTHERCALL", {"NAME": "OTHER"}, now=0)
+        assert(list(cache.lru.keys()) == [("qrz.com", "NOCALL"), ("qrz.com", "OTHERCALL")])  # MYCALL was the least recently used.
+
+    def test_cache_persistent(self):
+        """ Check that the cache persists between sessions, and that a cache hit skips the network entirely. """
+
+        path = "callsign_lookup.db"
+        if(os.path.exists(path)):
+            os.remove(path)
+        CallsignLookupCache(path=path).store("hamqth.com", "MYCALL", {"NAME": "NAME"})
+
+        self.hamqth.cache = CallsignLookupCache(path=path)
+        self.hamqth.connection = mock.MagicMock()
+        self.hamqth.session_id = "09b0ae90050be03c452ad235a1f2915ad684393c"
+        fields_and_data = self.hamqth.lookup("F/MYCALL/P")
+        assert(fields_and_data["NAME"] == "NAME")
+        assert(not self.hamqth.connection.request.called)
+        os.remove(path)
+
+    def test_cache_not_found(self):
+        """ Check that a callsign that could not be found is cached, but that other errors (such as an expired session) are not. """
+
+        self.qrz.cache = CallsignLookupCache(path=None)
+        self.qrz.connection = mock.MagicMock()
+        self.qrz.session_key = "3b1fd1d3ba495189984f93ff67bd45b6"
+        with mock.patch("pyqso.callsign_lookup.error"):
+            self.qrz.connection.getresponse.return_value.read.return_value = b'<?xml version="1.0" ?>\n<QRZDatabase version="1.33" xmlns="http://xmldata.qrz.com">\n<Session>\n<Error>Session Timeout</Error>\n</Session>\n</QRZDatabase>\n'
+            self.qrz.lookup("MYCALL")
+            assert(self.qrz.cache.get("qrz.com", "MYCALL") is None)
+            self.qrz.connection.getresponse.return_value.read.return_value = b'<?xml version="1.0" ?>\n<QRZDatabase version="1.33" xmlns="http://xmldata.qrz.com">\n<Session>\n<Error>Not found: MYCALL</Error>\n</Session>\n</QRZDatabase>\n'
+            self.qrz.lookup("MYCALL")
+            assert(self.qrz.cache.get("qrz.com", "MYCALL")["NAME"] == "")
+
+    def test_session_renewal(self):
+        """ Check that an expired session is renewed with the same login details, and that the lookup is then retried on the same connection. """
+
+        self.qrz.connection = mock.MagicMock()
+        self.qrz.session_key = "oldkey"
+        (self.qrz.username, self.qrz.password) = ("hello", "world")
+        self.qrz.connection.getresponse.return_value.read.side_effect = [
+            b'<?xml version="1.0" ?>\n<QRZDatabase version="1.33" xmlns="http://xmldata.qrz.com">\n<Session>\n<Error>Session Timeout</Error>\n</Session>\n</QRZDatabase>\n',
+            b'<?xml version="1.0" ?>\n<QRZDatabase version="1.33" xmlns="http://xmldata.qrz.com">\n<Session>\n<Key>newkey</Key>\n</Session>\n</QRZDatabase>\n',
+            b'<?xml version="1.0" ?>\n<QRZDatabase version="1.33" xmlns="http://xmldata.qrz.com">\n<Callsign>\n<call>MYCALL</call>\n<country>COUNTRY</country>\n</Callsign>\n</QRZDatabase>\n']
+        with mock.patch("pyqso.callsign_lookup.error") as error:
+            fields_and_data = self.qrz.lookup("MYCALL")
+            assert(not error.called)
+        assert(fields_and_data["COUNTRY"] == "COUNTRY")
+        assert(self.qrz.session_key == "newkey")
+        assert([c[0][1] for c in self.qrz.connection.request.call_args_list] == ["/xml/current/?s=oldkey;callsign=MYCALL", "/xml/current/?username=hello;password=world;agent=pyqso", "/xml/current/?s=newkey;callsign=MYCALL"])
+
+    def test_reconnect(self):
+        """ Check that the connection is re-opened if the server has closed it since the last request. """
+
+        connections = [mock.MagicMock(), mock.MagicMock()]
+        connections[0].getresponse.side_effect = http_client.RemoteDisconnected("Remote end closed connection without response")
+        connections[1].getresponse.return_value.read.return_value = b"Hello"
+        with mock.patch.object(self.hamqth, "create_connection", side_effect=connections):
+            assert(self.hamqth.request("/xml.php") == b"Hello")
+            assert(self.hamqth.request("/xml.php") == b"Hello")
+        assert(connections[0].close.called)
+        assert(connections[1].request.call_count == 2)
+
+    def test_client(self):
+        """ Check that the client only logs in once for several lookups, and answers repeated lookups from the cache. """
+
+        client = CallsignLookupClient(cache=CallsignLookupCache(path=None))
+        handler = client.get_handler("hamqth.com")
+        assert(client.get_handler("hamqth.com") is handler)
+        self.assertRaises(ValueError, client.get_handler, "example.com")
+
+        def connect(username, password):
+            (handler.session_key, handler.username, handler.password, handler.session_started) = ("key", username, password, time.time())
+            return True
+
+        with mock.patch.object(handler, "connect", side_effect=connect) as connect, mock.patch.object(CallsignLookupHamQTH, "query") as query:
+            query.return_value = handler.parse(b'<?xml version="1.0"?>\n<HamQTH version="2.6" xmlns="https://www.hamqth.com">\n<search>\n<callsign>MYCALL</callsign>\n<nick>NAME</nick>\n</search>\n</HamQTH>\n')
+            assert(client.lookup("hamqth.com", "hello", "world", "MYCALL")["NAME"] == "NAME")
+            assert(client.lookup("hamqth.com", "hello", "world", "F/MYCALL")["NAME"] == "NAME")
+            client.lookup("hamqth.com", "hello", "world", "OTHERCALL")
+            assert(connect.call_count == 1)
+            assert(query.call_count == 2)
+
+            # A session that is about to expire is renewed before the next lookup.
+            handler.session_started -= 3600
+            client.lookup("hamqth.com", "hello", "world", "NEWCALL")
+            assert(connect.call_count == 2)
+
+        # The lookups are sent over the calling thread's own connection, rather than the one used to log in.
+        worker = client.get_worker("hamqth.com")
+        assert(worker is not handler and client.get_worker("hamqth.com") is worker)
+        assert(worker.session_key == handler.session_key)
+
+    def test_client_concurrent_lookups(self):
+        """ Check that a slow lookup in one thread does not hold up a lookup in another thread. """
+
+        client = CallsignLookupClient(cache=CallsignLookupCache(path=None))
+        handler = client.get_handler("hamqth.com")
+        (handler.session_key, handler.username, handler.password, handler.session_started) = ("key", "hello", "world", time.time())
+        started = threading.Event()
+        release = threading.Event()
+        response = handler.parse(b'<?xml version="1.0"?>\n<HamQTH version="2.6" xmlns="https://www.hamqth.com">\n<search>\n<callsign>MYCALL</callsign>\n<nick>NAME</nick>\n</search>\n</HamQTH>\n')
+
+        def query(callsign):
+            if(callsign == "SLOWCALL"):
+                started.set()
+                release.wait(5)
+            return response
+
+        with mock.patch.object(CallsignLookupHamQTH, "query", side_effect=query):
+            slow = threading.Thread(target=client.lookup, args=("hamqth.com", "hello", "world", "SLOWCALL"))
+            slow.start()
+            try:
+                assert(started.wait(5))
+                start = time.time()
+                assert(client.lookup("hamqth.com", "hello", "world", "MYCALL")["NAME"] == "NAME")
+                assert(time.time() - start < 1)
+            finally:
+                release.set()
+                slow.join(5)
+
+    def test_async_lookup(self):
+        """ Check that a prefetched lookup is re-used when the user asks for it, and that the result of a cancelled lookup is ignored. """
+
+        client = mock.Mock()
+        client.lookup.return_value = {"NAME": "NAME"}
+        service = AsyncCallsignLookup(client)
+        callback = mock.Mock()
+        with mock.patch("pyqso.callsign_lookup.GLib") as glib:
+            glib.idle_add.side_effect = lambda function, *args: function(*args)
+
+            # Prefetch a callsign, and pretend that the user has stopped typing.
+            service.prefetch("hamqth.com", "hello", "world", "MYCALL")
+            assert(glib.timeout_add.called)
+            service.on_timer(service.generation)
+            service.future.result()
+            assert(service.result == ({"NAME": "NAME"}, []))
+
+            # The prefetched result is used straight away.
+            service.lookup("hamqth.com", "hello", "world", "MYCALL", callback)
+            callback.assert_called_once_with({"NAME": "NAME"}, [])
+            assert(client.lookup.call_count == 1)
+
+            # A lookup that completes after it has been cancelled is ignored.
+            callback.reset_mock()
+            service.lookup("hamqth.com", "hello", "world", "OTHERCALL", callback)
+            generation = service.generation
+            service.future.result()
+            service.cancel()
+            callback.reset_mock()
+            service.on_complete(generation, (mock.Mock(), []))
+            assert(not callback.called)
+            assert(client.lookup.call_count == 2)
+        service.shutdown()
+
 if(__name__ == '__main__'):
     unittest.main()
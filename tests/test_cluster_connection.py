@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import socket
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.cluster_connection import *
+
+
+class TestClusterConnection(unittest.TestCase):
+
+    """ The unit tests for the ClusterConnection class. """
+
+    def setUp(self):
+        """ Set up the objects needed for the unit tests. The Gtk main loop is replaced by a mock object, and the server is one end of a socket pair. """
+
+        self.glib = mock.patch("pyqso.cluster_connection.GLib", IO_IN=1, IO_OUT=4, IO_ERR=8, IO_HUP=16).start()
+        self.addCleanup(mock.patch.stopall)
+
+        self.text = []
+        self.states = []
+        self.connection = ClusterConnection("hello", 7300, "MYCALL", "secret", on_text=self.text.append, on_state=lambda state, message: self.states.append(state))
+        (self.client, self.server) = socket.socketpair()
+        self.server.settimeout(1)
+
+        # Pretend that the connection attempt has been started and has succeeded.
+        self.connection.state = CONNECTING
+        self.connection.on_socket_opened(self.connection.generation, self.client, None)
+
+    def tearDown(self):
+        """ Close the sockets. """
+        self.connection.disconnect(notify=False)
+        self.server.close()
+
+    def test_login(self):
+        """ Check that the username and password are sent in response to the server's login prompts. """
+        assert(self.states == [LOGGING_IN])
+
+        self.server.sendall(b"Welcome to the cluster.\r\nlogin: ")
+        assert(self.connection.on_io(None, self.glib.IO_IN))
+        assert(self.text == ["Welcome to the cluster.\nlogin: "])
+        assert(self.server.recv(100) == b"MYCALL\n")
+
+        self.server.sendall(b"pass")
+        self.connection.on_io(None, self.glib.IO_IN)
+        self.server.sendall(b"word: ")
+        self.connection.on_io(None, self.glib.IO_IN)
+        assert(self.server.recv(100) == b"secret\n")
+        assert(self.connection.state == CONNECTED)
+
+    def test_reconnect(self):
+        """ Check that a lost connection is re-established, with an increasing delay between attempts. """
+        self.server.close()
+        assert(not self.connection.on_io(None, self.glib.IO_IN))
+        assert(self.connection.state == WAITING)
+        self.glib.timeout_add_seconds.assert_called_with(1, self.connection.on_reconnect_timeout)
+
+        # A further failed attempt should double the delay.
+        with mock.patch("threading.Thread"):
+            self.connection.on_reconnect_timeout()
+        assert(self.connection.state == CONNECTING)
+        self.connection.on_socket_opened(self.connection.generation, None, OSError("Connection refused"))
+        self.glib.timeout_add_seconds.assert_called_with(2, self.connection.on_reconnect_timeout)
+
+        # Disconnecting should cancel any further attempts.
+        self.connection.disconnect()
+        assert(self.connection.state == DISCONNECTED)
+        assert(self.connection.timer is None)
+
+    def test_parse_telnet(self):
+        """ Check that Telnet commands are separated from the text, including commands split across two reads. """
+        (text, replies, remainder) = parse_telnet(bytes([IAC, DO, 1]) + b"DX de " + bytes([IAC, IAC, IAC, WILL]))
+        assert(text == b"DX de " + bytes([IAC]))
+        assert(replies == bytes([IAC, WONT, 1]))
+        assert(remainder == bytes([IAC, WILL]))
+
+        (text, replies, remainder) = parse_telnet(remainder + bytes([3, IAC, SB, 24, 1, IAC, SE]) + b"K1ABC")
+        assert(text == b"K1ABC")
+        assert(replies == bytes([IAC, DONT, 3]))
+        assert(remainder == b"")
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import sqlite3 as sqlite
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.contest_scoring import *
+
+
+class TestContestScore(unittest.TestCase):
+
+    """ The unit tests for the ContestScore class. """
+
+    def setUp(self):
+        """ Set up a CQ World Wide score for a station in England. """
+        self.score = ContestScore(get_rules("CQ-WW-CW"), mycall="G0ABC", cqz="14", ituz="27")
+        self.records = [{"CALL": "JA1ABC", "QSO_DATE": "20171125", "TIME_ON": "0010", "BAND": "20m", "MODE": "CW", "CQZ": "25"},
+                        {"CALL": "DL1ABC", "QSO_DATE": "20171125", "TIME_ON": "0000", "BAND": "20m", "MODE": "CW", "CQZ": "14"},
+                        {"CALL": "ja1abc", "QSO_DATE": "20171125", "TIME_ON": "0020", "BAND": "20m", "MODE": "CW", "CQZ": "25"},
+                        {"CALL": "JA1XYZ", "QSO_DATE": "20171125", "TIME_ON": "0030", "BAND": "40m", "MODE": "CW", "CQZ": "25"},
+                        {"CALL": "G4ABC", "QSO_DATE": "20171125", "TIME_ON": "0040", "BAND": "40m", "MODE": "CW", "CQZ": "14"}]
+
+    def test_station(self):
+        """ Check that the contest station's country and continent are found. """
+        assert(self.score.station == Station("G0ABC", "england", "14", "27", "EU"))
+
+    def test_score(self):
+        """ Check that the points, multipliers and duplicates are counted in a single sorted pass. """
+        assert(self.score.score(self.records) == 7*8)
+        assert((self.score.qso_count, self.score.dupe_count, self.score.points) == (5, 1, 3 + 1 + 3 + 0))
+        # Japan and zone 25 on both bands, Germany on 20m, England on 40m, and zone 14 on both bands.
+        assert(self.score.multiplier_count == 8)
+        assert(self.score.is_dupe({"CALL": "JA1ABC", "BAND": "20m"}) and not self.score.is_dupe({"CALL": "JA1ABC", "BAND": "15m"}))
+
+    def test_add(self):
+        """ Check that the multipliers are kept up-to-date as QSOs are added one at a time. """
+        claim = self.score.add(self.records[0])
+        assert(claim == Claim(3, [("DXCC", "20m", "japan"), ("CQZ", "20m", "25")], False))
+        assert(self.score.add(self.records[2]) == Claim(0, [], True))
+        assert(self.score.add({"CALL": ""}) is None)
+        assert(self.score.claimed_score == 3*2)
+
+    def test_rules(self):
+        """ Check the points and multipliers of the other contests. """
+        assert(type(get_rules("NAQP-CW")) is ContestRules)
+
+        wpx = ContestScore(get_rules("CQ-WPX-SSB"), mycall="K1ABC", cqz="5")
+        wpx.score([{"CALL": "JA1ABC", "BAND": "40m", "CQZ": "25"}, {"CALL": "JA1XYZ", "BAND": "20m", "CQZ": "25"}, {"CALL": "W1AW", "BAND": "20m"}, {"CALL": "VE3ABC", "BAND": "20m", "CQZ": "4"}])
+        assert(wpx.points == 6 + 3 + 1 + 2)
+        assert(sorted(m[2] for m in wpx.multipliers) == ["JA1", "VE3", "W1"])
+
+        iaru = ContestScore(get_rules("IARU-HF"), mycall="G0ABC", cqz="14", ituz="27")
+        iaru.score([{"CALL": "DL1ABC", "BAND": "20m", "MODE": "CW", "ITUZ": "28", "CQZ": "14"}, {"CALL": "DL1ABC", "BAND": "20m", "MODE": "SSB", "ITUZ": "28", "CQZ": "14"},
+                    {"CALL": "JA1ABC", "BAND": "20m", "MODE": "CW", "ITUZ": "45", "CQZ": "25"}, {"CALL": "G4ABC", "BAND": "20m", "MODE": "CW", "ITUZ": "27"}])
+        assert((iaru.points, iaru.dupe_count, iaru.multiplier_count) == (3 + 3 + 5 + 1, 0, 3))
+
+        ss = ContestScore(get_rules("ARRL-SS-CW"), mycall="K1ABC")
+        ss.score([{"CALL": "W1AW", "BAND": "20m", "RST_RCVD": "123 A 72 CT"}, {"CALL": "W1AW", "BAND": "40m", "RST_RCVD": "123 A 72 CT"}, {"CALL": "N6ABC", "BAND": "40m", "RST_RCVD": "1 B 99 SCV"}])
+        assert((ss.points, ss.dupe_count, ss.claimed_score) == (4, 1, 8))
+
+        # Stations outside of the United States and Canada count the states and provinces in the ARRL International DX contest.
+        arrl = ContestScore(get_rules("ARRL-DX-CW"), mycall="G0ABC")
+        arrl.score([{"CALL": "W1AW", "BAND": "20m", "RST_RCVD": "599 CT"}, {"CALL": "K1ABC", "BAND": "20m", "RST_RCVD": "599 CT"}, {"CALL": "W6ABC", "BAND": "40m", "RST_RCVD": "599 CA"}])
+        assert(arrl.claimed_score == 9*2)
+
+    def test_score_log(self):
+        """ Check that a log's QSOs are scored in time order, straight from the database. """
+        connection = sqlite.connect(":memory:")
+        connection.row_factory = sqlite.Row
+        connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, %s)" % ", ".join("%s TEXT" % f.lower() for f in SCORED_FIELDS))
+        connection.executemany("INSERT INTO test (call, qso_date, time_on, band, mode, cqz) VALUES (?, ?, ?, ?, ?, ?)", [(r["CALL"], r["QSO_DATE"], r["TIME_ON"], r["BAND"], r["MODE"], r["CQZ"]) for r in self.records])
+        log = mock.MagicMock()
+        log.connection = connection
+        log.name = "test"
+        assert(self.score.score_log(log) == 7*8)
+        assert(self.score.rate_meter.rate(3600) == 5)
+        connection.close()
+
+
+class TestRateMeter(unittest.TestCase):
+
+    """ The unit tests for the RateMeter class. """
+
+    def test_rate(self):
+        """ Check that the QSO rate is measured over sliding windows, and that old QSOs are forgotten. """
+        meter = RateMeter(windows=(600, 3600))
+        for t in range(0, 7200, 60):
+            meter.add(t)
+        meter.add(6000)  # A QSO logged out of order.
+        assert(meter.rates() == {600: 60.0, 3600: 61.0})
+        assert(meter.rate(600, now=7200+300) == 24.0)
+        for t in range(7200, 14400, 60):
+            meter.add(t)
+        assert(len(meter.times) < 150 and meter.rate(3600) == 60.0)
+
+
+class TestHelpers(unittest.TestCase):
+
+    """ The unit tests for the helper functions. """
+
+    def test_wpx_prefix(self):
+        """ Check that the CQ WPX prefix of a callsign is found. """
+        assert([wpx_prefix(c) for c in ["K1ABC", "9A1A", "2E0ABC", "n8bjq/p", "F/K1ABC", "K1ABC/4", "VP2E/K1ABC", "RAEM", ""]] == ["K1", "9A1", "2E0", "N8", "F0", "K4", "VP2", "RA0", ""])
+
+    def test_qso_time(self):
+        """ Check that the date and time of a QSO are converted to seconds since the epoch. """
+        assert(qso_time("19700102", "0001") == 86400 + 60)
+        assert(qso_time("19700101", "000030") == 30)
+        assert(qso_time("", "0000") is None and qso_time("1970010X", "0000") is None)
+
+    def test_get_section(self):
+        """ Check that the section is taken from the end of the received exchange. """
+        assert(get_section("123 A 72 orG") == "ORG")
+        assert(get_section("59 001") == "" and get_section(None) == "")
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import tempfile
+from pyqso.cross_check import *
+
+
+def qso(call, time, band="20m", sent="599 14", rcvd="599 5"):
+    """ Return a record of a QSO made on 25 November 2017. """
+    return {"CALL": call, "QSO_DATE": "20171125", "TIME_ON": time, "BAND": band, "RST_SENT": sent, "RST_RCVD": rcvd}
+
+
+class TestCrossCheck(unittest.TestCase):
+
+    """ The unit tests for the CrossCheck class. """
+
+    def setUp(self):
+        """ Set up the logs of three stations. """
+        self.cross_check = CrossCheck(tolerance=180)
+        self.cross_check.add_log("G0ABC", [qso("K1ABC", "0000"),  # Matched (the clocks differ by two minutes).
+                                           qso("K1ABC", "0010", band="40m", rcvd="599 4"),  # The exchange was copied wrongly.
+                                           qso("DL1XYZ", "0020"),  # The callsign was copied wrongly (it was DL1XY).
+                                           qso("JA1ABC", "0030"),  # JA1ABC submitted a log without this QSO.
+                                           qso("VK2ABC", "0040"),  # Nobody else worked VK2ABC.
+                                           qso("W1AW", "0050")])  # W1AW did not submit a log, but K1ABC worked it too.
+        self.cross_check.add_log("k1abc", [qso("G0ABC", "0002", sent="599 5", rcvd="599 14"),
+                                           qso("G0ABC", "0011", band="40m", sent="599 5", rcvd="599 014"),
+                                           qso("W1AW", "0100", sent="599 5", rcvd="599 5")])
+        self.cross_check.add_log("DL1XY", [qso("G0ABC", "0021", sent="599 14", rcvd="599 14")])
+        self.cross_check.add_log("JA1ABC", [qso("K1ABC", "0045", band="15m")])
+
+    def test_check(self):
+        """ Check that each QSO is classified as matched, unique, busted or not-in-log. """
+        results = self.cross_check.check()
+        assert([r.status for r in results["G0ABC"]] == [MATCHED, BUSTED_EXCHANGE, BUSTED_CALL, NOT_IN_LOG, UNIQUE, UNCHECKED])
+        assert(results["G0ABC"][1].detail == "599 5")
+        assert(results["G0ABC"][2].detail == "DL1XY")
+        assert(results["G0ABC"][0].record["TIME_ON"] == "0000")
+        assert([r.status for r in results["K1ABC"]] == [MATCHED, MATCHED, UNCHECKED])
+        assert([r.status for r in results["JA1ABC"]] == [NOT_IN_LOG])
+
+        counts = self.cross_check.summary(results)
+        assert(counts["G0ABC"][MATCHED] == 1 and counts["G0ABC"][NOT_IN_LOG] == 1 and sum(counts["G0ABC"].values()) == 6)
+
+    def test_tolerance(self):
+        """ Check that QSOs are only matched if the times are within the tolerance. """
+        cross_check = CrossCheck(tolerance=60)
+        cross_check.add_log("G0ABC", [qso("K1ABC", "0000"), qso("K1ABC", "0100")])
+        cross_check.add_log("K1ABC", [qso("G0ABC", "0002", sent="599 5"), qso("G0ABC", "0100", sent="599 5"), {"CALL": "G0ABC", "BAND": "20m"}])
+        results = cross_check.check()
+        assert([r.status for r in results["G0ABC"]] == [NOT_IN_LOG, MATCHED])
+        assert(len(results["K1ABC"]) == 2)  # The QSO without a date and time cannot be cross-checked.
+
+    def test_cabrillo_files(self):
+        """ Check that logs can be added from Cabrillo files. """
+        directory = tempfile.mkdtemp()
+        paths = [os.path.join(directory, "%d.log" % i) for i in range(2)]
+        with open(paths[0], "w") as f:
+            f.write("START-OF-LOG: 3.0\nCALLSIGN: G0ABC\nQSO: 14025 CW 2017-11-25 0000 G0ABC 599 14 K1ABC 599 5\nEND-OF-LOG:\n")
+        with open(paths[1], "w") as f:
+            f.write("START-OF-LOG: 3.0\nQSO: 14025 CW 2017-11-25 0001 K1ABC 599 5 G0ABC 599 14\nEND-OF-LOG:\n")
+        try:
+            failed = self.cross_check.add_cabrillo_files(paths + [os.path.join(directory, "missing.log")], workers=1)
+        finally:
+            for path in paths:
+                os.remove(path)
+            os.rmdir(directory)
+        assert(failed == [os.path.join(directory, "missing.log")])
+        results = self.cross_check.check()
+        assert([r.status for r in results["G0ABC"]] == [MATCHED] and [r.status for r in results["K1ABC"]] == [MATCHED])
+
+    def test_helpers(self):
+        """ Check that exchanges are normalised, and that the distance between callsigns is found. """
+        assert(exchange(" 599  014 ca") == ("599", "14", "CA") and exchange("0") == ("0",) and exchange(None) == ())
+        assert(distance("DL1XY", "DL1XYZ") == 1 and distance("K1ABC", "K1ACB") == 2 and distance("", "G0") == 2)
+
+if(__name__ == '__main__'):
+    unittest.main()
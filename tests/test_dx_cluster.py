@@ -23,6 +23,8 @@ try:
 except ImportError:
     import mock
 from pyqso.dx_cluster import *
+from pyqso.cluster_connection import DISCONNECTED
+from pyqso.worked_before import WorkedBefore, NEW_MODE
 
 
 class TestDXCluster(unittest.TestCase):
@@ -36,14 +38,71 @@ class TestDXCluster(unittest.TestCase):
         self.dxcluster = DXCluster(application=PyQSO())
 
     def test_on_telnet_io(self):
-        """ Check that the response from the Telnet server can be correctly decoded. """
-
-        telnetlib.Telnet = mock.Mock(spec=telnetlib.Telnet)
-        connection = telnetlib.Telnet("hello", "world")
-        connection.read_very_eager.return_value = b"Test message from the Telnet server."
-        self.dxcluster.connection = connection
-        result = self.dxcluster.on_telnet_io()
-        assert(result)
+        """ Check that the responses from the Telnet server are added to the end of the text buffer in a single insert. """
+
+        self.dxcluster.buffer = mock.MagicMock()
+        self.dxcluster.buffer.get_line_count.return_value = 2
+        with mock.patch("pyqso.dx_cluster.GObject") as GObject:
+            self.dxcluster.on_telnet_io("Test message from ")
+            self.dxcluster.on_telnet_io("the Telnet server.\n")
+            GObject.idle_add.assert_called_once_with(self.dxcluster.flush_output)
+        assert(not self.dxcluster.buffer.insert.called)
+        self.dxcluster.flush_output()
+        self.dxcluster.buffer.insert.assert_called_once_with(self.dxcluster.buffer.get_end_iter(), "Test message from the Telnet server.\n")
+        assert(not self.dxcluster.buffer.delete.called)
+
+    def test_flush_output(self):
+        """ Check that the oldest lines are removed from the text buffer in batches. """
+
+        self.dxcluster.buffer = mock.MagicMock()
+        self.dxcluster.maximum_lines = 100
+        self.dxcluster.trim_lines = 10
+        self.dxcluster.buffer.get_line_count.return_value = 111
+        self.dxcluster.pending = ["DX de W3LPL:     14025.0  JA1ABC       CW 599      1234Z\n"]
+        self.dxcluster.flush_output()
+        self.dxcluster.buffer.get_iter_at_line.assert_called_once_with(11)
+        self.dxcluster.buffer.delete.assert_called_once_with(self.dxcluster.buffer.get_start_iter(), self.dxcluster.buffer.get_iter_at_line())
+        assert(self.dxcluster.pending == [])
+
+    def test_telnet_connect(self):
+        """ Check that connecting to a Telnet server does not block, and that a failed connection is reported. """
+
+        with mock.patch("pyqso.dx_cluster.ClusterConnection") as ClusterConnection, mock.patch("pyqso.dx_cluster.error") as error:
+            self.dxcluster.telnet_connect("hello", 7300, "MYCALL")
+            assert(ClusterConnection.call_args[0] == ("hello", 7300, "MYCALL", None))
+            self.dxcluster.connections["hello:7300"].connect.assert_called_once_with()
+            self.dxcluster.on_telnet_state(DISCONNECTED, "Could not connect to hello:7300.", source="hello:7300")
+            assert(self.dxcluster.connections == {})
+            assert(error.call_count == 1)
+
+    def test_aggregation(self):
+        """ Check that spots from several Telnet servers are merged, and that duplicate spots are only printed once. """
+
+        self.dxcluster.connections = {"hello:7300": mock.MagicMock(), "world:7373": mock.MagicMock()}
+        with mock.patch.object(self.dxcluster, "print_text") as print_text:
+            self.dxcluster.on_telnet_io("DX de W3LPL:     14025.0  JA1ABC       CW 599                      1234Z\nHello from the server.\n", source="hello:7300")
+            self.dxcluster.on_telnet_io("DX de K1TTT:     14025.2  JA1ABC       CW                          1234Z\n", source="world:7373")
+            assert(print_text.call_count == 1)
+            assert(print_text.call_args[0][0].startswith("DX de W3LPL:"))
+        assert(len(self.dxcluster.spots) == 1)
+        assert(self.dxcluster.statistics["hello:7300"].first == 1)
+        assert(self.dxcluster.statistics["world:7373"].duplicates == 1)
+
+    def test_highlight(self):
+        """ Check that the callsigns of needed stations are highlighted once the text has been printed. """
+
+        self.dxcluster.application.logbook.worked_before = WorkedBefore()
+        self.dxcluster.application.logbook.worked_before.add({"CALL": "JA1ABC", "BAND": "20m", "MODE": "CW"})
+        self.dxcluster.buffer = mock.MagicMock()
+        self.dxcluster.buffer.get_line_count.return_value = 2
+        with mock.patch("pyqso.dx_cluster.GObject"):
+            self.dxcluster.on_telnet_io("DX de W3LPL:     14025.0  JA1ABC       CW 599                      1234Z\n")
+            self.dxcluster.on_telnet_io("DX de W3LPL:     14074.0  JA1ABC       FT8 -10 dB                  1235Z\n")
+        assert(self.dxcluster.pending_marks == [("JA1ABC", NEW_MODE)])
+        with mock.patch.object(self.dxcluster, "highlight") as highlight:
+            self.dxcluster.flush_output()
+            highlight.assert_called_once_with(self.dxcluster.buffer.get_iter_at_offset(), [("JA1ABC", NEW_MODE)])
+        assert(self.dxcluster.pending_marks == [])
 
 if(__name__ == '__main__'):
     unittest.main()
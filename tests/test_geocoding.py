@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import tempfile
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.geocoding import Geocoder, location_prefix
+
+
+class TestGeocoder(unittest.TestCase):
+
+    """ The unit tests for the Geocoder class. """
+
+    def setUp(self):
+        """ Set up the Geocoder object needed for the unit tests, using a temporary on-disk cache. """
+        (handle, self.path) = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.geocoder = Geocoder(path=self.path, maximum_size=2)
+
+    def tearDown(self):
+        """ Remove the temporary on-disk cache. """
+        self.geocoder.connection.close()
+        os.remove(self.path)
+
+    def test_lookup(self):
+        """ Check that the coordinates of a country can be found in the bundled country centroid table, regardless of case or whitespace. """
+        assert(self.geocoder.lookup("France") == (46.2, 2.2))
+        assert(self.geocoder.lookup("  united   KINGDOM ") == (55.4, -3.4))
+        assert(self.geocoder.lookup("Atlantis") is None)
+        assert(self.geocoder.lookup("") is None)
+
+    def test_lookup_callsign(self):
+        """ Check that the country of a callsign is found using the longest matching prefix. """
+        assert(self.geocoder.get_country("W1AW") == "United States")
+        assert(self.geocoder.get_country("KH6XYZ") == "Hawaii")
+        assert(self.geocoder.get_country("F/MYCALL") == "France")
+        assert(self.geocoder.get_country("g4abc/p") == "England")
+        assert(self.geocoder.lookup_callsign("JA1ABC") == ("Japan", (36.2, 138.3)))
+        assert(self.geocoder.get_country("") is None)
+
+    def test_location_prefix(self):
+        """ Check that portable prefixes and suffixes are handled correctly. """
+        assert(location_prefix("MYCALL") == "MYCALL")
+        assert(location_prefix("MYCALL/P") == "MYCALL")
+        assert(location_prefix("HB9/MYCALL/P") == "HB9")
+        assert(location_prefix("MYCALL/EA8") == "EA8")
+        assert(location_prefix("W1AW/4") == "W1AW")
+        assert(location_prefix("F/K1ABC") == "F")
+
+    def test_store(self):
+        """ Check that stored coordinates are persisted on disk, and that the least-recently used entries are evicted from memory. """
+        self.geocoder.store("Atlantis", (31.0, -24.0))
+        self.geocoder.store("Lyonesse", (49.9, -6.3))
+        self.geocoder.lookup("France")
+        assert(list(self.geocoder.lru.keys()) == ["lyonesse", "france"])
+
+        # A new Geocoder object should find the stored coordinates on disk.
+        g = Geocoder(path=self.path)
+        assert(g.lookup("Atlantis") == (31.0, -24.0))
+        g.connection.close()
+
+    def test_lookup_online(self):
+        """ Check that locations looked up online are passed to the callback and stored in the cache. """
+        callback = mock.MagicMock()
+        with mock.patch("pyqso.geocoding.geocoder", create=True) as geocoder, mock.patch("pyqso.geocoding.have_geocoder", True):
+            geocoder.google.return_value.latlng = [31.0, -24.0]
+            thread = self.geocoder.lookup_online("Atlantis", callback)
+            thread.join()
+        callback.assert_called_once_with("Atlantis", (31.0, -24.0))
+        assert(self.geocoder.lookup("Atlantis") == (31.0, -24.0))
+
+if(__name__ == '__main__'):
+    unittest.main()
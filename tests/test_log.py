@@ -19,6 +19,7 @@
 
 import unittest
 from pyqso.log import *
+from pyqso.worked_before import WorkedBefore, WORKED, NEW_MODE, NEW_DXCC_BAND
 
 
 class TestLog(unittest.TestCase):
@@ -174,6 +175,28 @@ class TestLog(unittest.TestCase):
             assert(records[0][field_name] == self.fields_and_data[field_name])
             assert(records[1][field_name] == self.fields_and_data[field_name])
 
+    def test_iter_records(self):
+        """ Check that all records in a log can be iterated over without fetching them all at once. """
+        query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+        c = self.connection.cursor()
+        for i in range(3):
+            c.execute(query, ("TEST%d" % i, self.fields_and_data["QSO_DATE"], self.fields_and_data["TIME_ON"], self.fields_and_data["FREQ"], self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+
+        records = self.log.iter_records()
+        assert(not isinstance(records, list))
+        assert([r["CALL"] for r in records] == ["TEST0", "TEST1", "TEST2"])
+
+    def test_get_records_by_index_range(self):
+        """ Check that the records in a range of indices, and the indices of all the records, can be retrieved. """
+        query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
+        c = self.connection.cursor()
+        for i in range(4):
+            c.execute(query, ("TEST%d" % i, self.fields_and_data["QSO_DATE"], self.fields_and_data["TIME_ON"], self.fields_and_data["FREQ"], self.fields_and_data["BAND"], self.fields_and_data["MODE"], self.fields_and_data["RST_SENT"], self.fields_and_data["RST_RCVD"]))
+        c.execute("DELETE FROM test WHERE id=2")
+
+        assert(self.log.indices == [1, 3, 4])
+        assert([r["CALL"] for r in self.log.get_records_by_index_range(2, 4)] == ["TEST2", "TEST3"])
+
     def test_record_count(self):
         """ Check that the total number of records in a log is calculated correctly. """
         query = "INSERT INTO test VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)"
@@ -223,5 +246,18 @@ class TestLog(unittest.TestCase):
             assert(exists[0] == 1)  # New log name should now exist.
         assert(self.log.name == new_name)
 
+    def test_worked_before(self):
+        """ Check that the index of worked stations is updated when records are added, edited and deleted. """
+        self.log.worked_before = WorkedBefore()
+        self.log.add_record([self.fields_and_data, dict(self.fields_and_data, BAND="70cm")])
+        assert(self.log.worked_before.status("TEST123", "2m", "FM") == WORKED)
+        self.log.edit_record(1, "MODE", "SSB")
+        assert(self.log.worked_before.status("TEST123", "2m", "FM") == NEW_MODE)
+        assert(self.log.worked_before.status("TEST123", "2m", "SSB") == WORKED)
+        self.log.delete_record(2)
+        assert(self.log.worked_before.status("TEST123", "70cm", "FM") == NEW_DXCC_BAND)
+        self.log.delete_record(1)
+        assert(len(self.log.worked_before) == 0)
+
 if(__name__ == '__main__'):
     unittest.main()
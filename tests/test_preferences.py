@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import tempfile
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.preferences import *
+
+
+class TestPreferences(unittest.TestCase):
+
+    """ The unit tests for the Preferences class. """
+
+    def setUp(self):
+        """ Write a temporary configuration file. """
+        (handle, self.path) = tempfile.mkstemp(suffix=".ini")
+        with os.fdopen(handle, "w") as f:
+            f.write("[general]\nshow_toolbox = True\n\n[records]\ndefault_power = 100\n")
+        self.preferences = Preferences(path=self.path)
+
+    def tearDown(self):
+        """ Remove the temporary configuration file. """
+        os.remove(self.path)
+
+    def test_get(self):
+        """ Check that the preferences are only read once, and that the fallback is used for preferences that have not been set. """
+        with mock.patch.object(self.preferences, "load", wraps=self.preferences.load) as load:
+            assert(self.preferences.have_config)
+            assert(self.preferences.getboolean("general", "show_toolbox"))
+            assert(self.preferences.get("records", "default_power") == "100")
+            assert(self.preferences.getfloat("records", "default_power") == 100.0)
+            assert(self.preferences.get("records", "default_mode") is None)
+            assert(self.preferences.getboolean("general", "keep_open", fallback=False) is False)
+            assert(not self.preferences.has_option("world_map", "show_qth"))
+            assert(load.call_count == 1)
+
+    def test_missing_file(self):
+        """ Check that the defaults are used if there is no configuration file. """
+        p = Preferences(path=self.path + ".missing")
+        assert(not p.have_config)
+        assert(p.getboolean("general", "show_toolbox", fallback=False) is False)
+
+    def test_save(self):
+        """ Check that saving the preferences writes them to the configuration file, and notifies the subscribers of the options that have changed. """
+        callback = mock.Mock()
+        self.preferences.subscribe(callback)
+
+        config = configparser.ConfigParser()
+        config.add_section("general")
+        config.set("general", "show_toolbox", "True")
+        config.add_section("records")
+        config.set("records", "default_power", "5")
+        config.set("records", "default_mode", "CW")
+        self.preferences.save(config)
+        callback.assert_called_once_with(set([("records", "default_power"), ("records", "default_mode")]))
+        assert(self.preferences.get("records", "default_power") == "5")
+        assert(Preferences(path=self.path).get("records", "default_mode") == "CW")
+
+        # Nothing is sent if nothing has changed, or once the subscriber has unsubscribed.
+        self.preferences.save(config)
+        self.preferences.unsubscribe(callback)
+        config.set("records", "default_power", "10")
+        self.preferences.save(config)
+        assert(callback.call_count == 1)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -48,5 +48,34 @@ class TestPrinter(unittest.TestCase):
         assert(result == Gtk.PrintOperationResult.APPLY)
         assert(os.path.exists(pdf))
 
+    def test_page_range(self):
+        """ Check that the page breaks are worked out from the number of lines that fit on a page. """
+        self.printer.title = "Log: test"
+        self.printer.record_count = 25
+        self.printer.lines_per_page = 10
+        assert(self.printer.number_of_pages == 4)
+        assert([self.printer.page_range(p) for p in range(4)] == [(0, 6), (6, 14), (14, 22), (22, 25)])
+
+        self.printer.title = None
+        self.printer.record_count = 8
+        assert(self.printer.number_of_pages == 1 and self.printer.page_range(0) == (0, 8))
+
+    def test_draw_page(self):
+        """ Check that only the records on a page are retrieved and drawn. """
+        self.printer.title = "Log: test"
+        self.printer.record_count = 25
+        self.printer.lines_per_page = 10
+        self.printer.line_height = 10
+        records = [{"id": i, "CALL": "TEST%d" % i, "QSO_DATE": "20170624", "TIME_ON": "1519", "FREQ": "145.550", "MODE": "FM", "RST_SENT": "59", "RST_RCVD": "57"} for i in range(25)]
+        self.printer.get_records = mock.MagicMock(side_effect=lambda start, stop: records[start:stop])
+        context = mock.MagicMock()
+        with mock.patch("pyqso.printer.PangoCairo") as PangoCairo:
+            self.printer.draw_page(mock.MagicMock(), context, 1)
+        self.printer.get_records.assert_called_once_with(6, 14)
+        layout = context.create_pango_layout.return_value
+        lines = [call[0][0] for call in layout.set_text.call_args_list]
+        assert(lines == TABLE_HEADER + [format_record(r) for r in records[6:14]])
+        assert(PangoCairo.show_layout.call_count == 10)
+
 if(__name__ == '__main__'):
     unittest.main()
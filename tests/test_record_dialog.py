@@ -24,6 +24,7 @@ try:
 except ImportError:
     import mock
 from pyqso.record_dialog import *
+from pyqso.rig import RigState
 
 
 class TestRecordDialog(unittest.TestCase):
@@ -33,7 +34,9 @@ class TestRecordDialog(unittest.TestCase):
     def setUp(self):
         """ Set up the objects needed for the unit tests. """
         PyQSO = mock.MagicMock()
-        self.record_dialog = RecordDialog(application=PyQSO(), log=None)
+        application = PyQSO()
+        application.rig.get_state.return_value = None  # No rig is being read.
+        self.record_dialog = RecordDialog(application=application, log=None)
         self.record_dialog.frequency_unit = "MHz"
 
         # Set up the necessary sources.
@@ -96,16 +99,16 @@ class TestRecordDialog(unittest.TestCase):
         assert(converted == frequency)
 
     def test_hamlib_autofill(self):
-        """ Check that FREQ, MODE and SUBMODE information can be retrieved from Hamlib's dummy rig (if the Hamlib module exists). """
-        if(have_hamlib):
-            rig_model = "RIG_MODEL_DUMMY"
-            rig_pathname = "/dev/Rig"
-            self.record_dialog.hamlib_autofill(rig_model, rig_pathname)
-            assert(self.record_dialog.sources["FREQ"].get_text() == "145.000000")
-            assert(self.record_dialog.sources["MODE"].get_active_text() == "FM")
-            assert(self.record_dialog.sources["SUBMODE"].get_active_text() == "")
-        else:
-            pass
+        """ Check that the FREQ, MODE and SUBMODE fields are filled in using the latest readings from the rig. """
+        self.record_dialog.hamlib_autofill(RigState(145.0, "FM", "", 0))
+        assert(self.record_dialog.sources["FREQ"].get_text() == "145.000000")
+        assert(self.record_dialog.sources["MODE"].get_active_text() == "FM")
+        assert(self.record_dialog.sources["SUBMODE"].get_active_text() == "")
+
+        self.record_dialog.frequency_unit = "kHz"
+        self.record_dialog.hamlib_autofill(RigState(7.1405, "CW", "", 0))
+        assert(float(self.record_dialog.sources["FREQ"].get_text()) == 7140.5)
+        assert(self.record_dialog.sources["MODE"].get_active_text() == "CW")
 
 if(__name__ == '__main__'):
     unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+import threading
+import time
+from pyqso.rig import *
+
+
+class TestRigService(unittest.TestCase):
+
+    """ The unit tests for the RigService class. """
+
+    def wait_for_state(self, service, timeout=5):
+        """ Wait until the service has read the rig, and return the readings. """
+        start = time.monotonic()
+        while(service.get_state() is None and time.monotonic() - start < timeout):
+            time.sleep(0.01)
+        return service.get_state()
+
+    def test_dummy_rig(self):
+        """ Check that the frequency and mode can be read from Hamlib's dummy rig (if the Hamlib module exists). """
+        if(have_hamlib):
+            service = RigService("RIG_MODEL_DUMMY", "/dev/Rig", interval=0.05)
+            service.start()
+            try:
+                state = self.wait_for_state(service)
+                assert((state.frequency, state.mode, state.submode) == (145.0, "FM", ""))
+            finally:
+                service.stop(wait=True)
+            assert(not service.running and service.get_state() is None)
+        else:
+            pass
+
+    def test_polling(self):
+        """ Check that a single communication channel is kept open, that the readings are refreshed, and that the channel is re-opened after an error. """
+        rig = mock.MagicMock()
+        rig.error_status = 0
+        rig.get_freq.return_value = 14.2e6
+        rig.get_mode.return_value = (1, 2400)
+        with mock.patch("pyqso.rig.Hamlib", create=True) as Hamlib, mock.patch("pyqso.rig.have_hamlib", True):
+            Hamlib.RIG_OK = 0
+            Hamlib.Rig.return_value = rig
+            Hamlib.rig_strrmode.return_value = "USB"
+            service = RigService("RIG_MODEL_DUMMY", "/dev/Rig", interval=0.01)
+            service.start()
+            try:
+                state = self.wait_for_state(service)
+                assert((state.frequency, state.mode, state.submode) == (14.2, "SSB", "USB"))
+
+                rig.get_freq.return_value = 7.1e6
+                start = time.monotonic()
+                while(service.get_state().frequency != 7.1 and time.monotonic() - start < 5):
+                    time.sleep(0.01)
+                assert(service.get_state().frequency == 7.1)
+                assert(Hamlib.Rig.call_count == 1 and rig.open.call_count == 1)
+
+                # The readings are withdrawn when the rig stops responding, and the channel is re-opened.
+                rig.error_status = -5
+                start = time.monotonic()
+                while(service.get_state() is not None and time.monotonic() - start < 5):
+                    time.sleep(0.01)
+                assert(service.get_state() is None and rig.close.call_count == 1)
+                rig.error_status = 0
+                assert(self.wait_for_state(service) is not None)
+                assert(rig.open.call_count == 2)
+            finally:
+                service.stop(wait=True)
+        assert(not service.running)
+
+    def test_restart_while_blocked(self):
+        """ Check that a background thread which is still blocked on opening the rig when the service is re-started does not wait for the stop, and stops without publishing its readings once it is unblocked. """
+        blocked = threading.Event()
+        unblock = threading.Event()
+        old_rig = mock.MagicMock()
+        old_rig.error_status = 0
+        old_rig.get_freq.return_value = 7.1e6
+        old_rig.open.side_effect = lambda: (blocked.set(), unblock.wait(5))
+        new_rig = mock.MagicMock()
+        new_rig.error_status = 0
+        new_rig.get_freq.return_value = 14.2e6
+        with mock.patch("pyqso.rig.Hamlib", create=True) as Hamlib, mock.patch("pyqso.rig.have_hamlib", True):
+            Hamlib.RIG_OK = 0
+            Hamlib.Rig.side_effect = [old_rig, new_rig]
+            Hamlib.rig_strrmode.return_value = "CW"
+            old_rig.get_mode.return_value = new_rig.get_mode.return_value = (2, 500)
+            service = RigService("RIG_MODEL_DUMMY", "/dev/Rig", interval=0.01)
+            service.start()
+            old_thread = service.thread
+            assert(blocked.wait(5))
+
+            # Stopping the service does not wait for the blocked thread.
+            start = time.monotonic()
+            service.stop()
+            assert(time.monotonic() - start < 1 and old_thread.is_alive())
+
+            service.rig_pathname = "/dev/OtherRig"
+            service.start()
+            try:
+                assert(self.wait_for_state(service).frequency == 14.2)
+                unblock.set()
+                old_thread.join(5)
+                assert(not old_thread.is_alive())
+                assert(old_rig.get_freq.call_count == 0 and old_rig.close.call_count == 1)
+                assert(service.get_state().frequency == 14.2)
+                assert(new_rig.set_conf.call_args == mock.call("rig_pathname", "/dev/OtherRig"))
+            finally:
+                unblock.set()
+                service.stop(wait=True)
+        assert(not service.running and service.get_state() is None)
+
+    def test_get_state(self):
+        """ Check that old readings can be ignored. """
+        service = RigService()
+        service.state = RigState(14.2, "CW", "", time.monotonic() - 10)
+        assert(service.get_state() is not None)
+        assert(service.get_state(maximum_age=5) is None)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from pyqso.spots import *
+
+
+class TestSpots(unittest.TestCase):
+
+    """ The unit tests for the DX spot parser. """
+
+    def test_parse_spot(self):
+        """ Check that a DX spot is parsed correctly, and that other lines are ignored. """
+        spot = parse_spot("DX de W3LPL:     14025.0  ja1abc       CW 599                      1234Z FM19", received=100.0)
+        assert(spot == Spot("W3LPL", 14025.0, "JA1ABC", "CW 599", "1234", "FM19", "20m", "CW", 100.0))
+        spot = parse_spot("DX de DL1ABC:    14200.0  VK2XYZ       usb 59 nice sig   1200Z")
+        assert(spot.mode == "SSB" and spot.locator == "")
+        assert(parse_spot("WWV de W0MU <21>:   SFI=70, A=4, K=1") is None)
+        assert(parse_spot("DX de G4ABC: garbled") is None)
+
+    def test_get_band(self):
+        """ Check that the band is found from the frequency in kHz. """
+        assert(get_band(1800.0) == "160m")
+        assert(get_band(14350.0) == "20m")
+        assert(get_band(14400.0) == "")
+        assert(get_band(144300.0) == "2m")
+
+    def test_feed(self):
+        """ Check that spots split across several reads are parsed once the rest of the line arrives. """
+        parser = SpotParser()
+        assert(parser.feed("Hello\r\nDX de W3LPL:  7003.5  UA3ABC ", received=0) == [])
+        spots = parser.feed("  CW 12 dB 24 WPM CQ  2359Z\nDX de K1TTT:  144174.0  W1XYZ  FT8 -12 dB  0001Z\n", received=0)
+        assert([s.dx_call for s in spots] == ["UA3ABC", "W1XYZ"])
+        assert(parser.partial == "")
+
+
+class TestSpotStore(unittest.TestCase):
+
+    """ The unit tests for the SpotStore class. """
+
+    def setUp(self):
+        """ Set up the SpotStore object needed for the unit tests. """
+        self.store = SpotStore(maximum_size=4, maximum_age=600)
+        spots = [("JA1ABC", 14025.0, "CW", 0), ("UA3ABC", 7003.5, "CW", 100), ("VK2XYZ", 14200.0, "SSB", 200), ("JA1ABC", 14074.0, "FT8", 300)]
+        for (dx_call, frequency, mode, received) in spots:
+            self.store.add(Spot("W3LPL", frequency, dx_call, mode, "0000", "", get_band(frequency), mode, received))
+
+    def test_query(self):
+        """ Check that the spots can be searched by band, mode, DX callsign and age. """
+        assert([s.dx_call for s in self.store.query(band="20m", now=300)] == ["JA1ABC", "VK2XYZ", "JA1ABC"])
+        assert([s.received for s in self.store.query(band="20m", age=150, now=300)] == [200, 300])
+        assert([s.frequency for s in self.store.query(dx_call="ja1abc", mode="CW", now=300)] == [14025.0])
+        assert(self.store.query(band="2m", now=300) == [])
+        assert(len(self.store.query(now=300)) == 4)
+
+    def test_expire(self):
+        """ Check that the oldest spots are removed from the store and its indices. """
+        self.store.add(Spot("W3LPL", 7010.0, "G4ABC", "", "0000", "", "40m", "", 400))
+        assert(len(self.store) == 4)
+        assert([s.received for s in self.store.query(dx_call="JA1ABC", now=400)] == [300])
+
+        # All but the newest spot are now older than the maximum age.
+        assert([s.dx_call for s in self.store.query(now=950)] == ["G4ABC"])
+        assert(self.store.indices["band"] == {"40m": self.store.spots})
+        assert("JA1ABC" not in self.store.indices["dx_call"])
+
+
+class TestSpotDeduplicator(unittest.TestCase):
+
+    """ The unit tests for the SpotDeduplicator and SourceStatistics classes. """
+
+    def test_check(self):
+        """ Check that spots of the same DX callsign on nearly the same frequency within the time window are duplicates. """
+        deduplicator = SpotDeduplicator(tolerance=1.0, window=120)
+        spot = Spot("W3LPL", 14025.0, "JA1ABC", "", "1234", "", "20m", "CW", 1000.0)
+        assert(deduplicator.check(spot, "hello") is None)
+        assert(deduplicator.check(spot._replace(spotter="K1TTT", frequency=14025.9, received=1100.0), "world") == (spot, "hello"))
+        assert(deduplicator.check(spot._replace(frequency=14027.0, received=1100.0), "world") is None)
+        assert(deduplicator.check(spot._replace(dx_call="JA1XYZ", received=1100.0), "world") is None)
+        assert(deduplicator.check(spot._replace(received=1200.0), "world") is None)  # Too late.
+        assert(len(deduplicator.buckets) <= 2)
+
+    def test_statistics(self):
+        """ Check that the spot rate and the lag behind other DX clusters are measured correctly. """
+        statistics = SourceStatistics(window=60)
+        spot = Spot("W3LPL", 14025.0, "JA1ABC", "", "1234", "", "20m", "CW", 1000.0)
+        statistics.record(spot, "world", (spot._replace(received=996.0), "hello"))
+        statistics.record(spot._replace(received=1010.0), "world", None)
+        assert((statistics.spots, statistics.first, statistics.duplicates) == (2, 1, 1))
+        assert(statistics.mean_lag == 4.0)
+        assert(statistics.rate(now=1030.0) == 2.0)
+        assert(statistics.rate(now=1065.0) == 1.0)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2017 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.toolbox import *
+
+
+class TestToolbox(unittest.TestCase):
+
+    """ The unit tests for the Toolbox class. """
+
+    def setUp(self):
+        """ Set up a Toolbox whose tools are stand-ins, with the toolbox hidden and the DX cluster page selected. """
+        PyQSO = mock.MagicMock()
+        self.application = PyQSO()
+        self.toolbox_frame = self.application.builder.get_object("toolbox")
+        self.toolbox_frame.get_visible.return_value = False
+        self.application.builder.get_object("tools").get_current_page.return_value = 0
+        self.toolbox = Toolbox(application=self.application)
+        self.tools = [mock.MagicMock(), mock.MagicMock(), mock.MagicMock()]
+        self.toolbox.pages = [(name, tool) for ((name, cls), tool) in zip(self.toolbox.pages, self.tools)]
+
+    def test_deferred_construction(self):
+        """ Check that the tools are only built when they are first shown. """
+        assert(self.toolbox.instances == {})
+        self.toolbox.show_current_tool()
+        assert(self.toolbox.instances == {})  # The toolbox is hidden.
+
+        self.toolbox_frame.get_visible.return_value = True
+        self.toolbox.show_current_tool()
+        assert(list(self.toolbox.instances.keys()) == ["dx_cluster"])
+        self.toolbox.on_switch_page(None, None, 1)
+        assert(self.tools[1].call_count == 1)
+        self.toolbox.instances["world_map"].draw.assert_called_once_with()
+        self.toolbox.instances["world_map"].resume.assert_called_once_with()
+        assert(self.tools[2].call_count == 0)
+
+    def test_dirty(self):
+        """ Check that tools which are not visible are only updated (in one go) when they are next shown. """
+        self.toolbox_frame.get_visible.return_value = True
+        self.toolbox.on_switch_page(None, None, 2)
+        awards = self.toolbox.instances["awards"]
+        self.toolbox.on_switch_page(None, None, 0)
+        for i in range(3):
+            self.toolbox.count_awards(self.application.logbook)
+        assert(awards.count.call_count == 0 and "awards" in self.toolbox.dirty)
+
+        self.toolbox.on_switch_page(None, None, 2)
+        awards.count.assert_called_once_with(self.application.logbook)
+        assert(self.toolbox.dirty == set())
+
+        # Grid square updates are dropped while the World Map is waiting to count the grid squares from scratch.
+        self.toolbox.count_grid_squares(self.application.logbook)
+        self.toolbox.update_grid_squares(added=["IO91"])
+        self.toolbox.on_switch_page(None, None, 1)
+        world_map = self.toolbox.instances["world_map"]
+        assert(world_map.update_grid_squares.call_count == 0)
+        world_map.count_grid_squares.assert_called_once_with(self.application.logbook)
+
+        # The World Map stops re-drawing itself when another page is selected.
+        self.toolbox.on_switch_page(None, None, 0)
+        world_map.pause.assert_called_once_with()
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+#    Copyright (C) 2018 Christian Thomas Jacobs.
+
+#    This file is part of PyQSO.
+
+#    PyQSO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    PyQSO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with PyQSO.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import sqlite3 as sqlite
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+from pyqso.worked_before import *
+from pyqso.spots import Spot
+
+
+class TestWorkedBefore(unittest.TestCase):
+
+    """ The unit tests for the WorkedBefore class. """
+
+    def setUp(self):
+        """ Set up an index containing a few QSOs. """
+        self.worked_before = WorkedBefore()
+        self.records = [{"CALL": "JA1ABC", "BAND": "20m", "MODE": "CW"},
+                        {"CALL": "ja1abc", "BAND": "20M", "MODE": "SSB"},
+                        {"CALL": "DL1ABC", "BAND": "40m", "MODE": "CW"}]
+        self.worked_before.add(self.records)
+
+    def test_status(self):
+        """ Check that the need status of a station is found correctly. """
+        assert(self.worked_before.status("JA1ABC", "20m", "CW") == WORKED)
+        assert(self.worked_before.status("JA1ABC", "20m", "FT8") == NEW_MODE)
+        assert(self.worked_before.status("JA1ABC", "20m", "") == WORKED)
+        assert(self.worked_before.status("JA1XYZ", "20m", "CW") == NEW_CALL)
+        assert(self.worked_before.status("JA1ABC", "40m", "CW") == NEW_DXCC_BAND)
+        assert(self.worked_before.status("DL2XYZ", "40m", "CW") == NEW_CALL)
+        assert(self.worked_before.status("DL1ABC", "", "") == WORKED)
+        assert(self.worked_before.spot_status(Spot("W3LPL", 14025.0, "DL1ABC", "", "1234", "", "20m", "CW", 0)) == NEW_DXCC_BAND)
+
+    def test_remove(self):
+        """ Check that a station is only removed from the index once all of its QSOs have been removed. """
+        self.worked_before.remove(self.records[1])
+        assert(self.worked_before.status("JA1ABC", "20m", "SSB") == NEW_MODE)
+        self.worked_before.remove(self.records[0])
+        assert(self.worked_before.status("JA1XYZ", "20m", "CW") == NEW_DXCC_BAND)
+        assert("JA1ABC" not in self.worked_before.calls)
+        assert(len(self.worked_before) == 1)
+
+    def test_load(self):
+        """ Check that the index is rebuilt from the logs in the database. """
+        connection = sqlite.connect(":memory:")
+        connection.row_factory = sqlite.Row
+        connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, call TEXT, band TEXT, mode TEXT, country TEXT)")
+        connection.execute("INSERT INTO test VALUES (NULL, 'G4ABC', '80m', 'CW', 'England')")
+        log = mock.MagicMock(connection=connection)
+        log.name = "test"
+        self.worked_before.load([log])
+        assert(len(self.worked_before) == 1)
+        assert(self.worked_before.status("G4ABC", "80m", "CW") == WORKED)
+        assert(self.worked_before.status("G4XYZ", "80m", "CW") == NEW_CALL)
+        assert(self.worked_before.status("JA1ABC", "20m", "CW") == NEW_DXCC_BAND)  # The previous contents of the index are discarded.
+        connection.close()
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -22,7 +22,22 @@ try:
     import unittest.mock as mock
 except ImportError:
     import mock
-from pyqso.world_map import Maidenhead, WorldMap
+import os
+import tempfile
+import sqlite3 as sqlite
+import numpy
+try:
+    import matplotlib
+    import matplotlib.figure
+    import matplotlib.transforms
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PathCollection
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.textpath import TextPath
+    have_matplotlib = True
+except ImportError:
+    have_matplotlib = False
+from pyqso.world_map import Maidenhead, WorldMap, Point, GridSquareHeatmap
 
 
 class TestMaidenhead(unittest.TestCase):
@@ -49,6 +64,96 @@ class TestMaidenhead(unittest.TestCase):
         gs6 = "IO91gb"
         assert self.maidenhead.gs2ll(gs6) == (51.0625, -1.4583333333333335)
 
+    def test_ll2gs_array(self):
+        """ Check that arrays of latitude-longitude coordinates can correctly be converted to Maidenhead grid squares. """
+        latitudes = [51.0593, 45.02, -33.9]
+        longitudes = [-1.4262, 0.04, 151.2]
+        assert(list(self.maidenhead.ll2gs_array(latitudes, longitudes, subsquare=False)) == ["IO91", "JN05", "QF56"])
+        assert(list(self.maidenhead.ll2gs_array(latitudes, longitudes, subsquare=True)) == [self.maidenhead.ll2gs(latitudes[i], longitudes[i], subsquare=True) for i in range(3)])
+
+    def test_gs2ll_array(self):
+        """ Check that arrays of Maidenhead grid squares can correctly be converted to latitude-longitude coordinates, and that invalid grid squares are ignored. """
+        latitudes, longitudes = self.maidenhead.gs2ll_array(["JN05", "JN05aa", "io91GB", "IO", None, "IO9", "ZZ00"])
+        assert((latitudes[0], longitudes[0]) == (45.5, 1.0))
+        assert((latitudes[1], longitudes[1]) == (45.020833333333336, 0.041666666666666664))
+        assert((latitudes[2], longitudes[2]) == self.maidenhead.gs2ll("IO91gb"))
+        assert((latitudes[3], longitudes[3]) == (55.0, -10.0))
+        assert(all(numpy.isnan(latitudes[4:])) and all(numpy.isnan(longitudes[4:])))
+
+    def test_histogram(self):
+        """ Check that the worked fields, squares and subsquares are counted correctly. """
+        grid_squares = ["IO91gb", "IO91hv", "io91GB", "JN05", None]
+        fields = self.maidenhead.histogram(grid_squares, level="field")
+        assert(fields.shape == (18, 18))
+        assert(fields[14, 8] == 3 and fields[13, 9] == 1 and fields.sum() == 4)
+        squares = self.maidenhead.histogram(grid_squares, level="square")
+        assert(squares.shape == (180, 180))
+        assert(squares[141, 89] == 3)
+        locators, counts = self.maidenhead.histogram(grid_squares, level="subsquare", sparse=True)
+        assert(list(locators) == ["IO91gb", "IO91hv"] and list(counts) == [2, 1])
+        self.assertRaises(ValueError, self.maidenhead.histogram, grid_squares, "continent")
+
+
+class TestGridSquareHeatmap(unittest.TestCase):
+
+    """ The unit tests for the GridSquareHeatmap class. """
+
+    def setUp(self):
+        """ Set up a logbook database and the GridSquareHeatmap object needed for the unit tests. """
+        self.directory = tempfile.mkdtemp()
+        self.logbook_path = os.path.join(self.directory, "logbook.db")
+        self.connection = sqlite.connect(self.logbook_path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE test (id INTEGER PRIMARY KEY AUTOINCREMENT, call TEXT, gridsquare TEXT)")
+            self.connection.executemany("INSERT INTO test (call, gridsquare) VALUES (?, ?)", [("TEST123", "IO91gb"), ("TEST456", "IO91hv"), ("TEST789", None), ("TEST012", "JN05")])
+
+        Logbook = mock.MagicMock()
+        Log = mock.MagicMock()
+        self.logbook = Logbook()
+        l = Log()
+        l.connection = self.connection
+        l.name = "test"
+        self.logbook.logs = [l]
+        self.logbook.path = self.logbook_path
+
+        self.heatmap = GridSquareHeatmap(Maidenhead(), path=os.path.join(self.directory, "heatmap.npz"))
+
+    def tearDown(self):
+        """ Remove the logbook database and the cached counts. """
+        self.connection.close()
+        for f in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, f))
+        os.rmdir(self.directory)
+
+    def test_add_remove(self):
+        """ Check that the counts are updated incrementally. """
+        self.heatmap.add(["IO91gb", "IO91", "JN05"])
+        assert(self.heatmap.squares[141, 89] == 2 and self.heatmap.fields[14, 8] == 2)
+        self.heatmap.remove(["IO91gb", "AA00"])
+        assert(self.heatmap.squares[141, 89] == 1 and self.heatmap.squares.sum() == 2)
+        assert(self.heatmap.squares.min() == 0)
+
+    def test_count(self):
+        """ Check that the counts are cached, and only recomputed when the logbook has been modified. """
+        with mock.patch.object(self.heatmap, "rebuild", wraps=self.heatmap.rebuild) as rebuild:
+            self.heatmap.count(self.logbook)
+            assert(rebuild.call_count == 1)
+            assert(self.heatmap.squares[141, 89] == 2 and self.heatmap.squares.sum() == 3)
+
+            # The cached counts should be used by a new GridSquareHeatmap object.
+            heatmap = GridSquareHeatmap(Maidenhead(), path=self.heatmap.path)
+            assert(heatmap.load(self.logbook_path))
+            assert(numpy.array_equal(heatmap.squares, self.heatmap.squares))
+
+            # Modify the logbook outside of the heatmap, which should invalidate the cache.
+            with self.connection:
+                self.connection.execute("INSERT INTO test (call, gridsquare) VALUES (?, ?)", ("TEST345", "IO91aa"))
+            os.utime(self.logbook_path, ns=(0, 0))
+            assert(not heatmap.load(self.logbook_path))
+            self.heatmap.count(self.logbook)
+            assert(rebuild.call_count == 2)
+            assert(self.heatmap.squares[141, 89] == 3)
+
 
 class TestWorldMap(unittest.TestCase):
 
@@ -59,6 +164,42 @@ class TestWorldMap(unittest.TestCase):
         PyQSO = mock.MagicMock()
         self.world_map = WorldMap(application=PyQSO())
 
+    def test_deferred_canvas(self):
+        """ Check that the drawing canvas and the grid square counts are only set up when the world map is first drawn while it is visible. """
+        assert(self.world_map.canvas is None and self.world_map.heatmap is None)
+        self.world_map.builder.get_object("tools").get_current_page.return_value = 0  # The DX cluster tool is visible instead.
+        with mock.patch.object(self.world_map, "setup_canvas") as setup_canvas:
+            assert(self.world_map.draw())
+            assert(setup_canvas.call_count == 0)
+            self.world_map.count_grid_squares(logbook=mock.MagicMock())
+            self.world_map.update_grid_squares(added=["IO91"])
+        assert(self.world_map.canvas is None and self.world_map.heatmap is None)
+
+    def test_get_label_collection(self):
+        """ Check that the labels are drawn as a single collection placed in data coordinates on a real set of axes (if matplotlib exists), and that the cache of text paths is bounded. """
+        if(have_matplotlib):
+            with mock.patch.multiple("pyqso.world_map", create=True, numpy=numpy, matplotlib=matplotlib, PathCollection=PathCollection, FontProperties=FontProperties, TextPath=TextPath):
+                self.world_map.fig = matplotlib.figure.Figure()
+                FigureCanvasAgg(self.world_map.fig)
+                self.world_map.ax = self.world_map.fig.add_subplot(1, 1, 1)
+                self.world_map.ax.set_xlim(-180, 180)
+                self.world_map.ax.set_ylim(-90, 90)
+                self.world_map.label_path_limit = 2
+
+                collection = self.world_map.get_label_collection(["G4ABC", "W1AW", "IO"], [-1.4, -72.7, -10.0], [51.1, 41.7, 50.0], size=7, offset=(0, 2.5), facecolors="white")
+                assert(collection in self.world_map.ax.collections)
+                assert(collection.get_offset_transform() == self.world_map.ax.transData)
+                assert(len(collection.get_paths()) == 3)
+                assert(collection.get_offsets().tolist() == [[-1.4, 51.1], [-72.7, 41.7], [-10.0, 50.0]])
+                self.world_map.fig.canvas.draw()
+
+                # Only the most recently used text paths are kept.
+                assert(list(self.world_map.label_paths.keys()) == [("W1AW", 7, False, (0, 2.5)), ("IO", 7, False, (0, 2.5))])
+                self.world_map.get_label_collection(["W1AW"], [-72.7], [41.7], size=7, offset=(0, 2.5))
+                assert(list(self.world_map.label_paths.keys()) == [("IO", 7, False, (0, 2.5)), ("W1AW", 7, False, (0, 2.5))])
+        else:
+            pass
+
     def test_get_worked_grid_squares(self):
         """ Check that the worked grid squares are determined correctly. """
         Logbook = mock.MagicMock()
@@ -70,5 +211,28 @@ class TestWorldMap(unittest.TestCase):
         worked_grid_squares = self.world_map.get_worked_grid_squares(logbook=logbook)
         assert worked_grid_squares[14, 8]  # IO square.
 
+    def test_add_points(self):
+        """ Check that many points can be added with only a single re-draw of the map. """
+        with mock.patch.object(self.world_map, "draw") as draw:
+            self.world_map.add_points([Point("TEST%d" % i, 51.0, -1.0+i) for i in range(100)])
+            assert(draw.call_count == 1)
+        assert(len(self.world_map.points) == 100)
+        assert(self.world_map.points[0].color_and_marker == ("y", "o"))
+
+    def test_pinpoint_records(self):
+        """ Check that QSOs are pinpointed offline using their grid square, country or callsign prefix, and that unknown countries are only looked up online once. """
+        records = [{"CALL": "TEST123", "COUNTRY": "England", "GRIDSQUARE": "IO91gb"}, {"CALL": "TEST456", "COUNTRY": "France", "GRIDSQUARE": None}, {"CALL": "JA1ABC", "COUNTRY": None, "GRIDSQUARE": None},
+                   {"CALL": "TEST789", "COUNTRY": "Atlantis", "GRIDSQUARE": None}, {"CALL": "TEST012", "COUNTRY": "Atlantis", "GRIDSQUARE": None}]
+        with mock.patch.object(self.world_map, "draw"), mock.patch.object(self.world_map.geocoder, "lookup_online") as lookup_online:
+            self.world_map.pinpoint_records(records)
+            assert(lookup_online.call_count == 1)
+            assert([p.name for p in self.world_map.points] == ["TEST123", "TEST456", "JA1ABC"])
+            assert((self.world_map.points[1].latitude, self.world_map.points[1].longitude) == (46.2, 2.2))
+
+            # The QSOs waiting on the online lookup are pinpointed once it completes.
+            self.world_map.on_lookup_online("Atlantis", (31.0, -24.0))
+            assert([p.name for p in self.world_map.points][3:] == ["TEST789", "TEST012"])
+            assert(self.world_map.pending_lookups == {})
+
 if(__name__ == '__main__'):
     unittest.main()